@@ -2,6 +2,8 @@
 ASGI config for health_environment project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Served this way, the async SPARQL endpoints under /api/async/ keep many
+Fuseki requests in flight on a single event loop.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -67,6 +68,70 @@ DATABASES = {
 # Fuseki Configuration
 FUSEKI_ENDPOINT = os.getenv('FUSEKI_ENDPOINT', 'http://localhost:3030/health_env/sparql')
 FUSEKI_UPDATE_ENDPOINT = os.getenv('FUSEKI_UPDATE_ENDPOINT', 'http://localhost:3030/health_env/update')
+# Graph Store protocol endpoint used by the bulk loader (populate_fuseki.py)
+FUSEKI_DATA_ENDPOINT = os.getenv('FUSEKI_DATA_ENDPOINT', 'http://localhost:3030/health_env/data')
+FUSEKI_POOL_SIZE = int(os.getenv('FUSEKI_POOL_SIZE', '10'))
+FUSEKI_CONNECT_TIMEOUT = float(os.getenv('FUSEKI_CONNECT_TIMEOUT', '3'))
+FUSEKI_READ_TIMEOUT = float(os.getenv('FUSEKI_READ_TIMEOUT', '30'))
+# 'fuseki' queries the remote endpoints above, 'rdflib' an in-process graph
+# built from the OWL file and the database (cached in RDFLIB_SNAPSHOT_PATH)
+SPARQL_BACKEND = os.getenv('SPARQL_BACKEND', 'fuseki')
+RDFLIB_ONTOLOGY_PATH = BASE_DIR / 'OWL File' / 'ontology_health_environment.owl'
+RDFLIB_SNAPSHOT_PATH = os.getenv('RDFLIB_SNAPSHOT_PATH', str(BASE_DIR / 'rdf_snapshot.nt'))
+# Upper bound on concurrent Fuseki requests per event loop (async endpoints)
+FUSEKI_ASYNC_MAX_CONCURRENCY = int(os.getenv('FUSEKI_ASYNC_MAX_CONCURRENCY', '50'))
+
+# SPARQL result cache. The dataset generation lives in a cache shared by all
+# processes (web workers and populate_fuseki.py) so a reload invalidates everyone.
+SPARQL_CACHE = {
+    'MAX_ENTRIES': int(os.getenv('SPARQL_CACHE_MAX_ENTRIES', '512')),
+    'TTL': int(os.getenv('SPARQL_CACHE_TTL', '300')),
+    'GENERATION_CACHE': 'sparql',
+}
+
+# Table versions behind the API's ETags (see ontology_app/conditional_get.py),
+# kept in a cache shared by all processes like the dataset generation
+TABLE_VERSIONS_CACHE = 'sparql'
+
+# SPARQL calls slower than this (ms) are logged with their full text by the
+# 'ontology_app.slow_queries' logger; the last ones are kept for the metrics endpoint
+SPARQL_SLOW_QUERY_MS = float(os.getenv('SPARQL_SLOW_QUERY_MS', '500'))
+SPARQL_SLOW_QUERY_LOG_SIZE = 50
+
+# Incremental Django -> Fuseki sync (manage.py sync_fuseki): capture changes in
+# the RDF outbox, rows applied per update request, idle wait between polls (s)
+RDF_SYNC = {
+    'ENABLED': os.getenv('RDF_SYNC_ENABLED', 'True') == 'True',
+    'BATCH_SIZE': int(os.getenv('RDF_SYNC_BATCH_SIZE', '500')),
+    'INTERVAL': float(os.getenv('RDF_SYNC_INTERVAL', '1')),
+}
+
+# Full reloads write a new named graph and switch a pointer to it: versions kept,
+# seconds other hosts may keep using a cached pointer, max lifetime of a reload flag
+SPARQL_GRAPH_VERSIONS = {
+    'KEEP': int(os.getenv('SPARQL_GRAPH_VERSIONS_KEEP', '2')),
+    'POINTER_TTL': 30,
+    'RELOAD_TIMEOUT': 6 * 3600,
+}
+
+# PostgreSQL / Fuseki routing: EWMA smoothing, failures before the circuit opens,
+# seconds before retrying an open backend, and how often the slower one is probed
+QUERY_ROUTER = {
+    'alpha': 0.2,
+    'failure_threshold': 3,
+    'cooldown': 30,
+    'probe_every': 20,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sparql': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SPARQL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'health_env_sparql')),
+    },
+}
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -88,8 +153,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOW_ALL_ORIGINS = True
 
 REST_FRAMEWORK = {
+    # Chosen by Accept: orjson for application/json (the default), application/msgpack, HTML
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'ontology_app.renderers.ORJSONRenderer',
+        'ontology_app.renderers.MessagePackRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
-    ]
-}
\ No newline at end of file
+    ],
+    # Keyset pagination: ?page_size= up to API_MAX_PAGE_SIZE, next/previous cursors, no COUNT(*)
+    'DEFAULT_PAGINATION_CLASS': 'ontology_app.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', '50')),
+}
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', '1000'))
\ No newline at end of file
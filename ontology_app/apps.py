@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class OntologyAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ontology_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connects the RDF outbox handlers)
@@ -0,0 +1,156 @@
+import asyncio
+import inspect
+import logging
+import time
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .conditional_get import mark_uncacheable
+from .sparql_cache import get_dataset_generation
+from .graph_versions import get_current_graph
+from .sparql_client import SPARQL_RESULTS_JSON, get_client
+from .sparql_metrics import caller_name, get_metrics, result_rows
+from .sparql_queries import OntologyQuery
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSparqlClient:
+    """
+    asyncio SPARQL client for ASGI deployments. One event loop keeps many
+    Fuseki requests in flight; a semaphore caps how many run at once so a
+    burst of requests cannot overwhelm the triple store.
+    """
+
+    def __init__(self, query_endpoint, max_concurrency=50, pool_size=10,
+                 connect_timeout=3.0, read_timeout=30.0):
+        self.query_endpoint = query_endpoint
+        self.max_concurrency = max_concurrency
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max(pool_size, max_concurrency),
+                                max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._counters = {'queries': 0, 'errors': 0, 'in_flight': 0, 'peak_in_flight': 0, 'waiting': 0}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.FUSEKI_ENDPOINT,
+            max_concurrency=settings.FUSEKI_ASYNC_MAX_CONCURRENCY,
+            pool_size=settings.FUSEKI_POOL_SIZE,
+            connect_timeout=settings.FUSEKI_CONNECT_TIMEOUT,
+            read_timeout=settings.FUSEKI_READ_TIMEOUT,
+        )
+
+    async def query(self, query, name=None, default_graph=None):
+        """Run a SELECT/ASK query and return the decoded SPARQL JSON results"""
+        metrics = get_metrics()
+        counters = self._counters
+        counters['queries'] += 1
+        counters['waiting'] += 1
+        async with self._semaphore:
+            counters['waiting'] -= 1
+            counters['in_flight'] += 1
+            counters['peak_in_flight'] = max(counters['peak_in_flight'], counters['in_flight'])
+            # Time spent waiting on the semaphore is not the query's latency
+            started = time.perf_counter()
+            try:
+                response = await self._http.post(
+                    self.query_endpoint,
+                    data={'query': query},
+                    headers={'Accept': SPARQL_RESULTS_JSON},
+                    params={'default-graph-uri': default_graph} if default_graph else None,
+                )
+                response.raise_for_status()
+                results = response.json()
+            except Exception as e:
+                counters['errors'] += 1
+                metrics.record(name, query, time.perf_counter() - started, error=e)
+                raise
+            finally:
+                counters['in_flight'] -= 1
+        metrics.record(name, query, time.perf_counter() - started,
+                       rows=result_rows(results), response_bytes=len(response.content))
+        return results
+
+    def stats(self):
+        return {'max_concurrency': self.max_concurrency, **self._counters}
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+class AsyncLocalGraphClient:
+    """Async facade over the in-process rdflib backend; queries take microseconds so they run inline"""
+
+    def __init__(self, client):
+        self._client = client
+
+    async def query(self, query, name=None, default_graph=None):
+        return self._client.query(query, name, default_graph)
+
+    def stats(self):
+        return self._client.stats()
+
+
+# httpx clients and asyncio semaphores are bound to the loop that created them
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the async SPARQL client of the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        if settings.SPARQL_BACKEND == 'rdflib':
+            client = AsyncLocalGraphClient(get_client())
+        else:
+            client = AsyncSparqlClient.from_settings()
+        _clients[loop] = client
+    return client
+
+
+class AsyncOntologyQuery(OntologyQuery):
+    """
+    OntologyQuery whose query methods return awaitables.
+    Must be instantiated inside a running event loop.
+    """
+
+    def __init__(self, raise_errors=False):
+        super().__init__(raise_errors)
+        self.client = get_async_client()
+
+    def execute_query(self, query, name=None):
+        """Execute SPARQL query without blocking the event loop; returns an awaitable"""
+        # Resolved now: once the coroutine runs, the calling method has returned
+        return self._execute(query, name or caller_name())
+
+    async def _execute(self, query, name):
+        # Both read the shared file cache, and the pointer may need a Fuseki
+        # round trip on a miss: run them in a worker thread, off the event loop
+        generation = await sync_to_async(get_dataset_generation, thread_sensitive=False)()
+        results = self.cache.get(query, generation)
+        if results is not None:
+            get_metrics().record_cache_hit(name)
+            return results
+        try:
+            graph = await sync_to_async(get_current_graph, thread_sensitive=False)()
+            results = await self.client.query(query, name, graph)
+        except Exception as e:
+            logger.error(f"SPARQL query error: {str(e)}")
+            if self.raise_errors:
+                raise
+            mark_uncacheable()
+            return {"results": {"bindings": []}}
+        self.cache.set(query, results, generation)
+        return results
+
+    async def _transform(self, results, func):
+        if inspect.isawaitable(results):
+            results = await results
+        return func(results)
@@ -0,0 +1,87 @@
+"""
+Async variants of the SPARQL-backed endpoints.
+
+Served under /api/async/ by health_environment.asgi; each request awaits
+Fuseki instead of holding a worker thread for the whole round trip.
+"""
+from functools import wraps
+
+from django.http import JsonResponse, HttpResponseNotAllowed
+
+from .async_sparql import AsyncOntologyQuery, get_async_client
+from .conditional_get import SPARQL, conditional_get
+from .sparql_columns import shape_results
+from .sparql_queries import alternatives_params
+
+
+def _get_only(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET'])
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@_get_only
+@conditional_get(SPARQL)
+async def ontology_query(request):
+    """Execute custom SPARQL queries"""
+    query_type = request.GET.get('type', 'patients')
+    ontology = AsyncOntologyQuery()
+
+    if query_type == 'patients':
+        results = await ontology.get_all_patients()
+    elif query_type == 'eco_traitements':
+        score_max = float(request.GET.get('score_max', 5.0))
+        results = await ontology.get_traitements_eco_responsables(score_max)
+    elif query_type == 'medecins_specialite':
+        specialite = request.GET.get('specialite', 'Generaliste')
+        results = await ontology.get_medecins_by_specialite(specialite)
+    else:
+        return JsonResponse({"error": "Invalid query type"}, status=400)
+
+    return JsonResponse(shape_results(results, request.GET.get('shape')))
+
+
+@_get_only
+@conditional_get(SPARQL)
+async def semantic_alternatives(request):
+    """Treatment alternatives for a disease (async)"""
+    maladie_nom = request.GET.get('maladie', 'Hypertension Artérielle')
+    ontology = AsyncOntologyQuery()
+    if request.GET.get('mode') == 'linear':
+        try:
+            top_k, min_diff = alternatives_params(request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        alternatives = await ontology.get_treatment_alternatives_linear(maladie_nom, top_k=top_k, min_diff=min_diff)
+    else:
+        alternatives = await ontology.get_treatment_alternatives_by_disease(maladie_nom)
+    return JsonResponse(shape_results(alternatives, request.GET.get('shape')))
+
+
+@_get_only
+@conditional_get(SPARQL)
+async def semantic_recommendation(request):
+    """Eco-efficiency treatment recommendations (async)"""
+    maladie_nom = request.GET.get('maladie', 'Hypertension Artérielle')
+    max_score = float(request.GET.get('max_score', 10))
+    recommendations = await AsyncOntologyQuery().get_best_treatment_recommendation(maladie_nom, max_score)
+    return JsonResponse(shape_results(recommendations, request.GET.get('shape')))
+
+
+@_get_only
+@conditional_get(SPARQL)
+async def semantic_eco_doctors(request):
+    """Experienced doctors prescribing eco-friendly treatments (async)"""
+    min_experience = int(request.GET.get('min_experience', 5))
+    max_impact = float(request.GET.get('max_impact', 5))
+    doctors = await AsyncOntologyQuery().get_eco_conscious_doctors(min_experience, max_impact)
+    return JsonResponse(shape_results(doctors, request.GET.get('shape')))
+
+
+@_get_only
+async def async_client_stats(request):
+    """Concurrency counters of the async SPARQL client on this event loop"""
+    return JsonResponse(get_async_client().stats())
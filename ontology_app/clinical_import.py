@@ -0,0 +1,461 @@
+"""
+Bulk import of clinical extracts (CSV or Parquet) from hospital systems.
+
+The pipeline has three stages:
+
+1. Rows are streamed from the file in chunks and validated against the
+   model fields themselves (Field.clean: types, max_length, choices,
+   validators such as efficacite 0-100, null/blank).
+2. Valid rows are loaded into a temporary staging table, with COPY on
+   PostgreSQL (executemany elsewhere).
+3. In one transaction, references given as natural keys (numero de
+   sécurité sociale, numéro d'ordre, nom de maladie, ...) are resolved,
+   rows breaking a constraint the database would enforce (unknown
+   reference, duplicate key in the file, unique value already taken)
+   are rejected, and the rest is merged with one UPDATE ... FROM and one
+   INSERT ... SELECT per table.
+
+Diagnostics and prescriptions are keyed on their references and date, so
+importing the same extract twice updates the rows instead of duplicating
+them. A row without a date gets the import time, so it is new at every
+run; two such rows with the same references in one file share that key,
+and the second is rejected as a duplicate.
+
+Rejected rows are written to a CSV file with their line number and the
+reason. Merged resources are queued in the RDF outbox when RDF_SYNC is
+enabled, set-based, since the merge itself sends no model signals.
+"""
+import csv
+import io
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .conditional_get import bump_all_table_versions
+from .dashboard_stats import reconcile_stats
+from .models import Patient, Medecin, Maladie, Traitement, Diagnostic, Prescription, RdfOutbox
+
+DEFAULT_CHUNK_SIZE = 10000
+FORMATS = ('csv', 'parquet')
+TRUE_STRINGS = {'1', 't', 'true', 'y', 'yes', 'o', 'oui'}
+FALSE_STRINGS = {'0', 'f', 'false', 'n', 'no', 'non'}
+
+
+class ImportSpec:
+    """
+    How one kind of extract maps to a model.
+
+    columns: file columns, each validated with a model field (the target
+    model's, or the referenced model's for natural keys)
+    lookups: (staging column to fill, model, {model column: staging column})
+    resolved in order; a row whose lookup finds nothing is rejected
+    key: target columns identifying an existing row to update; rows are
+    only inserted when empty
+    sync: (RDF outbox kind, staging column holding the object id)
+    """
+
+    def __init__(self, model, columns, lookups=(), key=(), sync=()):
+        self.model = model
+        self.columns = columns
+        self.lookups = lookups
+        self.key = key
+        self.sync = sync
+
+    def field(self, column):
+        model = self.columns[column]
+        return model._meta.get_field(column)
+
+    @property
+    def target_columns(self):
+        """Model columns written by the merge, in staging column order"""
+        names = [column for column, model in self.columns.items() if model is self.model]
+        names += [target for target, _, _ in self.lookups if target != 'id'
+                  and any(f.column == target for f in self.model._meta.concrete_fields)]
+        # Timestamps filled by Django on save() are filled by the merge
+        names += [f.column for f in self.model._meta.concrete_fields
+                  if _is_auto_timestamp(f) and f.column not in names]
+        return names
+
+
+SPECS = {
+    'patients': ImportSpec(
+        Patient,
+        columns={name: Patient for name in (
+            'numero_securite_sociale', 'nom', 'prenom', 'date_naissance', 'sexe', 'email',
+            'telephone', 'adresse', 'imc', 'groupe_sanguin', 'allergies',
+        )},
+        key=('numero_securite_sociale',),
+        lookups=[('id', Patient, {'numero_securite_sociale': 'numero_securite_sociale'})],
+        sync=[('Patient', 'id')],
+    ),
+    'traitements': ImportSpec(
+        Traitement,
+        columns={
+            **{name: Traitement for name in (
+                'nom_traitement', 'type_traitement', 'cout', 'duree', 'efficacite',
+                'date_debut', 'date_fin', 'description',
+            )},
+            'nom_maladie': Maladie,
+        },
+        lookups=[
+            ('maladie_id', Maladie, {'nom_maladie': 'nom_maladie'}),
+            ('id', Traitement, {'nom_traitement': 'nom_traitement', 'maladie_id': 'maladie_id'}),
+        ],
+        key=('nom_traitement', 'maladie_id'),
+        sync=[('Traitement', 'id')],
+    ),
+    'diagnostics': ImportSpec(
+        Diagnostic,
+        columns={
+            'numero_securite_sociale': Patient,
+            'numero_ordre': Medecin,
+            'nom_maladie': Maladie,
+            'date_diagnostic': Diagnostic,
+            'notes': Diagnostic,
+        },
+        lookups=[
+            ('patient_id', Patient, {'numero_securite_sociale': 'numero_securite_sociale'}),
+            ('medecin_id', Medecin, {'numero_ordre': 'numero_ordre'}),
+            ('maladie_id', Maladie, {'nom_maladie': 'nom_maladie'}),
+        ],
+        key=('patient_id', 'medecin_id', 'maladie_id', 'date_diagnostic'),
+        sync=[('diagnostiquePour', 'patient_id'), ('prescrit', 'medecin_id')],
+    ),
+    'prescriptions': ImportSpec(
+        Prescription,
+        columns={
+            'numero_securite_sociale': Patient,
+            'numero_ordre': Medecin,
+            'nom_maladie': Maladie,
+            'nom_traitement': Traitement,
+            'date_prescription': Prescription,
+            'posologie': Prescription,
+            'duree_prescription': Prescription,
+            'renouvellement': Prescription,
+        },
+        # The prescription belongs to the latest diagnostic of that patient, disease and doctor
+        lookups=[
+            ('patient_id', Patient, {'numero_securite_sociale': 'numero_securite_sociale'}),
+            ('medecin_id', Medecin, {'numero_ordre': 'numero_ordre'}),
+            ('maladie_id', Maladie, {'nom_maladie': 'nom_maladie'}),
+            ('diagnostic_id', Diagnostic, {
+                'patient_id': 'patient_id', 'medecin_id': 'medecin_id', 'maladie_id': 'maladie_id'}),
+            ('traitement_id', Traitement, {'nom_traitement': 'nom_traitement', 'maladie_id': 'maladie_id'}),
+        ],
+        key=('diagnostic_id', 'traitement_id', 'date_prescription'),
+        sync=[('prescrit', 'medecin_id')],
+    ),
+}
+
+
+def _is_auto_timestamp(field):
+    return getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+
+
+def _q(name):
+    return connection.ops.quote_name(name)
+
+
+def _order_by(model, name):
+    """SQL for one Meta.ordering entry of `model` on the alias t"""
+    column = _q(model._meta.get_field(name.lstrip('-')).column)
+    return f't.{column} DESC' if name.startswith('-') else f't.{column}'
+
+
+def read_csv(path, chunk_size, delimiter=','):
+    """Yield lists of (line number, {column: string}) from a CSV file with a header"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        chunk = []
+        for row in reader:
+            # Line of the row in the file, counting the header
+            chunk.append((reader.line_num, row))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def read_parquet(path, chunk_size):
+    """Yield lists of (row number, {column: value}) from a Parquet file, one record batch at a time"""
+    import pyarrow.parquet as pq
+
+    line = 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        rows = batch.to_pylist()
+        yield [(line + i + 1, row) for i, row in enumerate(rows)]
+        line += len(rows)
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.invalid = 0
+        self.rejected = 0
+        self.inserted = 0
+        self.updated = 0
+        self.phases = {}
+        self.started = time.perf_counter()
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    def to_dict(self):
+        seconds = self.seconds
+        return {
+            'read': self.read,
+            'invalid': self.invalid,
+            'rejected': self.rejected,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'phases': {phase: round(value, 3) for phase, value in self.phases.items()},
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.read / seconds, 1) if seconds else 0.0,
+        }
+
+
+class ClinicalImporter:
+    """
+    Imports one extract into the model of SPECS[kind].
+
+    rejects: path of the CSV file receiving invalid and rejected rows
+    """
+
+    def __init__(self, kind, rejects, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        if kind not in SPECS:
+            raise ValueError(f"kind must be one of {list(SPECS)}")
+        self.kind = kind
+        self.spec = SPECS[kind]
+        self.rejects_path = rejects
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.staging = f'import_{self.spec.model._meta.model_name}'
+        self.fields = [(column, self.spec.field(column)) for column in self.spec.columns]
+        self.now = timezone.now()
+
+    # -- validation ----------------------------------------------------------
+
+    def _clean(self, field, value):
+        if isinstance(value, str):
+            value = value.strip()
+            if isinstance(field, models.BooleanField) and value.lower() in TRUE_STRINGS | FALSE_STRINGS:
+                value = value.lower() in TRUE_STRINGS
+        if value in ('', None):
+            if _is_auto_timestamp(field):
+                return self.now
+            if field.null:
+                return None
+            if field.has_default():
+                return field.get_default()
+            value = ''
+        value = field.clean(value, None)
+        if isinstance(field, models.DateTimeField) and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def validate(self, row):
+        """(values in staging column order, None) or (None, reason)"""
+        values, errors = [], []
+        for column, field in self.fields:
+            try:
+                values.append(self._clean(field, row.get(column)))
+            except ValidationError as e:
+                errors.append(f"{column}: {' '.join(e.messages)}")
+        return (None, '; '.join(errors)) if errors else (values, None)
+
+    # -- staging -------------------------------------------------------------
+
+    def _staging_columns(self):
+        """[(name, SQL type)] of the staging table"""
+        columns = [('line', 'bigint')]
+        columns += [(name, self.spec.field(name).db_type(connection)) for name in self.spec.columns]
+        columns += [(target, 'bigint') for target, _, _ in self.spec.lookups]
+        return columns
+
+    def create_staging(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {_q(self.staging)}')
+        definition = ', '.join(f'{_q(name)} {sql_type}' for name, sql_type in self._staging_columns())
+        cursor.execute(f'CREATE TEMPORARY TABLE {_q(self.staging)} ({definition})')
+
+    def _db_values(self, values):
+        return [field.get_db_prep_save(value, connection) for (_, field), value in zip(self.fields, values)]
+
+    def copy_rows(self, cursor, rows):
+        """Append validated (line, values) rows to the staging table"""
+        columns = ['line'] + list(self.spec.columns)
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            for line, values in rows:
+                buffer.write('\t'.join(_copy_text(value) for value in [line] + self._db_values(values)))
+                buffer.write('\n')
+            buffer.seek(0)
+            column_list = ', '.join(_q(column) for column in columns)
+            cursor.copy_expert(f'COPY {_q(self.staging)} ({column_list}) FROM STDIN', buffer)
+        else:
+            placeholders = ', '.join(['%s'] * len(columns))
+            cursor.executemany(
+                f"INSERT INTO {_q(self.staging)} ({', '.join(_q(c) for c in columns)}) VALUES ({placeholders})",
+                [[line] + self._db_values(values) for line, values in rows],
+            )
+
+    # -- merge ---------------------------------------------------------------
+
+    def _resolve(self, cursor, target, model, match):
+        """
+        Fill a staging column with the id of the matching `model` row, NULL
+        if there is none. Among several matches the first in the model's
+        ordering wins (the latest diagnostic), then the highest id.
+        """
+        condition = ' AND '.join(f't.{_q(column)} = s.{_q(source)}' for column, source in match.items())
+        order = [_order_by(model, name) for name in model._meta.ordering] + ['t.id DESC']
+        cursor.execute(
+            f'UPDATE {_q(self.staging)} AS s SET {_q(target)} = '
+            f'(SELECT t.id FROM {_q(model._meta.db_table)} t WHERE {condition} '
+            f'ORDER BY {", ".join(order)} LIMIT 1)'
+        )
+
+    def _reject(self, cursor, writer, condition, reason, stats):
+        """Move the staging rows matching a SQL condition on `s` to the rejects file"""
+        staging = _q(self.staging)
+        columns = ', '.join(f's.{_q(c)}' for c in ['line'] + list(self.spec.columns))
+        cursor.execute(f'SELECT {columns} FROM {staging} s WHERE {condition} ORDER BY s.line')
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                writer.writerow([row[0], reason] + ['' if value is None else value for value in row[1:]])
+            stats.rejected += len(rows)
+        cursor.execute(f'DELETE FROM {staging} AS s WHERE {condition}')
+
+    def merge(self, cursor, writer, stats):
+        spec = self.spec
+        staging = _q(self.staging)
+        table = _q(spec.model._meta.db_table)
+        staged = dict(self._staging_columns())
+        key = [_q(column) for column in spec.key]
+
+        unique = [f.column for f in spec.model._meta.concrete_fields
+                  if f.unique and not f.primary_key and f.column in spec.columns and f.column not in spec.key]
+        # Key, lookup and unique columns are searched once per staging row
+        searched = dict.fromkeys(
+            list(spec.key) + [c for _, _, match in spec.lookups for c in match.values()] + unique
+        )
+        for i, column in enumerate(searched):
+            cursor.execute(f'CREATE INDEX {_q(f"{self.staging}_{i}")} ON {staging} ({_q(column)})')
+        cursor.execute(f'ANALYZE {staging}')
+
+        for target, model, match in spec.lookups:
+            # The row's own id is only known after the merge
+            if target != 'id':
+                self._resolve(cursor, target, model, match)
+                self._reject(cursor, writer, f's.{_q(target)} IS NULL',
+                             f"unknown {model._meta.verbose_name}: {', '.join(match.values())}", stats)
+
+        same_row = ' AND '.join(f't.{k} = s.{k}' for k in key)
+        if key:
+            self._reject(cursor, writer,
+                         f"EXISTS (SELECT 1 FROM {staging} t WHERE {same_row} AND t.line < s.line)",
+                         f"duplicate {', '.join(spec.key)} in file", stats)
+
+        # Unique values (email, ...) must not be taken by another row of the file or of the table
+        for name in unique:
+            column = _q(name)
+            other_row = f'NOT ({same_row})' if key else '1 = 1'
+            self._reject(cursor, writer, (
+                f'EXISTS (SELECT 1 FROM {staging} t WHERE t.{column} = s.{column} AND t.line < s.line) OR '
+                f'EXISTS (SELECT 1 FROM {table} t WHERE t.{column} = s.{column} AND {other_row})'
+            ), f"{name} already used", stats)
+
+        # Auto timestamps missing from the file get the import time
+        columns = spec.target_columns
+        if key:
+            updated = [c for c in columns if c not in spec.key and not self._auto_now_add(c)]
+            assignments = ', '.join(f'{_q(c)} = s.{_q(c)}' if c in staged else f'{_q(c)} = %s' for c in updated)
+            cursor.execute(
+                f"UPDATE {table} SET {assignments} FROM {staging} s "
+                f"WHERE {' AND '.join(f'{table}.{k} = s.{k}' for k in key)}",
+                [self.now for c in updated if c not in staged],
+            )
+            stats.updated += cursor.rowcount
+            where = f' WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {same_row})'
+        else:
+            where = ''
+        select = ', '.join(f's.{_q(c)}' if c in staged else '%s' for c in columns)
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(_q(c) for c in columns)}) SELECT {select} FROM {staging} s{where}",
+            [self.now for c in columns if c not in staged],
+        )
+        stats.inserted += cursor.rowcount
+
+        for target, model, match in spec.lookups:
+            if target == 'id':
+                self._resolve(cursor, target, model, match)
+        if settings.RDF_SYNC['ENABLED']:
+            self.enqueue(cursor)
+
+    def _auto_now_add(self, column):
+        field = next(f for f in self.spec.model._meta.concrete_fields if f.column == column)
+        return getattr(field, 'auto_now_add', False)
+
+    def enqueue(self, cursor):
+        """Queue every merged resource for sync_fuseki, one INSERT ... SELECT per kind"""
+        outbox = _q(RdfOutbox._meta.db_table)
+        for kind, column in self.spec.sync:
+            cursor.execute(
+                f'INSERT INTO {outbox} (kind, object_id, operation, created_at) '
+                f'SELECT DISTINCT %s, {_q(column)}, %s, %s FROM {_q(self.staging)} WHERE {_q(column)} IS NOT NULL',
+                [kind, 'save', self.now],
+            )
+
+    # -- driver --------------------------------------------------------------
+
+    def run(self, chunks):
+        """Import an iterable of row chunks (see read_csv / read_parquet); returns ImportStats"""
+        stats = ImportStats()
+        with open(self.rejects_path, 'w', newline='', encoding='utf-8') as rejects, connection.cursor() as cursor:
+            writer = csv.writer(rejects)
+            writer.writerow(['line', 'reason'] + list(self.spec.columns))
+            self.create_staging(cursor)
+            try:
+                started = time.perf_counter()
+                for chunk in chunks:
+                    valid = []
+                    for line, row in chunk:
+                        values, reason = self.validate(row)
+                        if reason:
+                            writer.writerow([line, reason] + [row.get(column, '') for column in self.spec.columns])
+                            stats.invalid += 1
+                        else:
+                            valid.append((line, values))
+                    if valid:
+                        self.copy_rows(cursor, valid)
+                    stats.read += len(chunk)
+                    if self.progress:
+                        self.progress('staging', stats)
+                stats.phases['staging'] = time.perf_counter() - started
+
+                started = time.perf_counter()
+                with transaction.atomic():
+                    self.merge(cursor, writer, stats)
+                    reconcile_stats()
+                    bump_all_table_versions()
+                stats.phases['merge'] = time.perf_counter() - started
+            finally:
+                cursor.execute(f'DROP TABLE IF EXISTS {_q(self.staging)}')
+        return stats
+
+
+def _copy_text(value):
+    """A value in the COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
@@ -0,0 +1,192 @@
+"""
+Conditional GET (ETag / Last-Modified) for the read endpoints.
+
+Each endpoint declares the sources its response is built from: models,
+whose tables carry a version in the shared cache, and/or SPARQL, the
+triple store's dataset generation (see sparql_cache). The ETag is a hash
+of the request path, its Accept header and those versions, so answering
+If-None-Match / If-Modified-Since with a 304 costs a few cache reads and
+never reaches the database or Fuseki.
+
+Table versions move when a change commits: the signal handlers in
+signals.py cover save, delete and many-to-many changes, and the bulk paths
+(synthetic data, clinical import, reset, snapshot restore) call
+bump_all_table_versions(). A version is a fresh random token rather than
+an incremented integer because incr() on the file cache is not atomic and
+two workers could hand out the same number for different data.
+
+A response built from a fallback (OntologyQuery returns no rows when
+Fuseki fails) is sent without validators, see mark_uncacheable().
+"""
+import asyncio
+import hashlib
+import time
+import uuid
+from contextvars import ContextVar
+from functools import wraps
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .sparql_cache import get_dataset_generation, get_dataset_modified
+
+VERSION_KEY = 'table_version:{}'
+# Source marker for responses read from the triple store
+SPARQL = 'sparql'
+SAFE_METHODS = ('GET', 'HEAD')
+
+# Mutable so that asyncio tasks spawned by the view, which copy the context, still reach it
+_uncacheable = ContextVar('conditional_get_uncacheable', default=None)
+
+
+def _store():
+    return caches[settings.TABLE_VERSIONS_CACHE]
+
+
+def bump_table_versions(*models):
+    """Give the tables of `models` a new version once the current transaction commits"""
+    keys = {VERSION_KEY.format(model._meta.db_table) for model in models}
+
+    def bump():
+        now = time.time()
+        _store().set_many({key: (uuid.uuid4().hex, now) for key in keys}, timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def bump_all_table_versions():
+    bump_table_versions(*apps.get_app_config('ontology_app').get_models(include_auto_created=True))
+
+
+def table_versions(models):
+    """{table: (version, modified)}; a table never seen yet gets a version now"""
+    store = _store()
+    keys = {VERSION_KEY.format(model._meta.db_table): model._meta.db_table for model in models}
+    versions = store.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        store.add(key, (uuid.uuid4().hex, time.time()), timeout=None)
+        versions[key] = store.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def serializer_models(serializer_class):
+    """The model of `serializer_class` and every model its eager-loaded relations read"""
+    model = serializer_class.Meta.model
+    models = {model}
+    for path in (*serializer_class.select_related_fields, *serializer_class.prefetch_related_fields):
+        current = model
+        for name in path.split('__'):
+            field = current._meta.get_field(name)
+            if field.many_to_many:
+                # Forward fields reach the link table through remote_field, reverse relations directly
+                models.add(getattr(field, 'through', None) or field.remote_field.through)
+            current = field.related_model
+            models.add(current)
+    return tuple(models)
+
+
+def validators(request, sources):
+    """(strong ETag, Last-Modified timestamp) of a GET of `request` built from `sources`"""
+    models = [source for source in sources if source != SPARQL]
+    versions = sorted(table_versions(models).items())
+    modified = [stamp for _, (_, stamp) in versions]
+    if SPARQL in sources:
+        versions.append((SPARQL, get_dataset_generation()))
+        modified.append(get_dataset_modified())
+    digest = hashlib.sha1(repr((
+        request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), versions,
+    )).encode()).hexdigest()
+    return quote_etag(digest), int(max(modified)) if modified else None
+
+
+def mark_uncacheable():
+    """The response being built holds a fallback, not the data its sources describe"""
+    flags = _uncacheable.get()
+    if flags is not None:
+        flags.append(True)
+
+
+def _not_modified(request, sources):
+    """A 304 (or 412) response when the client's copy is current, plus the validators"""
+    etag, last_modified = validators(request, sources)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        # A 304 repeats the validators and caching headers the 200 would send (RFC 9110 15.4.5)
+        _add_validators(response, etag, last_modified, [])
+    return response, etag, last_modified
+
+
+def _add_validators(response, etag, last_modified, flags):
+    # Only a successful representation can be revalidated
+    if response.status_code in (200, 304) and not flags:
+        response.headers.setdefault('ETag', etag)
+        if last_modified is not None:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+        # Browsers keep the copy but ask before each reuse; shared caches keep nothing
+        patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def _respond(view, request, args, kwargs, etag, last_modified):
+    flags = []
+    token = _uncacheable.set(flags)
+    try:
+        response = view(request, *args, **kwargs)
+    finally:
+        _uncacheable.reset(token)
+    return _add_validators(response, etag, last_modified, flags)
+
+
+def conditional_get(*sources):
+    """Decorator answering GET/HEAD with 304 when `sources` have not changed since the client's copy"""
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method not in SAFE_METHODS:
+                    return await view(request, *args, **kwargs)
+                response, etag, last_modified = _not_modified(request, sources)
+                if response is None:
+                    flags = []
+                    token = _uncacheable.set(flags)
+                    try:
+                        response = await view(request, *args, **kwargs)
+                    finally:
+                        _uncacheable.reset(token)
+                    _add_validators(response, etag, last_modified, flags)
+                return response
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method not in SAFE_METHODS:
+                    return view(request, *args, **kwargs)
+                response, etag, last_modified = _not_modified(request, sources)
+                if response is None:
+                    response = _respond(view, request, args, kwargs, etag, last_modified)
+                return response
+        return wrapper
+    return decorator
+
+
+class ConditionalGetMixin:
+    """
+    Conditional GET for a ViewSet. The sources default to the models of the
+    serializer; an @action reading something else passes version_sources=.
+    """
+    version_sources = None
+
+    def get_version_sources(self):
+        return self.version_sources or serializer_models(self.serializer_class)
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        response, etag, last_modified = _not_modified(request, self.get_version_sources())
+        if response is None:
+            response = _respond(super().dispatch, request, args, kwargs, etag, last_modified)
+        return response
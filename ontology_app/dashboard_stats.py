@@ -0,0 +1,110 @@
+"""
+Running aggregates behind /api/stats/.
+
+The dashboard used to issue one COUNT(*) or AVG per table on every page
+load. DashboardCounter rows now hold those values: the signal handlers in
+signals.py add +1 / -1 (or a carbon score delta) with a single UPDATE in
+the transaction of the change, and current_stats() reads the handful of
+rows back in one query.
+
+Bulk paths that bypass signals (bulk_create, the clinical importer,
+snapshot restore, TRUNCATE) call reconcile_stats(), which recomputes
+every counter from the tables in one statement. `manage.py
+reconcile_stats` does the same on a schedule and reports any drift.
+"""
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (
+    Etablissement, Patient, Medecin, Maladie, ImpactEnvironnemental,
+    Traitement, Examen, Diagnostic, Prescription, DashboardCounter,
+)
+
+# Treatments at or below this carbon score count as eco-friendly
+ECO_SCORE_MAX = Decimal(5)
+CENT = Decimal('0.01')
+
+# Counter name -> model whose rows it counts
+COUNTED_MODELS = {
+    'patients': Patient,
+    'medecins': Medecin,
+    'maladies': Maladie,
+    'traitements': Traitement,
+    'diagnostics': Diagnostic,
+    'prescriptions': Prescription,
+    'etablissements': Etablissement,
+    'examens': Examen,
+    'impacts': ImpactEnvironnemental,
+}
+COUNTER_NAMES = (*COUNTED_MODELS, 'traitements_eco', 'score_carbone_total')
+
+
+def is_eco(score):
+    return score is not None and Decimal(score) <= ECO_SCORE_MAX
+
+
+def record(name, delta):
+    """Add `delta` to counter `name`; a missing counter is rebuilt by the next read"""
+    if delta:
+        DashboardCounter.objects.filter(name=name).update(value=F('value') + delta, updated_at=timezone.now())
+
+
+def _q(name):
+    return connection.ops.quote_name(name)
+
+
+def _table(model):
+    return _q(model._meta.db_table)
+
+
+def compute_stats():
+    """Every counter computed from the tables, in a single statement"""
+    traitement = Traitement._meta.get_field('impact_environnemental')
+    impacts = _table(ImpactEnvironnemental)
+    columns = [f'(SELECT COUNT(*) FROM {_table(model)})' for model in COUNTED_MODELS.values()]
+    columns.append(
+        f'(SELECT COUNT(*) FROM {_table(Traitement)} t JOIN {impacts} i ON i.id = t.{_q(traitement.column)} '
+        f'WHERE i.score_carbone <= %s)'
+    )
+    columns.append(f'(SELECT COALESCE(SUM(score_carbone), 0) FROM {impacts})')
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT ' + ', '.join(columns), [ECO_SCORE_MAX])
+        row = cursor.fetchone()
+    # SQLite sums decimals as floats: round back to the counter's two places
+    return {name: Decimal(str(value)).quantize(CENT) for name, value in zip(COUNTER_NAMES, row)}
+
+
+def reconcile_stats():
+    """Overwrite the counters with freshly computed values; returns {name: (stored, actual)} where they differed"""
+    with transaction.atomic():
+        # Locking the counters first makes concurrent writers either commit
+        # before the recount (and be counted) or apply their delta after it
+        stored = {counter.name: counter.value for counter in DashboardCounter.objects.select_for_update()}
+        actual = compute_stats()
+        now = timezone.now()
+        DashboardCounter.objects.bulk_create(
+            [DashboardCounter(name=name, value=value, updated_at=now) for name, value in actual.items()],
+            update_conflicts=True, unique_fields=['name'], update_fields=['value', 'updated_at'],
+        )
+    return {name: (stored.get(name), value) for name, value in actual.items() if stored.get(name) != value}
+
+
+def stats_payload(counters):
+    """The /api/stats/ payload for a {name: value} of every counter"""
+    stats = {name: int(counters[name]) for name in (*COUNTED_MODELS, 'traitements_eco') if name != 'impacts'}
+    impacts = counters['impacts']
+    # A Decimal, as the Avg('score_carbone') it replaces
+    stats['impact_moyen'] = counters['score_carbone_total'] / impacts if impacts else 0
+    return stats
+
+
+def current_stats():
+    """The /api/stats/ payload, read from the counters"""
+    counters = dict(DashboardCounter.objects.values_list('name', 'value'))
+    if set(counters) != set(COUNTER_NAMES):
+        reconcile_stats()
+        counters = dict(DashboardCounter.objects.values_list('name', 'value'))
+    return stats_payload(counters)
@@ -0,0 +1,236 @@
+"""
+Fast reset of the application data and named data snapshots.
+
+reset_data() empties every ontology_app table with the database's flush
+SQL (a single TRUNCATE ... RESTART IDENTITY on PostgreSQL) instead of
+Model.delete(), which loads every related row into Python to cascade.
+
+A snapshot is a copy of those tables kept next to the live data: a
+PostgreSQL schema (data_snapshot_<name>) or, on SQLite, an attached
+database file. Saving and restoring are plain CREATE TABLE ... AS SELECT
+and INSERT ... SELECT statements that never leave the database server,
+so a multi-million-row state comes back in seconds.
+"""
+import os
+import re
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .conditional_get import bump_all_table_versions
+from .dashboard_stats import reconcile_stats
+from .models import DashboardCounter, RdfDigest, RdfOutbox
+
+SCHEMA_PREFIX = 'data_snapshot_'
+META_TABLE = 'snapshot_meta'
+NAME_PATTERN = re.compile(r'^[a-z0-9_]{1,40}$')
+# Rebuilt rather than copied: the outbox and digests refer to the live store, the counters to the live rows
+NOT_SAVED = (RdfOutbox, RdfDigest, DashboardCounter)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _q(name):
+    return connection.ops.quote_name(name)
+
+
+def data_models():
+    """Models of the app (many-to-many tables included), parents before children"""
+    models = list(apps.get_app_config('ontology_app').get_models(include_auto_created=True))
+    ordered, seen = [], set()
+
+    def visit(model):
+        if model in seen:
+            return
+        seen.add(model)
+        for field in model._meta.concrete_fields:
+            parent = field.related_model if field.is_relation else None
+            if parent in models and parent is not model:
+                visit(parent)
+        ordered.append(model)
+
+    for model in models:
+        visit(model)
+    return ordered
+
+
+def estimated_rows(models):
+    """
+    {table: row count estimate} from the planner statistics on PostgreSQL
+    (pg_class.reltuples, read without scanning the table); None where the
+    table was never analyzed and on other databases.
+    """
+    tables = [model._meta.db_table for model in models]
+    if connection.vendor != 'postgresql':
+        return dict.fromkeys(tables)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT t.name, c.reltuples FROM unnest(%s::text[]) AS t(name) '
+            'JOIN pg_class c ON c.oid = to_regclass(quote_ident(t.name))',
+            [tables],
+        )
+        estimates = {name: int(rows) for name, rows in cursor.fetchall() if rows >= 0}
+    return {table: estimates.get(table) for table in tables}
+
+
+def reset_data():
+    """
+    Empty every application table and restart the id sequences. Returns
+    {table: estimated rows removed} (see estimated_rows): counting them
+    exactly would scan every table the TRUNCATE is meant to skip.
+    """
+    models = data_models()
+    counts = estimated_rows(models)
+    tables = [model._meta.db_table for model in reversed(models)]
+    sql = connection.ops.sql_flush(no_style(), tables, reset_sequences=True)
+    connection.ops.execute_sql_flush(sql)
+    reconcile_stats()
+    bump_all_table_versions()
+    return counts
+
+
+def _check_name(name):
+    if not NAME_PATTERN.match(name):
+        raise SnapshotError("Snapshot names use lowercase letters, digits and underscores")
+
+
+def _location(name):
+    """Qualifier of the snapshot tables: a schema on PostgreSQL, an attached database on SQLite"""
+    return SCHEMA_PREFIX + name
+
+
+def _sqlite_prefix():
+    """Snapshot files sit next to the SQLite database: <database>.<name>.snapshot"""
+    return f"{connection.settings_dict['NAME']}."
+
+
+def _sqlite_path(name):
+    return f"{_sqlite_prefix()}{name}.snapshot"
+
+
+def _attach(cursor, name):
+    if connection.vendor == 'sqlite':
+        cursor.execute('ATTACH DATABASE %s AS ' + _q(_location(name)), [_sqlite_path(name)])
+
+
+def _detach(cursor, name):
+    if connection.vendor == 'sqlite':
+        cursor.execute('DETACH DATABASE ' + _q(_location(name)))
+
+
+def _check_vendor():
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        raise SnapshotError(f"Snapshots are not supported on {connection.vendor}")
+
+
+def list_snapshots():
+    """[{name, created_at, rows}] of the saved snapshots"""
+    _check_vendor()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT schema_name FROM information_schema.schemata WHERE schema_name LIKE %s ORDER BY 1',
+                [SCHEMA_PREFIX.replace('_', r'\_') + '%'],
+            )
+            names = [row[0][len(SCHEMA_PREFIX):] for row in cursor.fetchall()]
+    else:
+        directory, prefix = os.path.split(_sqlite_prefix())
+        names = sorted(entry[len(prefix):-len('.snapshot')] for entry in os.listdir(directory or '.')
+                       if entry.startswith(prefix) and entry.endswith('.snapshot'))
+    return [dict(name=name, **_read_meta(name)) for name in names]
+
+
+def _read_meta(name):
+    with connection.cursor() as cursor:
+        _attach(cursor, name)
+        try:
+            cursor.execute(f'SELECT created_at, row_count FROM {_q(_location(name))}.{_q(META_TABLE)}')
+            created_at, rows = cursor.fetchone()
+        finally:
+            _detach(cursor, name)
+    return {'created_at': created_at, 'rows': rows}
+
+
+def _exists(name):
+    return any(snapshot['name'] == name for snapshot in list_snapshots())
+
+
+def save_snapshot(name, replace=False):
+    """Copy every application table (except NOT_SAVED) into snapshot `name`; returns {table: rows}"""
+    _check_name(name)
+    _check_vendor()
+    if _exists(name):
+        if not replace:
+            raise SnapshotError(f"Snapshot {name} already exists")
+        delete_snapshot(name)
+    location = _q(_location(name))
+    counts = {}
+    with connection.cursor() as cursor:
+        _attach(cursor, name)
+        try:
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    cursor.execute(f'CREATE SCHEMA {location}')
+                for model in data_models():
+                    if model in NOT_SAVED:
+                        continue
+                    table = _q(model._meta.db_table)
+                    # Created empty then filled, so the INSERT reports the rows copied
+                    cursor.execute(f'CREATE TABLE {location}.{table} AS SELECT * FROM {table} WHERE 1 = 0')
+                    cursor.execute(f'INSERT INTO {location}.{table} SELECT * FROM {table}')
+                    counts[model._meta.db_table] = cursor.rowcount
+                cursor.execute(f'CREATE TABLE {location}.{_q(META_TABLE)} (created_at varchar(40), row_count bigint)')
+                cursor.execute(f'INSERT INTO {location}.{_q(META_TABLE)} VALUES (%s, %s)',
+                               [timezone.now().isoformat(timespec='seconds'), sum(counts.values())])
+        finally:
+            _detach(cursor, name)
+    return counts
+
+
+def restore_snapshot(name):
+    """Replace the application data with snapshot `name`; returns {table: rows}"""
+    _check_name(name)
+    _check_vendor()
+    if not _exists(name):
+        raise SnapshotError(f"Snapshot {name} does not exist")
+    location = _q(_location(name))
+    models = [model for model in data_models() if model not in NOT_SAVED]
+    counts = {}
+    with connection.cursor() as cursor:
+        _attach(cursor, name)
+        try:
+            with transaction.atomic():
+                tables = [model._meta.db_table for model in reversed(data_models())]
+                for statement in connection.ops.sql_flush(no_style(), tables):
+                    cursor.execute(statement)
+                for model in models:
+                    table = _q(model._meta.db_table)
+                    columns = ', '.join(_q(field.column) for field in model._meta.concrete_fields)
+                    cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {location}.{table}')
+                    counts[model._meta.db_table] = cursor.rowcount
+                # Ids handed out next must follow the restored ones
+                for statement in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(statement)
+                reconcile_stats()
+                bump_all_table_versions()
+        finally:
+            _detach(cursor, name)
+        # Fresh planner statistics for the benchmark that usually follows
+        for model in models:
+            cursor.execute(f'ANALYZE {_q(model._meta.db_table)}')
+    return counts
+
+
+def delete_snapshot(name):
+    _check_name(name)
+    _check_vendor()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {_q(_location(name))} CASCADE')
+    elif os.path.exists(_sqlite_path(name)):
+        os.remove(_sqlite_path(name))
+
@@ -0,0 +1,185 @@
+"""
+Versioned named graphs for zero-downtime reloads.
+
+Each full reload writes into a fresh named graph. Once it is complete, a
+single update (one Fuseki transaction) moves the pointer stored in the
+meta graph to it, and older versions beyond the retention count are
+dropped. Queries are sent with default-graph-uri set to the graph the
+pointer names, so readers never see a graph that is still being built.
+
+A reload that fails part-way is held (see hold_reload) until
+`populate_fuseki.py --replay` completes its graph: the incremental sync
+keeps its changes in the outbox meanwhile, so none of them is applied to
+the old graph and lost at the switch.
+"""
+import logging
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .rdf_mapping import iri
+
+logger = logging.getLogger(__name__)
+
+GRAPH_PREFIX = 'http://example.org/health/graph/'
+META_GRAPH = 'http://example.org/health/meta'
+CURRENT_GRAPH = iri('currentGraph')
+GRAPH_VERSION = iri('graphVersion')
+# Versions that have been current once, i.e. complete
+SERVED_GRAPH = iri('servedGraph')
+# Stands for the default graph loaded before versioning in the version list,
+# sorted before every timestamped version and dropped by collect_garbage
+LEGACY_GRAPH = GRAPH_PREFIX + '0-default'
+
+POINTER_KEY = 'sparql:current_graph'
+RELOAD_KEY = 'sparql:reload_in_progress'
+# Cached "no pointer yet", distinct from a cache miss
+NO_GRAPH = ''
+
+
+def _store():
+    return caches[settings.SPARQL_CACHE['GENERATION_CACHE']]
+
+
+def new_version_graph(client):
+    """
+    Create the IRI of a new version graph (versions sort by creation time)
+    and register it in the meta graph, so even an abandoned load gets dropped.
+    """
+    graph = GRAPH_PREFIX + datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    client.update(
+        f'INSERT DATA {{ GRAPH <{META_GRAPH}> {{ <{META_GRAPH}> {GRAPH_VERSION} <{graph}> }} }}',
+        name='register_graph',
+    )
+    return graph
+
+
+def read_pointer(client):
+    """Current version graph according to the triple store, None if there is none"""
+    results = client.query(
+        f'SELECT ?g WHERE {{ GRAPH <{META_GRAPH}> {{ <{META_GRAPH}> {CURRENT_GRAPH} ?g }} }}',
+        name='current_graph',
+    )
+    bindings = results.get('results', {}).get('bindings', [])
+    return bindings[0]['g']['value'] if bindings else None
+
+
+def get_current_graph(client=None):
+    """
+    Graph OntologyQuery should read, None to use the dataset's default graph.
+    Cached in the shared cache; switch_to() refreshes it immediately and other
+    hosts pick the change up within SPARQL_GRAPH_VERSIONS['POINTER_TTL'] seconds.
+    Raises when the pointer cannot be read: falling back to the default graph
+    would answer (and cache) queries from the wrong data.
+    """
+    if settings.SPARQL_BACKEND == 'rdflib':
+        return None
+    store = _store()
+    graph = store.get(POINTER_KEY)
+    if graph is None:
+        from .sparql_client import get_client
+
+        try:
+            graph = read_pointer(client or get_client()) or NO_GRAPH
+        except Exception as e:
+            logger.error(f"Cannot read the current graph pointer: {e}")
+            raise
+        store.set(POINTER_KEY, graph, settings.SPARQL_GRAPH_VERSIONS['POINTER_TTL'])
+    return graph or None
+
+
+def switch_to(client, graph):
+    """
+    Atomically point readers at `graph` and mark it served. On the first
+    switch the default graph readers used so far is listed as LEGACY_GRAPH,
+    so it is retained and then dropped like any other version.
+    """
+    store = _store()
+    # The cached pointer moves first: client.update() bumps the dataset
+    # generation, and a query between the two must not cache old-graph
+    # results (or hand out an ETag) under the new generation
+    store.set(POINTER_KEY, graph, settings.SPARQL_GRAPH_VERSIONS['POINTER_TTL'])
+    try:
+        # The outgoing graph is marked served too, for versions switched to before the marker existed
+        client.update(
+            f'INSERT {{ GRAPH <{META_GRAPH}> {{\n'
+            f'    <{META_GRAPH}> {GRAPH_VERSION} <{LEGACY_GRAPH}> .\n'
+            f'    <{META_GRAPH}> {SERVED_GRAPH} <{LEGACY_GRAPH}> }} }}\n'
+            f'WHERE {{ FILTER NOT EXISTS {{ GRAPH <{META_GRAPH}> {{ <{META_GRAPH}> {CURRENT_GRAPH} ?g }} }} }} ;\n'
+            f'INSERT {{ GRAPH <{META_GRAPH}> {{ <{META_GRAPH}> {SERVED_GRAPH} ?g }} }}\n'
+            f'WHERE {{ GRAPH <{META_GRAPH}> {{ <{META_GRAPH}> {CURRENT_GRAPH} ?g }} }} ;\n'
+            f'DELETE WHERE {{ GRAPH <{META_GRAPH}> {{ <{META_GRAPH}> {CURRENT_GRAPH} ?g }} }} ;\n'
+            f'INSERT DATA {{ GRAPH <{META_GRAPH}> {{\n'
+            f'    <{META_GRAPH}> {CURRENT_GRAPH} <{graph}> .\n'
+            f'    <{META_GRAPH}> {SERVED_GRAPH} <{graph}> }} }}',
+            name='switch_graph',
+        )
+    except Exception:
+        # Readers go back to whatever the triple store says
+        store.delete(POINTER_KEY)
+        raise
+
+
+def list_versions(client, predicate=GRAPH_VERSION):
+    """Every version graph in the dataset (or only the served ones), oldest first"""
+    results = client.query(
+        f'SELECT ?g WHERE {{ GRAPH <{META_GRAPH}> {{ <{META_GRAPH}> {predicate} ?g }} }}',
+        name='list_graphs',
+    )
+    return sorted(binding['g']['value'] for binding in results['results']['bindings'])
+
+
+def collect_garbage(client, keep=None):
+    """
+    Drop all but the `keep` newest served versions, and every version that
+    was never served (abandoned loads), except the current graph and one a
+    held reload still has to complete. Keeping at least two leaves hosts
+    with a not yet refreshed pointer a complete graph.
+    """
+    keep = max(1, keep if keep is not None else settings.SPARQL_GRAPH_VERSIONS['KEEP'])
+    kept = {read_pointer(client), *list_versions(client, SERVED_GRAPH)[-keep:]}
+    state = reload_state()
+    if state:
+        kept.add(state['graph'])
+    dropped = [graph for graph in list_versions(client) if graph not in kept]
+    for graph in dropped:
+        drop = 'DROP SILENT DEFAULT' if graph == LEGACY_GRAPH else f'DROP SILENT GRAPH <{graph}>'
+        client.update(
+            f'{drop} ;\n'
+            f'DELETE WHERE {{ GRAPH <{META_GRAPH}> {{ <{META_GRAPH}> ?p <{graph}> }} }}',
+            name='drop_graph',
+        )
+    return dropped
+
+
+def begin_reload(graph, last_outbox_id):
+    """
+    Mark a full reload of `graph` as running so the incremental sync holds
+    its changes. Outbox rows up to `last_outbox_id` are covered by the
+    reload and pruned once it switches.
+    """
+    _store().set(RELOAD_KEY, {'graph': graph, 'last_outbox_id': last_outbox_id},
+                 settings.SPARQL_GRAPH_VERSIONS['RELOAD_TIMEOUT'])
+
+
+def hold_reload():
+    """Keep a failed reload's state, without expiry, until a replay completes it"""
+    state = reload_state()
+    if state:
+        _store().set(RELOAD_KEY, state, timeout=None)
+
+
+def end_reload():
+    _store().delete(RELOAD_KEY)
+
+
+def reload_state():
+    """{'graph', 'last_outbox_id'} of the running or held reload, None if there is none"""
+    state = _store().get(RELOAD_KEY)
+    # Flags written before the state was recorded hold no graph
+    return state if isinstance(state, dict) else None
+
+
+def reload_in_progress():
+    return bool(_store().get(RELOAD_KEY))
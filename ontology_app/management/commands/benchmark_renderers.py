@@ -0,0 +1,54 @@
+import gzip
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from ontology_app.fast_serializers import values_serializer_for
+from ontology_app.renderers import MessagePackRenderer, ORJSONRenderer
+from ontology_app.urls import router
+
+RENDERERS = {
+    'json (stdlib)': JSONRenderer(),
+    'json (orjson)': ORJSONRenderer(),
+    'msgpack': MessagePackRenderer(),
+}
+
+
+class Command(BaseCommand):
+    help = "Compare encode time and payload size of the API renderers on full list pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoints', nargs='*', default=['diagnostics', 'prescriptions', 'traitements', 'patients'],
+                            help="Router prefixes of the list endpoints to benchmark")
+        parser.add_argument('--rows', type=int, default=settings.API_MAX_PAGE_SIZE,
+                            help="Rows per page (default: API_MAX_PAGE_SIZE)")
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="Encodings per renderer; the best time is reported")
+
+    def page(self, viewset, rows):
+        """A page of the endpoint as the view hands it to the renderer"""
+        serializer_class = viewset.serializer_class
+        queryset = viewset.queryset.all()[:rows]
+        fast = values_serializer_for(serializer_class)
+        results = fast.serialize(fast.rows(queryset)) if fast else serializer_class(queryset, many=True).data
+        return {'next': None, 'previous': None, 'results': results}
+
+    def handle(self, *args, **options):
+        viewsets = {prefix: viewset for prefix, viewset, _ in router.registry}
+        for endpoint in options['endpoints']:
+            data = self.page(viewsets[endpoint], options['rows'])
+            self.stdout.write(self.style.MIGRATE_HEADING(f"/api/{endpoint}/ ({len(data['results'])} rows)"))
+            baseline = None
+            for name, renderer in RENDERERS.items():
+                best = float('inf')
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    body = renderer.render(data, renderer.media_type, {})
+                    best = min(best, time.perf_counter() - started)
+                baseline = baseline or best
+                self.stdout.write(
+                    f"  {name:<14} {best * 1000:8.2f}ms  x{baseline / best:<5.1f} "
+                    f"{len(body):>9} bytes  {len(gzip.compress(body)):>8} gzipped"
+                )
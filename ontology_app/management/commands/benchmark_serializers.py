@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ontology_app.fast_serializers import values_serializer_for
+from ontology_app.urls import router
+
+
+class Command(BaseCommand):
+    help = "Compare the DRF serializers with their .values() fast path on full list pages, queries included"
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoints', nargs='*', default=['diagnostics', 'prescriptions', 'traitements'],
+                            help="Router prefixes of list endpoints with a fast serializer")
+        parser.add_argument('--rows', type=int, default=settings.API_MAX_PAGE_SIZE,
+                            help="Rows per page (default: API_MAX_PAGE_SIZE)")
+        parser.add_argument('--repeat', type=int, default=10,
+                            help="Serializations per path; the best time is reported")
+
+    def handle(self, *args, **options):
+        viewsets = {prefix: viewset for prefix, viewset, _ in router.registry}
+        for endpoint in options['endpoints']:
+            viewset = viewsets[endpoint]
+            serializer_class = viewset.serializer_class
+            fast = values_serializer_for(serializer_class)
+            if fast is None:
+                raise CommandError(f"{serializer_class.__name__} has no .values() fast path")
+            rows = options['rows']
+            paths = {
+                'DRF serializer': lambda: serializer_class(viewset.queryset.all()[:rows], many=True).data,
+                '.values()': lambda: fast.serialize(fast.rows(viewset.queryset.all()[:rows])),
+            }
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f"/api/{endpoint}/ ({serializer_class.__name__})"))
+            baseline = None
+            for name, serialize in paths.items():
+                best = float('inf')
+                for _ in range(options['repeat']):
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        results = serialize()
+                        best = min(best, time.perf_counter() - started)
+                baseline = baseline or best
+                self.stdout.write(
+                    f"  {name:<15} {best * 1000:8.2f}ms  x{baseline / best:<5.1f} "
+                    f"{len(results):>6} rows  {len(queries):>3} queries"
+                )
@@ -0,0 +1,69 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ontology_app.rdf_drift import LINKS, DriftChecker, rebuild_digests
+from ontology_app.rdf_sync import SUBJECT_KINDS, enqueue
+from ontology_app.sparql_client import get_client
+
+
+def repair(kind, pk):
+    """
+    Queue every triple of a resource for rebuilding: its own triples and the
+    links subject_delta leaves alone. For a resource deleted from the
+    database both deltas insert nothing, so none of its triples remain.
+    """
+    enqueue(kind, pk)
+    for predicate, _, _ in LINKS.get(kind, []):
+        enqueue(predicate, pk)
+
+
+class Command(BaseCommand):
+    help = "Compare the database with the triple store and list missing, extra and different resources"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', action='append', dest='kinds', choices=list(SUBJECT_KINDS),
+                            help="Entity type to check (repeatable, default: all)")
+        parser.add_argument('--graph', help="Named graph to check (default: the current version)")
+        parser.add_argument('--fanout', type=int, default=16, help="Sub-ranges per differing id range")
+        parser.add_argument('--rebuild-digests', action='store_true',
+                            help="Rehash the checked kinds from the database first, after changes that sent no signals")
+        parser.add_argument('--repair', action='store_true',
+                            help="Queue the drifted resources in the RDF outbox for sync_fuseki")
+        parser.add_argument('--json', action='store_true', help="Print the full report as JSON")
+
+    def handle(self, *args, **options):
+        if options['fanout'] < 2:
+            raise CommandError("--fanout must be at least 2")
+        started = time.perf_counter()
+        if options['rebuild_digests']:
+            rebuild_digests(options['kinds'])
+        checker = DriftChecker(get_client(), graph=options['graph'], fanout=options['fanout'])
+        report = checker.check(options['kinds'])
+        elapsed = time.perf_counter() - started
+
+        drifted = 0
+        for kind, result in report.items():
+            names = result['missing'] + result['extra'] + result['different']
+            drifted += len(names)
+            if options['repair']:
+                for name in names:
+                    repair(kind, int(name.rsplit('_', 1)[1]))
+            if not options['json']:
+                self.stdout.write(
+                    f"{kind}: {result['resources']} resources, {len(result['missing'])} missing, "
+                    f"{len(result['extra'])} extra, {len(result['different'])} different"
+                )
+                for status in ('missing', 'extra', 'different'):
+                    for name in result[status]:
+                        self.stdout.write(f"  {status:9} {name}")
+
+        if options['json']:
+            self.stdout.write(json.dumps({'queries': checker.queries, 'seconds': round(elapsed, 3),
+                                          'kinds': report}, indent=2))
+            return
+        summary = f"{drifted} drifted resources, {checker.queries} SPARQL queries, {elapsed:.2f}s"
+        if options['repair'] and drifted:
+            summary += " (queued for sync_fuseki)"
+        self.stdout.write(self.style.SUCCESS(summary) if not drifted else self.style.WARNING(summary))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ontology_app.data_snapshots import (
+    SnapshotError, delete_snapshot, list_snapshots, restore_snapshot, save_snapshot,
+)
+
+
+class Command(BaseCommand):
+    help = "Save, restore, list or delete named snapshots of the application data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['save', 'restore', 'list', 'delete'])
+        parser.add_argument('name', nargs='?', help="Snapshot name (lowercase letters, digits, _)")
+        parser.add_argument('--replace', action='store_true', help="Overwrite an existing snapshot on save")
+
+    def handle(self, *args, **options):
+        action, name = options['action'], options['name']
+        if action != 'list' and not name:
+            raise CommandError(f"{action} needs a snapshot name")
+        started = time.perf_counter()
+        try:
+            if action == 'list':
+                for snapshot in list_snapshots():
+                    self.stdout.write(f"{snapshot['name']}: {snapshot['rows']} rows, saved {snapshot['created_at']}")
+                return
+            if action == 'delete':
+                delete_snapshot(name)
+                self.stdout.write(self.style.SUCCESS(f"Snapshot {name} deleted"))
+                return
+            if action == 'save':
+                counts = save_snapshot(name, replace=options['replace'])
+            else:
+                counts = restore_snapshot(name)
+        except SnapshotError as e:
+            raise CommandError(str(e))
+
+        verb = 'saved to' if action == 'save' else 'restored from'
+        self.stdout.write(self.style.SUCCESS(
+            f"{sum(counts.values())} rows {verb} snapshot {name} in {time.perf_counter() - started:.2f}s"
+        ))
+        if action == 'restore':
+            self.stdout.write("The triple store is not restored: run populate_fuseki.py")
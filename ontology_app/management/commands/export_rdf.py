@@ -0,0 +1,67 @@
+import gzip
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ontology_app.rdf_mapping import ENTITY_MAPPINGS, ontology_triples
+
+# Rows fetched per database round trip; memory stays bounded by this, not the table size
+ITERATOR_CHUNK_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = "Stream the whole database to a gzip'd N-Triples / N-Quads file for offline bulk loading (tdb2.tdbloader)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='health_env.nt.gz',
+                            help="Output file, gzip-compressed when it ends in .gz")
+        parser.add_argument('--format', dest='rdf_format', choices=['nt', 'nq'], default='nt',
+                            help="nt: N-Triples, nq: N-Quads (every triple in --graph)")
+        parser.add_argument('--graph', help="Named graph IRI of the N-Quads statements")
+        parser.add_argument('--include-ontology', action='store_true',
+                            help="Also write the OWL ontology (RDFLIB_ONTOLOGY_PATH)")
+
+    def handle(self, *args, **options):
+        output = options['output']
+        quads = options['rdf_format'] == 'nq'
+        if quads and not options['graph']:
+            raise CommandError("--format nq needs --graph")
+        suffix = f" <{options['graph']}> .\n" if quads else ' .\n'
+
+        started = time.perf_counter()
+        tmp_path = f'{output}.tmp'
+        opener = gzip.open if output.endswith('.gz') else open
+        total = 0
+        with opener(tmp_path, 'wt', encoding='utf-8') as out:
+            if options['include_ontology']:
+                total += self._write_ontology(out, suffix)
+            for label, queryset, build in ENTITY_MAPPINGS:
+                entity_started = time.perf_counter()
+                rows = triples = 0
+                for instance in queryset().iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+                    lines = [f'{s} {p} {o}{suffix}' for s, p, o in build(instance)]
+                    out.writelines(lines)
+                    rows += 1
+                    triples += len(lines)
+                total += triples
+                self.stdout.write(
+                    f"{label}: {rows} rows, {triples} triples in {time.perf_counter() - entity_started:.2f}s"
+                )
+        # Readers (and the bulk loader) never see a partially written file
+        os.replace(tmp_path, output)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} triples written to {output} ({os.path.getsize(output)} bytes) in {elapsed:.2f}s "
+            f"({total / elapsed if elapsed else 0:,.0f} triples/s)"
+        ))
+
+    def _write_ontology(self, out, suffix):
+        count = 0
+        for s, p, o in ontology_triples(settings.RDFLIB_ONTOLOGY_PATH):
+            out.write(f'{s} {p} {o}{suffix}')
+            count += 1
+        self.stdout.write(f"Ontology: {count} triples")
+        return count
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ontology_app.data_snapshots import data_models, reset_data
+from ontology_app.models import DashboardCounter
+from ontology_app.synthetic_data import DEFAULT_BATCH_SIZE, SyntheticDataGenerator, scaled_counts
+
+
+class Command(BaseCommand):
+    help = "Generate a seedable synthetic dataset (10^3 to 10^7 rows) with bulk_create"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1000,
+                            help="Number of patients; the other tables are sized from it")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed (same seed, same dataset)")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Rows per INSERT statement")
+        parser.add_argument('--clear', action='store_true',
+                            help="Truncate the existing data first (also empties the RDF outbox)")
+        parser.add_argument('--dry-run', action='store_true', help="Only print the planned table sizes")
+
+    def handle(self, *args, **options):
+        if options['patients'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--patients and --batch-size must be positive")
+        if options['dry_run']:
+            for table, count in scaled_counts(options['patients']).items():
+                self.stdout.write(f"{table}: {count}")
+            self.stdout.write("(plus treatments, impacts, diagnostics, prescriptions and links, drawn at random)")
+            return
+
+        if options['clear']:
+            started = time.perf_counter()
+            reset_data()
+            self.stdout.write(f"Existing data truncated in {time.perf_counter() - started:.2f}s")
+        elif any(model.objects.exists() for model in data_models() if model is not DashboardCounter):
+            raise CommandError("The database already contains data: use --clear to replace it")
+
+        last_report = [0.0]
+
+        def progress(table, rows):
+            now = time.perf_counter()
+            if now - last_report[0] >= 2:
+                last_report[0] = now
+                self.stdout.write(f"  {table}: {rows} rows")
+
+        generator = SyntheticDataGenerator(
+            patients=options['patients'], seed=options['seed'],
+            batch_size=options['batch_size'], progress=progress,
+        )
+        written = generator.generate()
+        total = sum(written.values())
+        for table, rows in written.items():
+            self.stdout.write(f"{table}: {rows}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} rows written in {generator.seconds:.2f}s ({total / generator.seconds:,.0f} rows/s)"
+        ))
+        self.stdout.write("bulk_create sends no signals: run populate_fuseki.py to reload the triple store")
+
@@ -0,0 +1,56 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ontology_app.clinical_import import (
+    DEFAULT_CHUNK_SIZE, FORMATS, SPECS, ClinicalImporter, read_csv, read_parquet,
+)
+
+
+class Command(BaseCommand):
+    help = "Import a clinical CSV / Parquet extract through a staging table (COPY on PostgreSQL)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(SPECS), help="What the file contains")
+        parser.add_argument('path', help="CSV (with a header) or Parquet file")
+        parser.add_argument('--format', dest='file_format', choices=FORMATS,
+                            help="File format (default: from the extension)")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Rows validated and copied at a time")
+        parser.add_argument('--delimiter', default=',', help="CSV field delimiter")
+        parser.add_argument('--rejects', help="CSV file of rejected rows (default: <path>.rejects.csv)")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        file_format = options['file_format'] or ('parquet' if path.endswith(('.parquet', '.pq')) else 'csv')
+        if file_format == 'parquet':
+            chunks = read_parquet(path, options['chunk_size'])
+        else:
+            chunks = read_csv(path, options['chunk_size'], options['delimiter'])
+        rejects = options['rejects'] or f'{path}.rejects.csv'
+
+        def progress(phase, stats):
+            if not options['json']:
+                self.stdout.write(f"  {phase}: {stats.read} rows read, {stats.invalid} invalid")
+
+        importer = ClinicalImporter(options['kind'], rejects, chunk_size=options['chunk_size'], progress=progress)
+        stats = importer.run(chunks)
+        report = stats.to_dict()
+
+        if options['json']:
+            self.stdout.write(json.dumps({**report, 'rejects': rejects}, indent=2))
+            return
+        phases = ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in report['phases'].items())
+        self.stdout.write(
+            f"{report['read']} rows read: {report['inserted']} inserted, {report['updated']} updated, "
+            f"{report['invalid']} invalid, {report['rejected']} rejected ({phases})"
+        )
+        if report['invalid'] or report['rejected']:
+            self.stdout.write(self.style.WARNING(f"Rejected rows written to {rejects}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['seconds']:.2f}s, {report['rows_per_second']:,.0f} rows/s"
+        ))
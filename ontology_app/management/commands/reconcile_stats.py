@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ontology_app.dashboard_stats import reconcile_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the dashboard counters from the tables and report the drift they had"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help="Keep reconciling every INTERVAL seconds instead of once")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            drift = reconcile_stats()
+            elapsed = (time.perf_counter() - started) * 1000
+            for name, (stored, actual) in drift.items():
+                self.stdout.write(f"{name}: {stored} -> {actual}")
+            self.stdout.write(self.style.SUCCESS(
+                f"{len(drift)} counters corrected in {elapsed:.0f}ms" if drift
+                else f"Counters up to date ({elapsed:.0f}ms)"
+            ))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
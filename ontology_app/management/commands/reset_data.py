@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ontology_app.data_snapshots import reset_data
+
+
+class Command(BaseCommand):
+    help = "Empty every application table with TRUNCATE (no cascading Model.delete())"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help="Do not ask for confirmation")
+
+    def handle(self, *args, **options):
+        if options['interactive']:
+            answer = input("This deletes all patients, doctors, treatments, ... Type 'yes' to continue: ")
+            if answer != 'yes':
+                raise CommandError("Reset cancelled")
+        started = time.perf_counter()
+        counts = reset_data()
+        estimates = [rows for rows in counts.values() if rows is not None]
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(counts)} tables emptied in {time.perf_counter() - started:.2f}s"
+            + (f" (about {sum(estimates)} rows)" if estimates else "")
+        ))
+        self.stdout.write("The triple store still holds the old data: run populate_fuseki.py")
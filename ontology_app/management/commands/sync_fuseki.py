@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ontology_app.graph_versions import reload_in_progress
+from ontology_app.rdf_sync import apply_pending, pending_stats
+from ontology_app.sparql_client import get_client
+
+
+class Command(BaseCommand):
+    help = "Apply the pending RDF outbox changes to the triple store, continuously or once"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the outbox and exit instead of polling")
+        parser.add_argument('--batch-size', type=int, default=settings.RDF_SYNC['BATCH_SIZE'],
+                            help="Outbox rows per update request")
+        parser.add_argument('--interval', type=float, default=settings.RDF_SYNC['INTERVAL'],
+                            help="Seconds to wait when the outbox is empty or Fuseki fails")
+
+    def handle(self, *args, **options):
+        client = get_client()
+        batch_size = options['batch_size']
+        stats = pending_stats()
+        self.stdout.write(f"{stats['pending']} pending changes")
+
+        while True:
+            if reload_in_progress():
+                # Changes are applied to the new graph once the reload has switched to it
+                # (apply_pending checks again within its transaction)
+                if options['once']:
+                    self.stdout.write("Full reload in progress, nothing applied")
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            started = time.perf_counter()
+            try:
+                events, resources = apply_pending(client, batch_size)
+            except Exception as e:
+                # The batch stays in the outbox and is retried as a whole
+                self.stderr.write(f"Sync failed, retrying in {options['interval']}s: {e}")
+                if options['once']:
+                    raise
+                time.sleep(options['interval'])
+                continue
+
+            if events:
+                self.stdout.write(
+                    f"{events} changes -> {resources} resources in "
+                    f"{(time.perf_counter() - started) * 1000:.0f}ms"
+                )
+            if events < batch_size:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS("Outbox drained"))
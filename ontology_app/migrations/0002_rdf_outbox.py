@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ontology_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RdfOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=30)),
+                ('object_id', models.BigIntegerField()),
+                ('operation', models.CharField(choices=[('save', 'Création / modification'), ('delete', 'Suppression')], default='save', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Événement RDF',
+                'verbose_name_plural': 'Outbox RDF',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ontology_app', '0002_rdf_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diagnostic',
+            index=models.Index(fields=['-date_diagnostic', 'id'], name='diagnostic_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['-date_prescription', 'id'], name='prescription_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ontology_app', '0004_dashboard_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RdfDigest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=30)),
+                ('object_id', models.BigIntegerField()),
+                ('triples', models.IntegerField()),
+                ('digest', models.BigIntegerField()),
+            ],
+            options={
+                'verbose_name': 'Empreinte RDF',
+                'verbose_name_plural': 'Empreintes RDF',
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+    ]
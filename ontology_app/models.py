@@ -136,14 +136,18 @@ class ImpactEnvironnemental(models.Model):
         verbose_name = "Impact Environnemental"
         verbose_name_plural = "Impacts Environnementaux"
     
+    @staticmethod
+    def type_for_score(score_carbone):
+        """Type d'impact correspondant à un score carbone"""
+        if score_carbone < 5:
+            return 'faible'
+        elif score_carbone <= 15:
+            return 'modere'
+        return 'eleve'
+
     def save(self, *args, **kwargs):
-        # Auto-determine type based on score
-        if self.score_carbone < 5:
-            self.type_impact = 'faible'
-        elif self.score_carbone <= 15:
-            self.type_impact = 'modere'
-        else:
-            self.type_impact = 'eleve'
+        # Auto-determine type based on score (bulk_create bypasses save, see type_for_score)
+        self.type_impact = self.type_for_score(self.score_carbone)
         super().save(*args, **kwargs)
 
 class Medicament(models.Model):
@@ -233,6 +237,8 @@ class Diagnostic(models.Model):
     class Meta:
         verbose_name_plural = "Diagnostics"
         ordering = ['-date_diagnostic']
+        # Keyset pagination walks (-date_diagnostic, id): see ontology_app/pagination.py
+        indexes = [models.Index(fields=['-date_diagnostic', 'id'], name='diagnostic_keyset_idx')]
     
     def __str__(self):
         return f"{self.patient} - {self.maladie.nom_maladie}"
@@ -249,6 +255,60 @@ class Prescription(models.Model):
     class Meta:
         verbose_name_plural = "Prescriptions"
         ordering = ['-date_prescription']
+        # Keyset pagination walks (-date_prescription, id): see ontology_app/pagination.py
+        indexes = [models.Index(fields=['-date_prescription', 'id'], name='prescription_keyset_idx')]
+    
+    def __str__(self):
+        return f"{self.traitement.nom_traitement} pour {self.diagnostic.patient}"
+
+class RdfOutbox(models.Model):
+    """Changement en attente de synchronisation vers Fuseki (voir rdf_sync)"""
+    OPERATION_CHOICES = [
+        ('save', 'Création / modification'),
+        ('delete', 'Suppression'),
+    ]
+    
+    # Patient, Medecin, Maladie, Impact, Traitement or a link predicate
+    # (diagnostiquePour, prescrit) whose triples are rebuilt for object_id
+    kind = models.CharField(max_length=30)
+    object_id = models.BigIntegerField()
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES, default='save')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Événement RDF"
+        verbose_name_plural = "Outbox RDF"
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.operation} {self.kind}_{self.object_id}"
+
+class RdfDigest(models.Model):
+    """Empreinte des triplets d'une ressource tels qu'envoyés à Fuseki (voir rdf_drift)"""
+    # Same kinds as RdfOutbox: a resource type or a link predicate
+    kind = models.CharField(max_length=30)
+    object_id = models.BigIntegerField()
+    triples = models.IntegerField()
+    digest = models.BigIntegerField()
+    
+    class Meta:
+        verbose_name = "Empreinte RDF"
+        verbose_name_plural = "Empreintes RDF"
+        unique_together = [('kind', 'object_id')]
+    
+    def __str__(self):
+        return f"{self.kind}_{self.object_id}: {self.triples} triplets"
+
+class DashboardCounter(models.Model):
+    """Agrégat courant de /api/stats/, tenu à jour par les signaux (voir dashboard_stats)"""
+    name = models.CharField(max_length=40, primary_key=True)
+    # Row counts and the carbon score total share one exact type
+    value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Compteur du tableau de bord"
+        verbose_name_plural = "Compteurs du tableau de bord"
     
     def __str__(self):
-        return f"{self.traitement.nom_traitement} pour {self.diagnostic.patient}"
\ No newline at end of file
+        return f"{self.name} = {self.value}"
@@ -0,0 +1,117 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+DRF's CursorPagination puts only the first ordering field in the cursor and
+falls back to an OFFSET when several rows share it, which is the usual case
+for timestamps written by a bulk import. KeysetPagination keeps every
+ordering field in the cursor, the primary key last, so each page is
+
+    WHERE date < :d OR (date = :d AND id > :i) ORDER BY date DESC, id LIMIT n+1
+
+an index range scan that costs the same on page 1 and on page 10 000.
+No COUNT(*) is ever run: clients follow the `next` / `previous` links.
+
+The ordering is the model's Meta.ordering with `id` appended as the
+tie-breaker (`-date_diagnostic, id` for Diagnostic, `id` for models
+without a default ordering).
+"""
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+def cursor_ordering(model):
+    """Meta.ordering of `model` made total by a trailing id"""
+    ordering = tuple(model._meta.ordering)
+    if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+        ordering += ('id',)
+    return ordering
+
+
+def _reverse(ordering):
+    return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+
+def _after(ordering, position):
+    """Rows strictly after `position`: (a > x) | (a = x & b > y) | ..."""
+    condition, equal = Q(), {}
+    for field, value in zip(ordering, position):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+class KeysetPagination(CursorPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        return cursor_ordering(queryset.model)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse, position = (False, None) if self.cursor is None else self.cursor[1:]
+
+        ordering = _reverse(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(_after(ordering, self._decode_position(position)))
+            except (ValidationError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # One extra row tells whether another page follows
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_following
+        else:
+            self.has_next, self.has_previous = has_following, position is not None
+        self.next_position = self.previous_position = position
+        return self.page
+
+    def _decode_position(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _get_position_from_instance(self, instance, ordering):
+        # Pages are model instances or, on the fast read path, .values() rows
+        if isinstance(instance, dict):
+            values = [instance['pk' if field.lstrip('-') == 'id' else field.lstrip('-')] for field in ordering]
+        else:
+            values = [getattr(instance, field.lstrip('-')) for field in ordering]
+        return json.dumps([value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = (self._get_position_from_instance(self.page[-1], self.ordering)
+                    if self.page else self.next_position)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = (self._get_position_from_instance(self.page[0], self.ordering)
+                    if self.page else self.previous_position)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
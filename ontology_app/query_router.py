@@ -0,0 +1,225 @@
+"""
+Hybrid query routing between PostgreSQL (ORM) and Fuseki (SPARQL).
+
+Each logical query is registered with an equivalent plan per backend, both
+returning the same flat rows. The router keeps an exponentially weighted
+latency and error rate per backend, sends each call to the cheaper healthy
+one, and falls back to the other when a backend fails or its circuit is open.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Medecin, Traitement
+from .sparql_columns import ColumnarResult
+from .sparql_queries import OntologyQuery
+
+POSTGRESQL = 'postgresql'
+SPARQL = 'sparql'
+BACKENDS = (POSTGRESQL, SPARQL)
+
+
+class BackendHealth:
+    """Latency/error estimates and circuit breaker state of one backend"""
+
+    def __init__(self, alpha, failure_threshold, cooldown):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.calls = 0
+        self.failures = 0
+
+    def available(self, now):
+        return now >= self.open_until
+
+    def cost(self):
+        # Unmeasured backends cost nothing so they get sampled at least once
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + 10 * self.error_rate)
+
+    def record_success(self, elapsed):
+        self.calls += 1
+        self.latency = elapsed if self.latency is None else (
+            self.alpha * elapsed + (1 - self.alpha) * self.latency)
+        self.error_rate = (1 - self.alpha) * self.error_rate
+        self.consecutive_failures = 0
+
+    def record_failure(self, now):
+        self.calls += 1
+        self.failures += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.open_until = now + self.cooldown
+
+    def stats(self, now):
+        return {
+            'latency_ms': round(self.latency * 1000, 3) if self.latency is not None else None,
+            'error_rate': round(self.error_rate, 4),
+            'calls': self.calls,
+            'failures': self.failures,
+            'circuit_open': not self.available(now),
+        }
+
+
+class QueryRouter:
+    def __init__(self, alpha=0.2, failure_threshold=3, cooldown=30, probe_every=20):
+        self.probe_every = probe_every
+        self._plans = {}
+        self._health = {backend: BackendHealth(alpha, failure_threshold, cooldown) for backend in BACKENDS}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def register(self, name, orm, sparql):
+        self._plans[name] = {POSTGRESQL: orm, SPARQL: sparql}
+
+    @property
+    def queries(self):
+        return list(self._plans)
+
+    def _order(self):
+        """Backends to try, cheapest healthy one first"""
+        now = time.monotonic()
+        with self._lock:
+            self._calls += 1
+            healthy = sorted(
+                (b for b in BACKENDS if self._health[b].available(now)),
+                key=lambda b: self._health[b].cost(),
+            )
+            # Periodically send one call to the runner-up to refresh its estimate
+            if len(healthy) > 1 and self.probe_every and self._calls % self.probe_every == 0:
+                healthy.reverse()
+            # With every circuit open, still try rather than fail outright
+            fallback = [b for b in BACKENDS if b not in healthy]
+        return healthy + fallback
+
+    def execute(self, name, *args, source=None, **kwargs):
+        """Run a logical query; returns (backend used, rows)"""
+        plans = self._plans[name]
+        order = [source] if source in BACKENDS else self._order()
+        last_error = None
+        for backend in order:
+            started = time.perf_counter()
+            try:
+                rows = plans[backend](*args, **kwargs)
+            except Exception as e:
+                with self._lock:
+                    self._health[backend].record_failure(time.monotonic())
+                last_error = e
+                continue
+            with self._lock:
+                self._health[backend].record_success(time.perf_counter() - started)
+            return backend, rows
+        raise last_error
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'queries': self.queries,
+                'backends': {backend: health.stats(now) for backend, health in self._health.items()},
+            }
+
+
+def _sparql_rows(results):
+    columns = ColumnarResult.from_sparql(results)
+    return [dict(zip(columns.columns, row)) for row in columns.rows()]
+
+
+def _sorted(rows, *keys):
+    """Same total order for both plans, whatever the backend does with ties"""
+    return sorted(rows, key=lambda row: tuple(
+        (row[key] is None, row[key] if row[key] is not None else 0) for key in keys))
+
+
+def _by_experience(rows):
+    return sorted(rows, key=lambda row: (-(row['anneesExperience'] or 0), row['nom'], row['prenom']))
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _ontology():
+    # Errors must surface so the router can count them and fall back
+    return OntologyQuery(raise_errors=True)
+
+
+def eco_traitements_orm(score_max=5.0):
+    traitements = Traitement.objects.filter(
+        impact_environnemental__score_carbone__lte=score_max
+    ).order_by('impact_environnemental__score_carbone').values_list(
+        'nom_traitement', 'impact_environnemental__score_carbone', 'efficacite',
+        'impact_environnemental__consommation_eau', 'impact_environnemental__recyclable',
+    )
+    return _sorted([
+        {'nomTraitement': nom, 'scoreCarbone': _float(score), 'efficacite': _float(efficacite),
+         'consommationEau': _float(eau), 'recyclable': recyclable}
+        for nom, score, efficacite, eau, recyclable in traitements
+    ], 'scoreCarbone', 'nomTraitement')
+
+
+def eco_traitements_sparql(score_max=5.0):
+    rows = _sparql_rows(_ontology().get_traitements_eco_responsables(score_max))
+    return _sorted(rows, 'scoreCarbone', 'nomTraitement')
+
+
+def traitements_for_maladie_orm(maladie_nom):
+    traitements = Traitement.objects.filter(
+        maladie__nom_maladie=maladie_nom
+    ).order_by('impact_environnemental__score_carbone').values_list(
+        'nom_traitement', 'cout', 'efficacite', 'impact_environnemental__score_carbone',
+    )
+    return _sorted([
+        {'nomTraitement': nom, 'cout': _float(cout), 'efficacite': _float(efficacite),
+         'scoreCarbone': _float(score)}
+        for nom, cout, efficacite, score in traitements
+    ], 'scoreCarbone', 'nomTraitement')
+
+
+def traitements_for_maladie_sparql(maladie_nom):
+    rows = _sparql_rows(_ontology().get_traitements_for_maladie(maladie_nom))
+    for row in rows:
+        row.pop('traitement', None)
+    return _sorted(rows, 'scoreCarbone', 'nomTraitement')
+
+
+def medecins_by_specialite_orm(specialite):
+    medecins = Medecin.objects.filter(specialite=specialite).order_by('-annees_experience')
+    return _by_experience([
+        {'nom': nom, 'prenom': prenom, 'anneesExperience': experience}
+        for nom, prenom, experience in medecins.values_list('nom', 'prenom', 'annees_experience')
+    ])
+
+
+def medecins_by_specialite_sparql(specialite):
+    # The literal, not the class: 'autre' and unknown codes have no class of their own
+    results = _ontology().get_medecins_with_specialite(specialite)
+    rows = _sparql_rows(results)
+    for row in rows:
+        row.pop('medecin', None)
+    return _by_experience(rows)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Return the process-wide QueryRouter with every logical query registered"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                router = QueryRouter(**settings.QUERY_ROUTER)
+                router.register('eco_traitements', eco_traitements_orm, eco_traitements_sparql)
+                router.register('traitements_maladie', traitements_for_maladie_orm, traitements_for_maladie_sparql)
+                router.register('medecins_specialite', medecins_by_specialite_orm, medecins_by_specialite_sparql)
+                _router = router
+    return _router
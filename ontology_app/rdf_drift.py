@@ -0,0 +1,216 @@
+"""
+PostgreSQL vs Fuseki drift detection.
+
+Every triple whose subject is a resource (Patient_12, Traitement_3, ...)
+is hashed the same way on both sides: the first DIGEST_HEX_DIGITS hex
+digits of MD5("s p o datatype") read as an integer. A set of triples is
+summarised by its count and the sum of those integers, which SPARQL can
+compute with SUM() and which do not depend on triple order.
+
+The database side is not hashed on each run: RdfDigest holds the summary
+of every resource as sync_fuseki last wrote it (see rdf_sync.store_digests),
+and rebuild_digests() recomputes a whole kind after a full reload or bulk
+changes that sent no signals. Pending outbox rows are sync lag, not drift.
+
+Comparison is hierarchical: one pass over the triples of an entity type
+gives per-range summaries, then only the ranges whose summaries differ
+are split FANOUT ways, down to single resources. Past the first pass, the
+store only reads the triples of subjects in differing ranges, listed in a
+VALUES block once the ranges are narrow enough, so the queries and the
+triples they hash grow with the number of differences.
+"""
+import operator
+from decimal import Decimal
+from functools import reduce
+
+from django.db.models import F, Max, Q, Sum
+
+from .graph_versions import get_current_graph
+from .models import Diagnostic, Prescription, RdfDigest
+from .rdf_mapping import DIGEST_HEX_DIGITS, NAMESPACE, XSD, iri, resource, triple_digest, triples_digest
+from .rdf_sync import SUBJECT_KINDS
+
+FANOUT = 16
+HEX_DIGITS = '0123456789abcdef'
+# Ranges per SPARQL query, to keep the FILTER expression reasonably small
+RANGES_PER_QUERY = 64
+# Differing ranges spanning at most this many ids are read subject by subject
+VALUES_MAX_IDS = 4096
+VALUES_PER_QUERY = 512
+BATCH_SIZE = 2000
+
+# Class every resource of a kind is typed with
+KIND_CLASSES = {'Impact': 'ImpactEnvironnemental'}
+
+# Link triples hanging off a subject kind: (predicate, target kind, (subject_id, target_id) rows)
+LINKS = {
+    'Patient': [('diagnostiquePour', 'Maladie', lambda: Diagnostic.objects.values_list(
+        'patient_id', 'maladie_id').order_by().distinct())],
+    'Medecin': [('prescrit', 'Traitement', lambda: Prescription.objects.values_list(
+        'diagnostic__medecin_id', 'traitement_id').order_by().distinct())],
+}
+
+
+def _sparql_digest(var):
+    """SPARQL expression turning the MD5 hex string in `var` into the same integer"""
+    terms = [
+        f'STRLEN(STRBEFORE("{HEX_DIGITS}", SUBSTR({var}, {i + 1}, 1))) * {16 ** (DIGEST_HEX_DIGITS - 1 - i)}'
+        for i in range(DIGEST_HEX_DIGITS)
+    ]
+    return ' + '.join(terms)
+
+
+def _merge(buckets, more):
+    """Add the (count, digest) summaries of `more` to `buckets`: a bucket may span two queries"""
+    for bucket, (count, digest) in more.items():
+        previous = buckets.get(bucket, (0, 0))
+        buckets[bucket] = (previous[0] + count, previous[1] + digest)
+    return buckets
+
+
+def digest_kinds(kind):
+    """RdfDigest kinds summed into the resources of a subject kind: its own and its links"""
+    return [kind] + [predicate for predicate, _, _ in LINKS.get(kind, [])]
+
+
+def rebuild_digests(kinds=None):
+    """Recompute the stored digests of whole kinds from the database; returns the resources hashed"""
+    resources = 0
+    for kind in kinds or SUBJECT_KINDS:
+        model, build = SUBJECT_KINDS[kind]
+        RdfDigest.objects.filter(kind__in=digest_kinds(kind)).delete()
+        batch = []
+        for instance in model.objects.all().iterator(chunk_size=BATCH_SIZE):
+            count, digest = triples_digest(build(instance))
+            batch.append(RdfDigest(kind=kind, object_id=instance.pk, triples=count, digest=digest))
+            resources += 1
+            if len(batch) >= BATCH_SIZE:
+                RdfDigest.objects.bulk_create(batch)
+                batch = []
+        RdfDigest.objects.bulk_create(batch)
+
+        for predicate, target_kind, rows in LINKS.get(kind, []):
+            links = {}
+            for subject_id, target_id in rows():
+                digest = triple_digest(resource(kind, subject_id), iri(predicate), resource(target_kind, target_id))
+                count, total = links.get(subject_id, (0, 0))
+                links[subject_id] = (count + 1, total + digest)
+            RdfDigest.objects.bulk_create(
+                [RdfDigest(kind=predicate, object_id=pk, triples=count, digest=total)
+                 for pk, (count, total) in links.items()],
+                batch_size=BATCH_SIZE,
+            )
+    return resources
+
+
+class DriftChecker:
+    def __init__(self, client, graph=None, fanout=FANOUT):
+        self.client = client
+        self.graph = graph if graph is not None else get_current_graph(client)
+        self.fanout = fanout
+        self.queries = 0
+
+    def _query_buckets(self, kind, width, subjects):
+        """{bucket: (count, digest)} of the triples of the subjects a SPARQL pattern binds to ?s and ?id"""
+        query = f"""
+        PREFIX xsd: <{XSD}>
+        SELECT ?bucket (COUNT(*) AS ?triples) (SUM(?h) AS ?digest)
+        WHERE {{
+            {subjects}
+            ?s ?p ?o .
+            BIND (MD5(CONCAT(STR(?s), " ", STR(?p), " ", STR(?o), " ",
+                             IF(isLITERAL(?o), STR(DATATYPE(?o)), ""))) AS ?md5)
+            BIND ({_sparql_digest('?md5')} AS ?h)
+            BIND (xsd:integer(FLOOR(?id / {width})) AS ?bucket)
+        }}
+        GROUP BY ?bucket
+        """
+        self.queries += 1
+        results = self.client.query(query, name='drift_digests', default_graph=self.graph)
+        return {
+            int(Decimal(row['bucket']['value'])): (int(row['triples']['value']), int(Decimal(row['digest']['value'])))
+            for row in results['results']['bindings']
+        }
+
+    def _typed_subjects(self, kind, ranges):
+        """Pattern binding the resources of a kind, through its class, within [lo, hi) ranges"""
+        prefix = f'{NAMESPACE}{kind}_'
+        range_filter = ' || '.join(f'(?id >= {lo} && ?id < {hi})' for lo, hi in ranges) if ranges else 'true'
+        return f"""{{ SELECT ?s ?id WHERE {{
+                ?s a {iri(KIND_CLASSES.get(kind, kind))} .
+                BIND (xsd:integer(STRAFTER(STR(?s), "{prefix}")) AS ?id)
+                FILTER (BOUND(?id) && ({range_filter}))
+            }} }}"""
+
+    @staticmethod
+    def _listed_subjects(kind, ids):
+        rows = ' '.join(f'({resource(kind, pk)} {pk})' for pk in ids)
+        return f'VALUES (?s ?id) {{ {rows} }}'
+
+    def _remote_buckets(self, kind, width, ranges=None):
+        """{bucket: (count, digest)} of the store for id // width, within [lo, hi) ranges (None: all)"""
+        if ranges is None:
+            return self._query_buckets(kind, width, self._typed_subjects(kind, None))
+        buckets = {}
+        if sum(hi - lo for lo, hi in ranges) <= VALUES_MAX_IDS:
+            ids = [pk for lo, hi in ranges for pk in range(lo, hi)]
+            for i in range(0, len(ids), VALUES_PER_QUERY):
+                _merge(buckets, self._query_buckets(kind, width, self._listed_subjects(kind, ids[i:i + VALUES_PER_QUERY])))
+            return buckets
+        for i in range(0, len(ranges), RANGES_PER_QUERY):
+            subjects = self._typed_subjects(kind, ranges[i:i + RANGES_PER_QUERY])
+            _merge(buckets, self._query_buckets(kind, width, subjects))
+        return buckets
+
+    @staticmethod
+    def _local_buckets(kind, width, ranges=None):
+        """{bucket: (count, digest)} of the stored digests, like _remote_buckets"""
+        digests = RdfDigest.objects.filter(kind__in=digest_kinds(kind))
+        batches = [None] if ranges is None else [ranges[i:i + RANGES_PER_QUERY]
+                                                 for i in range(0, len(ranges), RANGES_PER_QUERY)]
+        buckets = {}
+        for batch in batches:
+            rows = digests
+            if batch is not None:
+                rows = rows.filter(reduce(operator.or_, (Q(object_id__gte=lo, object_id__lt=hi) for lo, hi in batch)))
+            rows = (rows.annotate(bucket=F('object_id') / width).values('bucket')
+                    .annotate(count=Sum('triples'), total=Sum('digest')).order_by())
+            _merge(buckets, {row['bucket']: (row['count'], row['total']) for row in rows})
+        return buckets
+
+    def check_kind(self, kind):
+        """{'missing': [...], 'extra': [...], 'different': [...]} resource names for one kind"""
+        model, _ = SUBJECT_KINDS[kind]
+        stored = RdfDigest.objects.filter(kind=kind)
+        if not stored.exists() and model.objects.exists():
+            # Nothing recorded yet (first run after the migration)
+            rebuild_digests([kind])
+        report = {'missing': [], 'extra': [], 'different': [], 'resources': stored.count()}
+
+        # Top level: at most FANOUT buckets over the whole kind, in one pass
+        max_id = RdfDigest.objects.filter(kind__in=digest_kinds(kind)).aggregate(Max('object_id'))['object_id__max']
+        width = 1
+        while width * self.fanout <= (max_id or 0):
+            width *= self.fanout
+        ranges = None
+        while True:
+            remote = self._remote_buckets(kind, width, ranges)
+            mine = self._local_buckets(kind, width, ranges)
+            differing = sorted(b for b in set(remote) | set(mine) if remote.get(b) != mine.get(b))
+            if width == 1:
+                for pk in differing:
+                    name = f'{kind}_{pk}'
+                    if pk not in remote:
+                        report['missing'].append(name)
+                    elif pk not in mine:
+                        report['extra'].append(name)
+                    else:
+                        report['different'].append(name)
+                return report
+            if not differing:
+                return report
+            ranges = [(b * width, (b + 1) * width) for b in differing]
+            width //= self.fanout
+
+    def check(self, kinds=None):
+        return {kind: self.check_kind(kind) for kind in (kinds or SUBJECT_KINDS)}
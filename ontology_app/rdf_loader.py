@@ -0,0 +1,235 @@
+"""
+Bulk loading of the Django data into Fuseki.
+
+Triples are cut into chunks of a configurable size and each chunk is sent
+in a single request, either as an N-Triples / Turtle document through the
+SPARQL Graph Store protocol or as one large INSERT DATA update, instead
+of one request per entity.
+
+Chunks can be sent by a pool of worker threads. Adding triples is
+idempotent, so a failed chunk is simply re-sent with exponential backoff;
+chunks that still fail are written to a JSON Lines failure manifest that
+BulkLoader.replay() sends again later.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from .rdf_mapping import ENTITY_MAPPINGS, to_ntriples, to_turtle
+from .sparql_cache import bump_dataset_generation
+
+logger = logging.getLogger(__name__)
+
+METHODS = ('gsp', 'update')
+FORMATS = {
+    'nt': ('application/n-triples', to_ntriples),
+    'turtle': ('text/turtle', to_turtle),
+}
+DEFAULT_CHUNK_SIZE = 5000
+# HTTP statuses worth retrying; other 4xx mean the request itself is wrong
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def iter_chunks(triples, chunk_size):
+    """Group an iterable of triples into lists of at most chunk_size"""
+    chunk = []
+    for triple in triples:
+        chunk.append(triple)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert_data(triples, graph=None):
+    """INSERT DATA update for a chunk of triples (or an N-Triples document)"""
+    body = triples if isinstance(triples, str) else to_ntriples(triples)
+    if graph:
+        body = f'GRAPH <{graph}> {{\n{body}}}'
+    return f'INSERT DATA {{\n{body}}}'
+
+
+def is_retryable(error):
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRYABLE_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class LoadStats:
+    def __init__(self):
+        self.triples = 0
+        self.chunks = 0
+        self.retries = 0
+        self.failed_chunks = 0
+        self.failed_triples = 0
+        self.started = time.perf_counter()
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def triples_per_second(self):
+        seconds = self.seconds
+        return self.triples / seconds if seconds else 0.0
+
+    def to_dict(self):
+        return {
+            'triples': self.triples,
+            'chunks': self.chunks,
+            'retries': self.retries,
+            'failed_chunks': self.failed_chunks,
+            'failed_triples': self.failed_triples,
+            'seconds': round(self.seconds, 3),
+            'triples_per_second': round(self.triples_per_second, 1),
+        }
+
+
+class BulkLoader:
+    """
+    Sends triples to Fuseki chunk by chunk.
+
+    method: 'gsp' (Graph Store protocol upload) or 'update' (INSERT DATA)
+    rdf_format: 'nt' or 'turtle', for the Graph Store protocol
+    concurrency: chunks in flight at once (worker threads)
+    retries / backoff: re-sends of a failed chunk, waiting backoff * 2**attempt
+    (with jitter, capped at max_backoff) seconds between them
+    progress: optional callable(label, LoadStats) called after every chunk
+    """
+
+    def __init__(self, client, chunk_size=DEFAULT_CHUNK_SIZE, method='gsp',
+                 rdf_format='nt', graph=None, progress=None, concurrency=1,
+                 retries=3, backoff=0.5, max_backoff=30.0):
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}")
+        if rdf_format not in FORMATS:
+            raise ValueError(f"rdf_format must be one of {list(FORMATS)}")
+        self.client = client
+        self.chunk_size = chunk_size
+        self.method = method
+        self.rdf_format = rdf_format
+        self.graph = graph
+        self.progress = progress
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # (label, chunk, error) of every chunk that failed all its attempts
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def send_chunk(self, chunk):
+        if isinstance(chunk, str):
+            # Replayed chunks are stored as N-Triples whatever the original format
+            content_type, data = FORMATS['nt'][0], chunk
+        else:
+            content_type, serialize = FORMATS[self.rdf_format]
+            data = serialize(chunk) if self.method == 'gsp' else None
+        if self.method == 'gsp':
+            self.client.upload(data, content_type, graph=self.graph)
+        else:
+            self.client.update(insert_data(chunk, self.graph), name='bulk_insert')
+
+    def _send_with_retries(self, chunk, stats):
+        attempt = 0
+        while True:
+            try:
+                self.send_chunk(chunk)
+                return None
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    return e
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                attempt += 1
+                with self._lock:
+                    stats.retries += 1
+                logger.warning(f"Chunk failed ({e}), retry {attempt}/{self.retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _chunk_done(self, label, chunk, error, stats):
+        size = _chunk_size(chunk)
+        with self._lock:
+            if error is None:
+                stats.triples += size
+                stats.chunks += 1
+            else:
+                stats.failed_chunks += 1
+                stats.failed_triples += size
+                self.failures.append((label, chunk, error))
+            if self.progress:
+                self.progress(label, stats)
+
+    def load(self, triples, label='', stats=None):
+        """Send every triple of the iterable; returns the LoadStats"""
+        stats = stats or LoadStats()
+        if self.concurrency == 1:
+            for chunk in iter_chunks(triples, self.chunk_size):
+                self._chunk_done(label, chunk, self._send_with_retries(chunk, stats), stats)
+            return stats
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = {}
+            for chunk in iter_chunks(triples, self.chunk_size):
+                # Bounded: never serialize more chunks than the workers can take
+                if len(in_flight) >= self.concurrency * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._chunk_done(label, in_flight.pop(future), future.result(), stats)
+                in_flight[pool.submit(self._send_with_retries, chunk, stats)] = chunk
+            for future, chunk in in_flight.items():
+                self._chunk_done(label, chunk, future.result(), stats)
+        return stats
+
+    def load_dataset(self, mappings=ENTITY_MAPPINGS):
+        """Load every entity type; returns {label: stats dict} plus a 'total' entry"""
+        report = {}
+        total = LoadStats()
+        for label, queryset, build in mappings:
+            stats = self.load(
+                (triple for instance in queryset().iterator(chunk_size=2000) for triple in build(instance)),
+                label,
+            )
+            for field in ('triples', 'chunks', 'retries', 'failed_chunks', 'failed_triples'):
+                setattr(total, field, getattr(total, field) + getattr(stats, field))
+            report[label] = stats.to_dict()
+        bump_dataset_generation()
+        report['total'] = total.to_dict()
+        return report
+
+    def write_failures(self, path):
+        """Write the failed chunks as a JSON Lines manifest; returns the number of entries"""
+        with open(path, 'w', encoding='utf-8') as manifest:
+            for label, chunk, error in self.failures:
+                manifest.write(json.dumps({
+                    'label': label,
+                    'method': self.method,
+                    'graph': self.graph,
+                    'triples': _chunk_size(chunk),
+                    'error': str(error),
+                    'data': chunk if isinstance(chunk, str) else to_ntriples(chunk),
+                }, ensure_ascii=False) + '\n')
+        return len(self.failures)
+
+    def replay(self, path):
+        """Re-send the chunks of a failure manifest; failures are collected again"""
+        stats = LoadStats()
+        with open(path, encoding='utf-8') as manifest:
+            for line in manifest:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.graph = entry.get('graph', self.graph)
+                chunk = entry['data']
+                self._chunk_done(entry['label'], chunk, self._send_with_retries(chunk, stats), stats)
+        bump_dataset_generation()
+        return stats
+
+
+def _chunk_size(chunk):
+    return chunk.count('\n') if isinstance(chunk, str) else len(chunk)
@@ -0,0 +1,247 @@
+"""
+Mapping of the Django models to the health ontology.
+
+Every function returns (subject, predicate, object) triples whose terms
+are already in N-Triples syntax, so they can be embedded in SPARQL
+INSERT DATA requests, written to .nt files or parsed by rdflib.
+"""
+import hashlib
+import re
+
+from .models import (
+    Patient, Medecin, Maladie, ImpactEnvironnemental, Traitement,
+    Diagnostic, Prescription
+)
+from .sparql_stream import parse_tsv_term
+
+NAMESPACE = 'http://example.org/health#'
+RDF_TYPE = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+RDF_LANG_STRING = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#langString'
+# Triple digests are this many hex digits of an MD5: 32 bits, so sums over
+# up to 2**31 triples fit in a 64-bit integer column (see rdf_drift)
+DIGEST_HEX_DIGITS = 8
+
+SPECIALITE_CLASSES = {
+    'generaliste': 'Generaliste',
+    'cardiologue': 'Cardiologue',
+    'pneumologue': 'Pneumologue',
+}
+
+MALADIE_CLASSES = {
+    'chronique': 'MaladieChronique',
+    'aigue': 'MaladieAigue',
+    'infectieuse': 'MaladieInfectieuse',
+    'cardiovasculaire': 'MaladieCardiovasculaire',
+    'respiratoire': 'MaladieRespiratoire',
+}
+
+TRAITEMENT_CLASSES = {
+    'medicamenteux': 'TraitementMedicamenteux',
+    'chirurgie': 'Chirurgie',
+    'physiotherapie': 'Physiotherapie',
+    'radiotherapie': 'Radiotherapie',
+    'psychotherapie': 'Psychotherapie',
+}
+
+
+def escape_literal(s):
+    """Escape special characters for a quoted SPARQL / N-Triples string"""
+    if s is None:
+        return ""
+    s = str(s)
+    # Escape backslashes first, then quotes
+    s = s.replace('\\', '\\\\')
+    s = s.replace('"', '\\"')
+    s = s.replace('\n', '\\n')
+    s = s.replace('\r', '\\r')
+    return s
+
+
+def iri(name):
+    return f'<{NAMESPACE}{name}>'
+
+
+def resource(kind, pk):
+    """IRI of a model instance, e.g. health:Patient_12"""
+    return iri(f'{kind}_{pk}')
+
+
+def string(value):
+    return f'"{escape_literal(value)}"'
+
+
+def typed(value, datatype):
+    return f'"{escape_literal(value)}"^^<{XSD}{datatype}>'
+
+
+def decimal(value):
+    return typed(float(value), 'decimal')
+
+
+def integer(value):
+    return typed(int(value), 'integer')
+
+
+def boolean(value):
+    return typed(str(bool(value)).lower(), 'boolean')
+
+
+def _date_triple(subject, value):
+    # A missing date has no triple rather than a "None"^^xsd:date literal
+    return [(subject, iri('dateNaissance'), typed(value.isoformat(), 'date'))] if value else []
+
+
+def patient_triples(patient):
+    s = resource('Patient', patient.id)
+    return [
+        (s, RDF_TYPE, iri('Patient')),
+        (s, iri('nom'), string(patient.nom)),
+        (s, iri('prenom'), string(patient.prenom)),
+        (s, iri('email'), string(patient.email)),
+        *_date_triple(s, patient.date_naissance),
+        (s, iri('sexe'), string(patient.sexe)),
+        (s, iri('numeroSecuriteSociale'), string(patient.numero_securite_sociale)),
+        (s, iri('groupeSanguin'), string(patient.groupe_sanguin or '')),
+        (s, iri('IMC'), decimal(patient.imc or 0)),
+    ]
+
+
+def medecin_triples(medecin):
+    s = resource('Medecin', medecin.id)
+    return [
+        (s, RDF_TYPE, iri(SPECIALITE_CLASSES.get(medecin.specialite, 'Medecin'))),
+        (s, RDF_TYPE, iri('Medecin')),
+        (s, iri('nom'), string(medecin.nom)),
+        (s, iri('prenom'), string(medecin.prenom)),
+        (s, iri('email'), string(medecin.email)),
+        *_date_triple(s, medecin.date_naissance),
+        (s, iri('sexe'), string(medecin.sexe)),
+        (s, iri('numeroOrdre'), string(medecin.numero_ordre)),
+        (s, iri('specialite'), string(medecin.specialite)),
+        (s, iri('anneesExperience'), integer(medecin.annees_experience)),
+    ]
+
+
+def maladie_triples(maladie):
+    s = resource('Maladie', maladie.id)
+    return [
+        (s, RDF_TYPE, iri(MALADIE_CLASSES.get(maladie.type_maladie, 'Maladie'))),
+        (s, RDF_TYPE, iri('Maladie')),
+        (s, iri('nomMaladie'), string(maladie.nom_maladie)),
+        (s, iri('codeCIM10'), string(maladie.code_cim10 or '')),
+        (s, iri('gravite'), string(maladie.gravite)),
+        (s, iri('contagieuse'), boolean(maladie.contagieuse)),
+        (s, iri('tauxMortalite'), decimal(maladie.taux_mortalite)),
+    ]
+
+
+def impact_triples(impact):
+    s = resource('Impact', impact.id)
+    return [
+        (s, RDF_TYPE, iri('ImpactEnvironnemental')),
+        (s, iri('scoreCarbone'), decimal(impact.score_carbone)),
+        (s, iri('consommationEau'), decimal(impact.consommation_eau)),
+        (s, iri('dechets'), decimal(impact.dechets)),
+        (s, iri('recyclable'), boolean(impact.recyclable)),
+    ]
+
+
+def traitement_triples(traitement):
+    s = resource('Traitement', traitement.id)
+    triples = [
+        (s, RDF_TYPE, iri(TRAITEMENT_CLASSES.get(traitement.type_traitement, 'Traitement'))),
+        (s, RDF_TYPE, iri('Traitement')),
+        (s, iri('nomTraitement'), string(traitement.nom_traitement)),
+        (s, iri('cout'), decimal(traitement.cout)),
+        (s, iri('duree'), integer(traitement.duree)),
+        (s, iri('efficacite'), decimal(traitement.efficacite)),
+        (s, iri('traite'), resource('Maladie', traitement.maladie_id)),
+    ]
+    if traitement.impact_environnemental_id:
+        triples.append((s, iri('aImpact'), resource('Impact', traitement.impact_environnemental_id)))
+    return triples
+
+
+def diagnostic_triples(diagnostic):
+    """A diagnostic is stored as a patient -> disease link"""
+    return [(resource('Patient', diagnostic.patient_id), iri('diagnostiquePour'),
+             resource('Maladie', diagnostic.maladie_id))]
+
+
+def prescription_triples(prescription):
+    """A prescription is stored as a doctor -> treatment link"""
+    return [(resource('Medecin', prescription.diagnostic.medecin_id), iri('prescrit'),
+             resource('Traitement', prescription.traitement_id))]
+
+
+# (label, queryset factory, triple builder) in load order
+ENTITY_MAPPINGS = [
+    ('Patients', lambda: Patient.objects.all(), patient_triples),
+    ('Médecins', lambda: Medecin.objects.all(), medecin_triples),
+    ('Maladies', lambda: Maladie.objects.all(), maladie_triples),
+    ('Impacts Environnementaux', lambda: ImpactEnvironnemental.objects.all(), impact_triples),
+    ('Traitements', lambda: Traitement.objects.all(), traitement_triples),
+    ('Diagnostics', lambda: Diagnostic.objects.all(), diagnostic_triples),
+    ('Prescriptions', lambda: Prescription.objects.select_related('diagnostic'), prescription_triples),
+]
+
+
+def iter_dataset_triples():
+    """Every triple of the Django database, entity type by entity type"""
+    for _, queryset, build in ENTITY_MAPPINGS:
+        for instance in queryset().iterator(chunk_size=2000):
+            yield from build(instance)
+
+
+def ontology_triples(path):
+    """Triples of the OWL ontology file, in the same N-Triples term form"""
+    from rdflib import Graph
+
+    graph = Graph()
+    graph.parse(path, format='xml')
+    for s, p, o in graph:
+        yield s.n3(), p.n3(), o.n3()
+
+
+def _term_parts(term):
+    """(value, datatype) of an N-Triples term, matching STR() and DATATYPE() in SPARQL"""
+    if term.startswith('<'):
+        return term[1:-1], ''
+    parsed = parse_tsv_term(term)
+    if 'xml:lang' in parsed:
+        return parsed['value'], RDF_LANG_STRING
+    return parsed['value'], parsed.get('datatype', XSD + 'string')
+
+
+def triple_digest(s, p, o):
+    """Integer hash of a triple, computed the same way by SPARQL in rdf_drift"""
+    value, datatype = _term_parts(o)
+    line = f'{s[1:-1]} {p[1:-1]} {value} {datatype}'
+    return int(hashlib.md5(line.encode('utf-8')).hexdigest()[:DIGEST_HEX_DIGITS], 16)
+
+
+def triples_digest(triples):
+    """(triple count, digest sum) of a set of triples; a store keeps a repeated triple once"""
+    distinct = set(triples)
+    return len(distinct), sum(triple_digest(*triple) for triple in distinct)
+
+
+def to_ntriples(triples):
+    """N-Triples document (or INSERT DATA body) for a list of triples"""
+    return ''.join(f'{s} {p} {o} .\n' for s, p, o in triples)
+
+
+TURTLE_PREFIX = f'@prefix health: <{NAMESPACE}> .\n'
+_NAMESPACE_IRI_RE = re.compile(rf'^<{re.escape(NAMESPACE)}([A-Za-z_][A-Za-z0-9_-]*)>$')
+
+
+def _abbreviate(term):
+    match = _NAMESPACE_IRI_RE.match(term)
+    return f'health:{match.group(1)}' if match else term
+
+
+def to_turtle(triples):
+    """Turtle document for a list of triples, health: IRIs written as prefixed names"""
+    body = ''.join(f'{_abbreviate(s)} {_abbreviate(p)} {_abbreviate(o)} .\n' for s, p, o in triples)
+    return TURTLE_PREFIX + body
@@ -0,0 +1,171 @@
+"""
+Incremental synchronisation of the Django data to Fuseki.
+
+Model signals (see signals.py) write RdfOutbox rows in the same transaction
+as the change itself. The applier (manage.py sync_fuseki) reads pending
+rows in batches, coalesces them per resource and, for each one, replaces
+the triples it owns with the ones built from the current database row:
+a deleted row simply leaves nothing to insert. Every delta is therefore
+idempotent and can be re-sent safely after a failure. Deltas target the
+current version graph (see graph_versions) and are held back while a
+full reload builds the next one. Once a delta is applied, the digest of
+the triples it wrote is stored in RdfDigest for check_drift.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from .graph_versions import get_current_graph, reload_in_progress
+from .models import (
+    Patient, Medecin, Maladie, ImpactEnvironnemental, Traitement,
+    Diagnostic, Prescription, RdfDigest, RdfOutbox,
+)
+from .rdf_mapping import (
+    iri, resource, to_ntriples, triples_digest,
+    patient_triples, medecin_triples, maladie_triples, impact_triples, traitement_triples,
+)
+
+logger = logging.getLogger(__name__)
+
+# Resources whose own triples (everything except the link predicates) are rebuilt
+SUBJECT_KINDS = {
+    'Patient': (Patient, patient_triples),
+    'Medecin': (Medecin, medecin_triples),
+    'Maladie': (Maladie, maladie_triples),
+    'Impact': (ImpactEnvironnemental, impact_triples),
+    'Traitement': (Traitement, traitement_triples),
+}
+
+# Link predicates derived from Diagnostic / Prescription rows: (subject kind, targets query)
+LINK_KINDS = {
+    'diagnostiquePour': ('Patient', 'Maladie', lambda pk: Diagnostic.objects.filter(
+        patient_id=pk).values_list('maladie_id', flat=True).order_by().distinct()),
+    'prescrit': ('Medecin', 'Traitement', lambda pk: Prescription.objects.filter(
+        diagnostic__medecin_id=pk).values_list('traitement_id', flat=True).order_by().distinct()),
+}
+
+
+def enqueue(kind, object_id, operation='save'):
+    """Record that the triples of (kind, object_id) must be rebuilt"""
+    if object_id is None or not settings.RDF_SYNC['ENABLED']:
+        return
+    RdfOutbox.objects.create(kind=kind, object_id=object_id, operation=operation)
+
+
+def _with(graph):
+    return f'WITH <{graph}> ' if graph else ''
+
+
+def _insert_data(triples, graph):
+    body = to_ntriples(triples)
+    return f'INSERT DATA {{ GRAPH <{graph}> {{\n{body}}} }}' if graph else f'INSERT DATA {{\n{body}}}'
+
+
+def owned_triples(kind, pk):
+    """
+    Triples (kind, pk) owns in the store, built from the database: the own
+    triples of a resource, or its links of one predicate. Empty once deleted.
+    """
+    if kind in SUBJECT_KINDS:
+        model, build = SUBJECT_KINDS[kind]
+        instance = model.objects.filter(pk=pk).first()
+        return build(instance) if instance is not None else []
+    subject_kind, target_kind, targets = LINK_KINDS[kind]
+    subject = resource(subject_kind, pk)
+    return [(subject, iri(kind), resource(target_kind, target)) for target in targets(pk)]
+
+
+def subject_delta(kind, pk, graph=None, triples=None):
+    """DELETE/INSERT operations replacing the own triples of one resource"""
+    subject = resource(kind, pk)
+    links = ', '.join(iri(predicate) for predicate in LINK_KINDS)
+    operations = [
+        f'{_with(graph)}DELETE {{ {subject} ?p ?o }} WHERE {{ {subject} ?p ?o FILTER (?p NOT IN ({links})) }}'
+    ]
+    triples = owned_triples(kind, pk) if triples is None else triples
+    if triples:
+        operations.append(_insert_data(triples, graph))
+    return operations
+
+
+def link_delta(predicate, pk, graph=None, triples=None):
+    """DELETE/INSERT operations replacing every `predicate` link of one resource"""
+    subject_kind, _, _ = LINK_KINDS[predicate]
+    pattern = f'{resource(subject_kind, pk)} {iri(predicate)} ?o'
+    operations = [f'{_with(graph)}DELETE {{ {pattern} }} WHERE {{ {pattern} }}']
+    triples = owned_triples(predicate, pk) if triples is None else triples
+    if triples:
+        operations.append(_insert_data(triples, graph))
+    return operations
+
+
+def build_update(keys, graph=None, owned=None):
+    """
+    One SPARQL update request for a set of (kind, object_id) keys, applied
+    to `graph`; `owned` maps keys to their already built owned_triples()
+    """
+    owned = owned or {}
+    operations = []
+    for kind, pk in keys:
+        if kind in SUBJECT_KINDS:
+            operations.extend(subject_delta(kind, pk, graph, owned.get((kind, pk))))
+        elif kind in LINK_KINDS:
+            operations.extend(link_delta(kind, pk, graph, owned.get((kind, pk))))
+        else:
+            logger.warning(f"Unknown RDF outbox kind: {kind}")
+    return ' ;\n'.join(operations)
+
+
+def store_digests(owned):
+    """Record in RdfDigest the (triple count, digest sum) the store now holds for each key"""
+    by_kind = {}
+    for kind, pk in owned:
+        by_kind.setdefault(kind, []).append(pk)
+    for kind, ids in by_kind.items():
+        RdfDigest.objects.filter(kind=kind, object_id__in=ids).delete()
+    RdfDigest.objects.bulk_create([
+        RdfDigest(kind=kind, object_id=pk, triples=count, digest=digest)
+        for (kind, pk), (count, digest) in ((key, triples_digest(triples)) for key, triples in owned.items())
+        if count
+    ])
+
+
+def apply_pending(client, batch_size=500):
+    """
+    Apply up to batch_size pending outbox rows in one update request.
+    Returns (rows consumed, distinct resources rebuilt). Rows are only
+    deleted once Fuseki has accepted the update, and are kept while a full
+    reload runs: applied to the current graph, they would be lost when the
+    reload switches to its own.
+    """
+    with transaction.atomic():
+        if reload_in_progress():
+            return 0, 0
+        # Concurrent appliers each take a different batch on PostgreSQL
+        events = list(
+            RdfOutbox.objects.select_for_update(skip_locked=True)
+            .order_by('id').values_list('id', 'kind', 'object_id')[:batch_size]
+        )
+        if not events:
+            return 0, 0
+        # Keep first-seen order so deltas are applied in commit order
+        keys = list(dict.fromkeys((kind, pk) for _, kind, pk in events))
+        owned = {key: owned_triples(*key) for key in keys if key[0] in SUBJECT_KINDS or key[0] in LINK_KINDS}
+        # The current version graph, or the default graph before the first versioned reload
+        update = build_update(keys, get_current_graph(client), owned)
+        if update:
+            client.update(update, name='rdf_sync')
+        if reload_in_progress():
+            # The reload began during the update and may not cover these rows:
+            # keep them for its graph (the deltas are idempotent)
+            transaction.set_rollback(True)
+            return 0, 0
+        store_digests(owned)
+        RdfOutbox.objects.filter(id__in=[event_id for event_id, _, _ in events]).delete()
+    return len(events), len(keys)
+
+
+def pending_stats():
+    oldest = RdfOutbox.objects.order_by('id').values_list('created_at', flat=True).first()
+    return {'pending': RdfOutbox.objects.count(), 'oldest': oldest}
@@ -0,0 +1,243 @@
+"""
+Embedded triple store backend (SPARQL_BACKEND = 'rdflib').
+
+The ontology and the Django data are held in an in-process rdflib graph,
+so OntologyQuery runs without a network hop or a Fuseki server. The graph
+is loaded from an N-Triples snapshot when one exists (see the
+build_rdf_snapshot command) and rebuilt from the database otherwise.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.plugins.sparql import prepareQuery
+
+from .sparql_cache import bump_dataset_generation
+from .sparql_metrics import get_metrics, result_rows
+
+logger = logging.getLogger(__name__)
+
+
+def _term(value):
+    if isinstance(value, URIRef):
+        return {"type": "uri", "value": str(value)}
+    if isinstance(value, BNode):
+        return {"type": "bnode", "value": str(value)}
+    term = {"type": "literal", "value": str(value)}
+    if isinstance(value, Literal):
+        if value.language:
+            term["xml:lang"] = value.language
+        elif value.datatype:
+            term["datatype"] = str(value.datatype)
+    return term
+
+
+def result_to_json(result):
+    """Convert an rdflib SELECT/ASK result to the SPARQL JSON structure Fuseki returns"""
+    if result.type == 'ASK':
+        return {"head": {}, "boolean": bool(result.askAnswer)}
+    variables = [str(v) for v in result.vars]
+    bindings = []
+    for row in result:
+        binding = {}
+        for name, value in zip(variables, row):
+            if value is not None:
+                binding[name] = _term(value)
+        bindings.append(binding)
+    return {"head": {"vars": variables}, "results": {"bindings": bindings}}
+
+
+# pyparsing, behind rdflib's SPARQL parser, is not thread-safe: concurrent
+# parses can permanently break its parse actions for the whole process
+_parse_lock = threading.Lock()
+
+
+@lru_cache(maxsize=256)
+def _prepare(query):
+    # Parsing and translating the query costs far more than evaluating it
+    with _parse_lock:
+        return prepareQuery(query)
+
+
+def build_graph(ontology_path=None):
+    """Fresh graph holding the OWL ontology plus every triple of the Django database"""
+    from .rdf_mapping import iter_dataset_triples, to_ntriples
+
+    graph = Graph()
+    ontology_path = ontology_path or settings.RDFLIB_ONTOLOGY_PATH
+    if ontology_path and os.path.exists(ontology_path):
+        graph.parse(ontology_path, format='xml')
+    graph.parse(data=to_ntriples(iter_dataset_triples()), format='nt')
+    return graph
+
+
+def write_snapshot(graph, path):
+    """Write the graph atomically so running processes never read half a file"""
+    tmp_path = f'{path}.tmp'
+    graph.serialize(destination=tmp_path, format='nt', encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+class _ListStream:
+    """SparqlStream-compatible wrapper around already computed bindings"""
+
+    def __init__(self, results):
+        self.vars = results.get("head", {}).get("vars", [])
+        self._bindings = results.get("results", {}).get("bindings", [])
+
+    def __iter__(self):
+        return iter(self._bindings)
+
+    def close(self):
+        pass
+
+
+class ReadWriteLock:
+    """
+    Shared for queries, exclusive for updates: an rdflib graph can be read
+    by several threads at once but not while it is modified. Waiting
+    writers go first so a stream of queries cannot starve an update.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class LocalGraphClient:
+    """Drop-in replacement for SparqlClient answering from an in-process rdflib graph"""
+
+    def __init__(self, snapshot_path=None, ontology_path=None):
+        self.snapshot_path = snapshot_path
+        self.ontology_path = ontology_path
+        self._graph = None
+        self._snapshot_mtime = None
+        # _lock guards loading and the counters, _access the graph itself
+        self._lock = threading.RLock()
+        self._access = ReadWriteLock()
+        self._counters = {'queries': 0, 'updates': 0, 'errors': 0, 'loads': 0}
+        self._last_load_seconds = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.RDFLIB_SNAPSHOT_PATH, settings.RDFLIB_ONTOLOGY_PATH)
+
+    def _snapshot_mtime_now(self):
+        try:
+            return os.stat(self.snapshot_path).st_mtime_ns if self.snapshot_path else None
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        started = time.perf_counter()
+        mtime = self._snapshot_mtime_now()
+        if mtime is not None:
+            graph = Graph()
+            graph.parse(self.snapshot_path, format='nt')
+        else:
+            graph = build_graph(self.ontology_path)
+            if self.snapshot_path:
+                write_snapshot(graph, self.snapshot_path)
+                mtime = self._snapshot_mtime_now()
+        self._graph = graph
+        self._snapshot_mtime = mtime
+        self._counters['loads'] += 1
+        self._last_load_seconds = round(time.perf_counter() - started, 3)
+        logger.info(f"rdflib graph loaded: {len(graph)} triples in {self._last_load_seconds}s")
+
+    @property
+    def graph(self):
+        """The current graph, reloaded when a newer snapshot has been written"""
+        with self._lock:
+            if self._graph is None or self._snapshot_mtime_now() != self._snapshot_mtime:
+                self._load()
+            return self._graph
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def query(self, query, name=None, default_graph=None):
+        # No response body in-process, so only rows are recorded.
+        # The snapshot holds a single version, so default_graph is ignored
+        metrics = get_metrics()
+        self._count('queries')
+        graph = self.graph
+        started = time.perf_counter()
+        try:
+            with self._access.reading():
+                results = result_to_json(graph.query(_prepare(query)))
+        except Exception as e:
+            self._count('errors')
+            metrics.record(name, query, time.perf_counter() - started, error=e)
+            raise
+        metrics.record(name, query, time.perf_counter() - started, rows=result_rows(results))
+        return results
+
+    def query_stream(self, query, result_format='json', name=None, default_graph=None):
+        return _ListStream(self.query(query, name))
+
+    def update(self, update, name='update'):
+        metrics = get_metrics()
+        self._count('updates')
+        graph = self.graph
+        started = time.perf_counter()
+        try:
+            with self._access.writing(), _parse_lock:
+                graph.update(update)
+        except Exception as e:
+            self._count('errors')
+            metrics.record(name, update, time.perf_counter() - started, error=e)
+            raise
+        metrics.record(name, update, time.perf_counter() - started)
+        bump_dataset_generation()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'rdflib',
+                'triples': len(self._graph) if self._graph is not None else None,
+                'snapshot': str(self.snapshot_path) if self.snapshot_path else None,
+                'last_load_seconds': self._last_load_seconds,
+                'prepared_queries': _prepare.cache_info().currsize,
+                **self._counters,
+            }
+
+    def close(self):
+        pass
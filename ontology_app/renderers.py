@@ -0,0 +1,50 @@
+"""
+Response renderers picked by the Accept header.
+
+ORJSONRenderer replaces DRF's JSONRenderer for `application/json`: same
+compact UTF-8 output, encoded by orjson in C instead of the json module's
+per-object Python calls. MessagePackRenderer serves
+`application/msgpack`, a binary encoding of the same data for clients
+that can decode it. `manage.py benchmark_renderers` compares the three on
+the large list endpoints.
+
+Types neither library knows natively (Decimal, lazy strings, querysets)
+go through DRF's own JSONEncoder.default, and datetimes outside
+serializers keep DRF's `...Z` form, so the values are those DRF renders.
+"""
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def _default(obj):
+    """The value DRF's encoder gives `obj`; raises TypeError for unsupported types"""
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer encoded with orjson; indented output (`; indent=N`) stays on the json module"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=_default, option=ORJSON_OPTIONS)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True, datetime=False)
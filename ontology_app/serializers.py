@@ -5,89 +5,138 @@ from .models import (
     Diagnostic, Prescription
 )
 
-class EtablissementSerializer(serializers.ModelSerializer):
+# Shared by the get_* methods and their values_methods (see fast_serializers)
+def full_name(prenom, nom):
+    return f"{prenom} {nom}"
+
+def doctor_name(prenom, nom):
+    return f"Dr. {prenom} {nom}"
+
+def carbon_score(score_carbone):
+    return float(score_carbone) if score_carbone is not None else None
+
+class EagerLoadingMixin:
+    """Relations read by the serializer, loaded by setup_eager_loading() in a fixed number of queries"""
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
+
+class EtablissementSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Etablissement
         fields = '__all__'
 
-class PatientSerializer(serializers.ModelSerializer):
+class PatientSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     etablissement_nom = serializers.CharField(source='etablissement.nom_etablissement', read_only=True)
     
+    select_related_fields = ('etablissement',)
+    
     class Meta:
         model = Patient
         fields = '__all__'
 
-class MedecinSerializer(serializers.ModelSerializer):
+class MedecinSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     etablissement_nom = serializers.CharField(source='etablissement.nom_etablissement', read_only=True)
     
+    select_related_fields = ('etablissement',)
+    
     class Meta:
         model = Medecin
         fields = '__all__'
 
-class SymptomeSerializer(serializers.ModelSerializer):
+class SymptomeSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    prefetch_related_fields = ('maladies',)
+    
     class Meta:
         model = Symptome
         fields = '__all__'
 
-class MaladieSerializer(serializers.ModelSerializer):
+class MaladieSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     symptomes = SymptomeSerializer(many=True, read_only=True)
     
+    prefetch_related_fields = ('symptomes__maladies',)
+    
     class Meta:
         model = Maladie
         fields = '__all__'
 
-class ImpactEnvironnementalSerializer(serializers.ModelSerializer):
+class ImpactEnvironnementalSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = ImpactEnvironnemental
         fields = '__all__'
 
-class MedicamentSerializer(serializers.ModelSerializer):
+class MedicamentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Medicament
         fields = '__all__'
 
-class TraitementSerializer(serializers.ModelSerializer):
+class TraitementSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     maladie_nom = serializers.CharField(source='maladie.nom_maladie', read_only=True)
     impact_environnemental = ImpactEnvironnementalSerializer(read_only=True)
     medicaments = MedicamentSerializer(many=True, read_only=True)
     
+    select_related_fields = ('maladie', 'impact_environnemental')
+    prefetch_related_fields = ('medicaments',)
+    
     class Meta:
         model = Traitement
         fields = '__all__'
 
-class ExamenSerializer(serializers.ModelSerializer):
+class ExamenSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    prefetch_related_fields = ('maladies_diagnostiquees',)
+    
     class Meta:
         model = Examen
         fields = '__all__'
 
-class DiagnosticSerializer(serializers.ModelSerializer):
+class DiagnosticSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     patient_nom = serializers.SerializerMethodField()
     maladie_nom = serializers.CharField(source='maladie.nom_maladie', read_only=True)
     medecin_nom = serializers.SerializerMethodField()
     
+    select_related_fields = ('patient', 'maladie', 'medecin')
+    prefetch_related_fields = ('examens',)
+    # Method fields as (.values() columns, function) for the read fast path
+    values_methods = {
+        'patient_nom': (('patient__prenom', 'patient__nom'), full_name),
+        'medecin_nom': (('medecin__prenom', 'medecin__nom'), doctor_name),
+    }
+    
     class Meta:
         model = Diagnostic
         fields = '__all__'
     
     def get_patient_nom(self, obj):
-        return f"{obj.patient.prenom} {obj.patient.nom}"
+        return full_name(obj.patient.prenom, obj.patient.nom)
     
     def get_medecin_nom(self, obj):
-        return f"Dr. {obj.medecin.prenom} {obj.medecin.nom}"
+        return doctor_name(obj.medecin.prenom, obj.medecin.nom)
 
-class PrescriptionSerializer(serializers.ModelSerializer):
+class PrescriptionSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     traitement_nom = serializers.CharField(source='traitement.nom_traitement', read_only=True)
     patient_nom = serializers.SerializerMethodField()
     impact_score = serializers.SerializerMethodField()
     
+    select_related_fields = ('diagnostic__patient', 'traitement__impact_environnemental')
+    values_methods = {
+        'patient_nom': (('diagnostic__patient__prenom', 'diagnostic__patient__nom'), full_name),
+        'impact_score': (('traitement__impact_environnemental__score_carbone',), carbon_score),
+    }
+    
     class Meta:
         model = Prescription
         fields = '__all__'
     
     def get_patient_nom(self, obj):
-        return f"{obj.diagnostic.patient.prenom} {obj.diagnostic.patient.nom}"
+        return full_name(obj.diagnostic.patient.prenom, obj.diagnostic.patient.nom)
     
     def get_impact_score(self, obj):
-        if obj.traitement.impact_environnemental:
-            return float(obj.traitement.impact_environnemental.score_carbone)
-        return None
\ No newline at end of file
+        impact = obj.traitement.impact_environnemental
+        return carbon_score(impact.score_carbone if impact else None)
\ No newline at end of file
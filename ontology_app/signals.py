@@ -0,0 +1,204 @@
+"""
+Signal handlers feeding the RDF outbox (see rdf_sync), the dashboard
+counters (see dashboard_stats) and the table versions behind the ETags
+(see conditional_get).
+
+Handlers run inside the transaction that saves or deletes the model, so
+an outbox row or counter delta exists exactly when the change is
+committed; table versions move right after the commit. Bulk operations
+(QuerySet.update, bulk_create) bypass signals and need a full reload with
+populate_fuseki.py, a reconcile_stats() and a bump_all_table_versions().
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .conditional_get import bump_table_versions
+from .dashboard_stats import COUNTED_MODELS, ECO_SCORE_MAX, is_eco, record
+from .models import (
+    Patient, Medecin, Maladie, ImpactEnvironnemental, Traitement,
+    Diagnostic, Prescription, DashboardCounter, RdfDigest, RdfOutbox,
+)
+from .rdf_sync import enqueue
+
+SUBJECT_MODELS = {
+    Patient: 'Patient',
+    Medecin: 'Medecin',
+    Maladie: 'Maladie',
+    ImpactEnvironnemental: 'Impact',
+    Traitement: 'Traitement',
+}
+
+
+@receiver(post_save)
+def subject_saved(sender, instance, raw=False, **kwargs):
+    kind = SUBJECT_MODELS.get(sender)
+    if kind and not raw:
+        enqueue(kind, instance.pk)
+
+
+@receiver(post_delete)
+def subject_deleted(sender, instance, **kwargs):
+    kind = SUBJECT_MODELS.get(sender)
+    if kind:
+        enqueue(kind, instance.pk, 'delete')
+
+
+# Links are rebuilt for the previous owner too when a foreign key moves
+
+@receiver(pre_save, sender=Diagnostic)
+def diagnostic_moving(sender, instance, raw=False, **kwargs):
+    instance._rdf_previous = None
+    if instance.pk and not raw and settings.RDF_SYNC['ENABLED']:
+        instance._rdf_previous = Diagnostic.objects.filter(pk=instance.pk).values_list(
+            'patient_id', 'medecin_id').first()
+
+
+def _diagnostic_links(instance, operation, previous=None):
+    patients = {instance.patient_id}
+    medecins = {instance.medecin_id}
+    if previous:
+        patients.add(previous[0])
+        medecins.add(previous[1])
+    for patient_id in patients:
+        enqueue('diagnostiquePour', patient_id, operation)
+    # The prescrit links of a diagnostic's prescriptions hang off its doctor
+    if operation == 'delete' or (previous and previous[1] != instance.medecin_id):
+        for medecin_id in medecins:
+            enqueue('prescrit', medecin_id, operation)
+
+
+@receiver(post_save, sender=Diagnostic)
+def diagnostic_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _diagnostic_links(instance, 'save', getattr(instance, '_rdf_previous', None))
+
+
+@receiver(post_delete, sender=Diagnostic)
+def diagnostic_deleted(sender, instance, **kwargs):
+    _diagnostic_links(instance, 'delete')
+
+
+@receiver(pre_save, sender=Prescription)
+def prescription_moving(sender, instance, raw=False, **kwargs):
+    instance._rdf_previous = None
+    if instance.pk and not raw and settings.RDF_SYNC['ENABLED']:
+        instance._rdf_previous = Prescription.objects.filter(pk=instance.pk).values_list(
+            'diagnostic__medecin_id', flat=True).first()
+
+
+def _prescription_links(instance, operation, previous=None):
+    if not settings.RDF_SYNC['ENABLED']:
+        return
+    medecin_id = Diagnostic.objects.filter(pk=instance.diagnostic_id).values_list(
+        'medecin_id', flat=True).first()
+    for pk in {medecin_id, previous} - {None}:
+        enqueue('prescrit', pk, operation)
+
+
+@receiver(post_save, sender=Prescription)
+def prescription_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _prescription_links(instance, 'save', getattr(instance, '_rdf_previous', None))
+
+
+@receiver(post_delete, sender=Prescription)
+def prescription_deleted(sender, instance, **kwargs):
+    _prescription_links(instance, 'delete')
+
+
+# Dashboard counters
+
+COUNTERS = {model: name for name, model in COUNTED_MODELS.items()}
+
+
+@receiver(post_save)
+def counted_saved(sender, instance, created=False, raw=False, **kwargs):
+    name = COUNTERS.get(sender)
+    if name and created and not raw:
+        record(name, 1)
+
+
+@receiver(post_delete)
+def counted_deleted(sender, instance, **kwargs):
+    name = COUNTERS.get(sender)
+    if name:
+        record(name, -1)
+
+
+@receiver(pre_save, sender=ImpactEnvironnemental)
+def impact_scoring(sender, instance, raw=False, **kwargs):
+    instance._stats_previous_score = None
+    if not instance._state.adding and not raw:
+        instance._stats_previous_score = ImpactEnvironnemental.objects.filter(pk=instance.pk).values_list(
+            'score_carbone', flat=True).first()
+
+
+@receiver(post_save, sender=ImpactEnvironnemental)
+def impact_scored(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    score = Decimal(str(instance.score_carbone))
+    previous = getattr(instance, '_stats_previous_score', None)
+    record('score_carbone_total', score - (previous or 0))
+    # The treatment using this impact may enter or leave the eco-friendly count
+    if previous is not None and is_eco(previous) != is_eco(score) and \
+            Traitement.objects.filter(impact_environnemental=instance).exists():
+        record('traitements_eco', 1 if is_eco(score) else -1)
+
+
+@receiver(post_delete, sender=ImpactEnvironnemental)
+def impact_unscored(sender, instance, **kwargs):
+    record('score_carbone_total', -Decimal(str(instance.score_carbone)))
+
+
+def _eco_traitement(impact_id):
+    return impact_id is not None and ImpactEnvironnemental.objects.filter(
+        pk=impact_id, score_carbone__lte=ECO_SCORE_MAX).exists()
+
+
+@receiver(pre_save, sender=Traitement)
+def traitement_rating(sender, instance, raw=False, **kwargs):
+    instance._stats_was_eco = False
+    if not instance._state.adding and not raw:
+        instance._stats_was_eco = Traitement.objects.filter(
+            pk=instance.pk, impact_environnemental__score_carbone__lte=ECO_SCORE_MAX).exists()
+
+
+@receiver(post_save, sender=Traitement)
+def traitement_rated(sender, instance, raw=False, **kwargs):
+    if not raw:
+        record('traitements_eco', _eco_traitement(instance.impact_environnemental_id)
+               - getattr(instance, '_stats_was_eco', False))
+
+
+# pre_delete: a cascade from the impact removes it right after the treatment
+@receiver(pre_delete, sender=Traitement)
+def traitement_leaving(sender, instance, **kwargs):
+    instance._stats_was_eco = _eco_traitement(instance.impact_environnemental_id)
+
+
+@receiver(post_delete, sender=Traitement)
+def traitement_left(sender, instance, **kwargs):
+    record('traitements_eco', -getattr(instance, '_stats_was_eco', False))
+
+
+# Table versions
+
+UNVERSIONED = (DashboardCounter, RdfDigest, RdfOutbox)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def table_changed(sender, **kwargs):
+    if sender._meta.app_label == 'ontology_app' and sender not in UNVERSIONED:
+        bump_table_versions(sender)
+
+
+@receiver(m2m_changed)
+def links_changed(sender, action, **kwargs):
+    # sender is the link table, for either side of the relation
+    if action.startswith('post_'):
+        bump_table_versions(sender)
@@ -0,0 +1,138 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+GENERATION_KEY = 'sparql:dataset_generation'
+GENERATION_MODIFIED_KEY = 'sparql:dataset_modified'
+
+# String literals are kept verbatim, whitespace everywhere else is collapsed
+_TOKEN_RE = re.compile(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')|\s+')
+
+
+def normalize_query(query):
+    """Canonical cache key for a SPARQL query: collapse insignificant whitespace"""
+    return _TOKEN_RE.sub(lambda m: m.group(1) or ' ', query).strip()
+
+
+def _generation_store():
+    return caches[settings.SPARQL_CACHE['GENERATION_CACHE']]
+
+
+def get_dataset_generation():
+    """Current triple store generation, shared by every process using the same cache backend"""
+    return _generation_store().get(GENERATION_KEY, 0)
+
+
+def get_dataset_modified():
+    """Unix time of the last generation bump (first asked for when none is recorded)"""
+    store = _generation_store()
+    store.add(GENERATION_MODIFIED_KEY, time.time(), timeout=None)
+    return store.get(GENERATION_MODIFIED_KEY)
+
+
+def bump_dataset_generation():
+    """Invalidate every cached SPARQL result, in this process and the others"""
+    store = _generation_store()
+    store.add(GENERATION_KEY, 0, timeout=None)
+    generation = store.incr(GENERATION_KEY)
+    # After the increment: a Last-Modified may lag the data, never run ahead of it
+    store.set(GENERATION_MODIFIED_KEY, time.time(), timeout=None)
+    return generation
+
+
+class SparqlResultCache:
+    """
+    LRU + TTL cache of SPARQL results keyed on the normalized query text.
+    Entries belong to a dataset generation; when the generation moves on
+    the whole cache is dropped before the next lookup.
+    """
+
+    def __init__(self, max_entries=512, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _sync_generation(self, generation):
+        if generation != self._generation:
+            self._counters['invalidations'] += len(self._entries)
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, query, generation):
+        if not self.enabled:
+            return None
+        key = normalize_query(query)
+        with self._lock:
+            self._sync_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            expires_at, results = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return results
+
+    def set(self, query, results, generation):
+        if not self.enabled:
+            return
+        key = normalize_query(query)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._sync_generation(generation)
+            self._entries[key] = (expires_at, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        lookups = counters['hits'] + counters['misses']
+        return {
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'size': size,
+            'generation': self._generation,
+            **counters,
+            'hit_ratio': round(counters['hits'] / lookups, 4) if lookups else None,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide SparqlResultCache, creating it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SparqlResultCache(
+                    max_entries=settings.SPARQL_CACHE['MAX_ENTRIES'],
+                    ttl=settings.SPARQL_CACHE['TTL'],
+                )
+    return _cache
@@ -0,0 +1,201 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .sparql_cache import bump_dataset_generation
+from .sparql_metrics import get_metrics, result_rows
+from .sparql_stream import RESULT_FORMATS, SparqlStream
+
+SPARQL_RESULTS_JSON = 'application/sparql-results+json'
+
+
+def _dataset_params(default_graph):
+    return {'default-graph-uri': default_graph} if default_graph else None
+
+
+class SparqlClient:
+    """
+    Keep-alive HTTP client for the Fuseki query and update endpoints.
+    A single requests.Session is shared so TCP connections are pooled
+    and reused across requests instead of being opened per query.
+    """
+
+    def __init__(self, query_endpoint, update_endpoint=None, pool_size=10,
+                 connect_timeout=3.0, read_timeout=30.0, data_endpoint=None):
+        self.query_endpoint = query_endpoint
+        self.update_endpoint = update_endpoint
+        self.data_endpoint = data_endpoint
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._adapter = adapter
+
+        self._lock = threading.Lock()
+        self._counters = {'queries': 0, 'updates': 0, 'uploads': 0, 'errors': 0}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.FUSEKI_ENDPOINT,
+            settings.FUSEKI_UPDATE_ENDPOINT,
+            pool_size=settings.FUSEKI_POOL_SIZE,
+            connect_timeout=settings.FUSEKI_CONNECT_TIMEOUT,
+            read_timeout=settings.FUSEKI_READ_TIMEOUT,
+            data_endpoint=settings.FUSEKI_DATA_ENDPOINT,
+        )
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def _post(self, url, data, headers, counter, stream=False, params=None):
+        self._count(counter)
+        try:
+            response = self.session.post(url, data=data, headers=headers, params=params,
+                                         timeout=self.timeout, stream=stream)
+            response.raise_for_status()
+        except requests.RequestException:
+            self._count('errors')
+            raise
+        return response
+
+    def query(self, query, name=None, default_graph=None):
+        """
+        Run a SELECT/ASK query and return the decoded SPARQL JSON results.
+        default_graph: named graph to use as the query's default graph
+        """
+        metrics = get_metrics()
+        started = time.perf_counter()
+        try:
+            response = self._post(
+                self.query_endpoint,
+                {'query': query},
+                {'Accept': SPARQL_RESULTS_JSON},
+                'queries',
+                params=_dataset_params(default_graph),
+            )
+            results = response.json()
+        except Exception as e:
+            metrics.record(name, query, time.perf_counter() - started, error=e)
+            raise
+        metrics.record(name, query, time.perf_counter() - started,
+                       rows=result_rows(results), response_bytes=len(response.content))
+        return results
+
+    def query_stream(self, query, result_format='json', name=None, default_graph=None):
+        """Run a SELECT query and decode its rows incrementally (json or tsv)"""
+        metrics = get_metrics()
+        started = time.perf_counter()
+        try:
+            response = self._post(
+                self.query_endpoint,
+                {'query': query},
+                {'Accept': RESULT_FORMATS[result_format]},
+                'queries',
+                stream=True,
+                params=_dataset_params(default_graph),
+            )
+        except Exception as e:
+            metrics.record(name, query, time.perf_counter() - started, error=e)
+            raise
+
+        def on_close(rows, response_bytes):
+            # Measured when the stream is exhausted or closed, i.e. the full transfer
+            metrics.record(name, query, time.perf_counter() - started,
+                           rows=rows, response_bytes=response_bytes)
+
+        return SparqlStream(response, result_format, on_close=on_close)
+
+    def update(self, update, name='update'):
+        """Run a SPARQL UPDATE request and invalidate cached query results"""
+        metrics = get_metrics()
+        started = time.perf_counter()
+        try:
+            response = self._post(
+                self.update_endpoint,
+                {'update': update},
+                {'Content-Type': 'application/x-www-form-urlencoded'},
+                'updates',
+            )
+        except Exception as e:
+            metrics.record(name, update, time.perf_counter() - started, error=e)
+            raise
+        metrics.record(name, update, time.perf_counter() - started)
+        bump_dataset_generation()
+        return response
+
+    def upload(self, data, content_type='application/n-triples', graph=None, name='upload'):
+        """
+        Add RDF (N-Triples or Turtle) to the dataset through the SPARQL Graph
+        Store protocol, into `graph` or the default graph. The caller is
+        responsible for bumping the dataset generation once its load is done.
+        """
+        metrics = get_metrics()
+        started = time.perf_counter()
+        body = data.encode('utf-8')
+        try:
+            response = self._post(
+                self.data_endpoint,
+                body,
+                {'Content-Type': f'{content_type}; charset=utf-8'},
+                'uploads',
+                params={'graph': graph} if graph else {'default': ''},
+            )
+        except Exception as e:
+            metrics.record(name, f'<{len(body)} bytes of {content_type}>', time.perf_counter() - started, error=e)
+            raise
+        metrics.record(name, f'<{len(body)} bytes of {content_type}>', time.perf_counter() - started,
+                       response_bytes=len(body))
+        return response
+
+    def stats(self):
+        """Request counters and per-host connection pool usage"""
+        pools = []
+        pool_manager = self._adapter.poolmanager
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                'connections_opened': pool.num_connections,
+                'requests_sent': pool.num_requests,
+                'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+            })
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            'pool_size': self.pool_size,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            **counters,
+            'pools': pools,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide SPARQL client for the configured backend, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if settings.SPARQL_BACKEND == 'rdflib':
+                    from .rdflib_backend import LocalGraphClient
+                    _client = LocalGraphClient.from_settings()
+                else:
+                    _client = SparqlClient.from_settings()
+    return _client
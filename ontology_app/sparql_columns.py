@@ -0,0 +1,106 @@
+"""
+Typed columnar form of SPARQL SELECT results.
+
+Instead of one {"type", "value", "datatype"} dict per cell, each variable
+becomes a single column whose literals are converted once, in bulk, to
+Python values. Fully bound numeric columns are packed into array.array.
+"""
+from array import array
+from datetime import date, datetime
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+
+def _boolean(value):
+    return value in ('true', '1')
+
+
+def _datetime(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+_CONVERTERS = {
+    XSD + 'decimal': float,
+    XSD + 'double': float,
+    XSD + 'float': float,
+    XSD + 'integer': int,
+    XSD + 'int': int,
+    XSD + 'long': int,
+    XSD + 'short': int,
+    XSD + 'nonNegativeInteger': int,
+    XSD + 'positiveInteger': int,
+    XSD + 'boolean': _boolean,
+    XSD + 'date': date.fromisoformat,
+    XSD + 'dateTime': _datetime,
+}
+
+_ARRAY_TYPECODES = {float: 'd', int: 'q'}
+
+
+def _build_column(terms):
+    """Convert one variable's terms; returns (python type name, values)"""
+    datatypes = {term.get('datatype') for term in terms if term is not None}
+    converter = _CONVERTERS.get(datatypes.pop()) if len(datatypes) == 1 else None
+    raw = [term['value'] if term is not None else None for term in terms]
+    if converter is None:
+        return 'string', raw
+
+    try:
+        values = [converter(value) if value is not None else None for value in raw]
+    except (ValueError, TypeError):
+        return 'string', raw
+
+    kind = {float: 'float', int: 'int', _boolean: 'boolean'}.get(converter, 'date')
+    typecode = _ARRAY_TYPECODES.get(converter)
+    if typecode and None not in values:
+        try:
+            return kind, array(typecode, values)
+        except OverflowError:
+            pass
+    return kind, values
+
+
+class ColumnarResult:
+    """SPARQL result set stored as one typed column per variable"""
+
+    __slots__ = ('columns', 'types', 'data', 'length')
+
+    def __init__(self, columns, types, data, length):
+        self.columns = columns
+        self.types = types
+        self.data = data
+        self.length = length
+
+    @classmethod
+    def from_sparql(cls, results):
+        columns = list(results.get('head', {}).get('vars', []))
+        bindings = results['results']['bindings']
+        types, data = [], []
+        for name in columns:
+            kind, values = _build_column([binding.get(name) for binding in bindings])
+            types.append(kind)
+            data.append(values)
+        return cls(columns, types, data, len(bindings))
+
+    def __len__(self):
+        return self.length
+
+    def rows(self):
+        return zip(*self.data) if self.data else iter(())
+
+    def to_dict(self):
+        """Flat {columns, types, rows} payload for the API"""
+        return {
+            'columns': self.columns,
+            'types': self.types,
+            'rows': [list(row) for row in self.rows()],
+        }
+
+
+def shape_results(results, shape):
+    """Apply the ?shape= option of the semantic endpoints to a result set or a dict of result sets"""
+    if shape != 'columns':
+        return results
+    if isinstance(results.get('results'), dict) and 'bindings' in results['results']:
+        return ColumnarResult.from_sparql(results).to_dict()
+    return {key: ColumnarResult.from_sparql(value).to_dict() for key, value in results.items()}
@@ -0,0 +1,180 @@
+"""
+Per-query SPARQL metrics.
+
+Every SPARQL call made by the clients is recorded under the name of the
+OntologyQuery method that issued it: duration, result rows and response
+bytes go into fixed-bucket latency histograms, and queries slower than
+settings.SPARQL_SLOW_QUERY_MS are logged with their full text.
+"""
+import bisect
+import logging
+import sys
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+slow_query_logger = logging.getLogger('ontology_app.slow_queries')
+
+# Upper bounds of the latency buckets, in milliseconds (last bucket is unbounded)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+PERCENTILES = (50, 90, 95, 99)
+
+
+def caller_name(depth=2):
+    """Name of the function `depth` frames up, used as the default query name"""
+    return sys._getframe(depth).f_code.co_name
+
+
+class LatencyHistogram:
+    """Cumulative latency distribution of one query, in fixed millisecond buckets"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, duration_ms):
+        self.counts[bisect.bisect_left(self.bounds, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+    def percentile(self, p):
+        """Estimate from the buckets, interpolating linearly inside the matching one"""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max_ms
+                upper = min(upper, self.max_ms)
+                return round(lower + (upper - lower) * (rank - seen) / count, 3)
+            seen += count
+        return round(self.max_ms, 3)
+
+    def to_dict(self):
+        labels = [str(bound) for bound in self.bounds] + ['+Inf']
+        return {
+            'mean': round(self.total_ms / self.count, 3) if self.count else None,
+            'max': round(self.max_ms, 3),
+            **{f'p{p}': self.percentile(p) for p in PERCENTILES},
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class QueryStats:
+    """Counters and latency histogram of one named query"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.rows = 0
+        self.bytes = 0
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'cache_hits': self.cache_hits,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rows_per_call': round(self.rows / self.calls, 1) if self.calls else None,
+            'latency_ms': self.latency.to_dict(),
+        }
+
+
+class SparqlMetrics:
+    def __init__(self, slow_query_ms=500, slow_log_size=50):
+        self.slow_query_ms = slow_query_ms
+        self._queries = {}
+        self._slow_queries = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def _stats(self, name):
+        stats = self._queries.get(name)
+        if stats is None:
+            stats = self._queries[name] = QueryStats()
+        return stats
+
+    def record(self, name, query, duration, rows=None, response_bytes=None, error=None):
+        """Record one SPARQL call; duration in seconds"""
+        duration_ms = duration * 1000
+        name = name or 'anonymous'
+        with self._lock:
+            stats = self._stats(name)
+            stats.calls += 1
+            stats.latency.observe(duration_ms)
+            if error is not None:
+                stats.errors += 1
+            if rows:
+                stats.rows += rows
+            if response_bytes:
+                stats.bytes += response_bytes
+
+        if self.slow_query_ms is not None and duration_ms >= self.slow_query_ms:
+            entry = {
+                'name': name,
+                'duration_ms': round(duration_ms, 3),
+                'rows': rows,
+                'bytes': response_bytes,
+                'error': str(error) if error is not None else None,
+                'at': time.time(),
+                'query': query,
+            }
+            with self._lock:
+                self._slow_queries.append(entry)
+            slow_query_logger.warning(
+                f"Slow SPARQL query {name}: {entry['duration_ms']}ms, {rows} rows, "
+                f"{response_bytes} bytes\n{query}"
+            )
+
+    def record_cache_hit(self, name):
+        with self._lock:
+            self._stats(name or 'anonymous').cache_hits += 1
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._slow_queries.clear()
+            self._started = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'since': self._started,
+                'slow_query_ms': self.slow_query_ms,
+                'queries': {name: stats.to_dict() for name, stats in sorted(self._queries.items())},
+                'slow_queries': list(self._slow_queries),
+            }
+
+
+def result_rows(results):
+    """Row count of a SPARQL JSON result (None for ASK)"""
+    bindings = results.get('results', {}).get('bindings') if isinstance(results, dict) else None
+    return len(bindings) if bindings is not None else None
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Return the process-wide SparqlMetrics, creating it on first use"""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = SparqlMetrics(
+                    slow_query_ms=settings.SPARQL_SLOW_QUERY_MS,
+                    slow_log_size=settings.SPARQL_SLOW_QUERY_LOG_SIZE,
+                )
+    return _metrics
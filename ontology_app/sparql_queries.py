@@ -1,24 +1,162 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
-from django.conf import settings
+from decimal import Decimal, InvalidOperation
+from .sparql_client import get_client
+from .graph_versions import get_current_graph
+from .conditional_get import mark_uncacheable
+from .sparql_cache import get_cache, get_dataset_generation
+from .sparql_metrics import caller_name, get_metrics
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 
+XSD_DECIMAL = "http://www.w3.org/2001/XMLSchema#decimal"
+# Score differences computed at a time by _treatment_pairs (8 bytes each)
+PAIR_BLOCK_CELLS = 1 << 18
+ALTERNATIVES_VARS = [
+    "maladie", "traitement1", "score1", "efficacite1",
+    "traitement2", "score2", "efficacite2", "scoreDiff", "efficaciteDiff",
+]
+
+def sparql_literal(value):
+    """Quote a Python string as a SPARQL string literal"""
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    value = value.replace('\n', '\\n').replace('\r', '\\r')
+    return f'"{value}"'
+
+def _group_by_maladie(results, maladie_noms, limit=None):
+    """Split a VALUES ?nomMaladie result set into one result set per disease"""
+    head_vars = [v for v in results.get("head", {}).get("vars", []) if v != "nomMaladie"]
+    grouped = {nom: [] for nom in maladie_noms}
+    for binding in results["results"]["bindings"]:
+        nom = binding.get("nomMaladie", {}).get("value")
+        rows = grouped.get(nom)
+        if rows is None or (limit is not None and len(rows) >= limit):
+            continue
+        rows.append({k: v for k, v in binding.items() if k != "nomMaladie"})
+    return {
+        nom: {"head": {"vars": head_vars}, "results": {"bindings": rows}}
+        for nom, rows in grouped.items()
+    }
+
+def _literal_difference(a, b):
+    """Exact a - b on two numeric literal bindings, as SPARQL arithmetic would return it"""
+    try:
+        value = str(Decimal(a["value"]) - Decimal(b["value"]))
+    except InvalidOperation:
+        value = repr(float(a["value"]) - float(b["value"]))
+    return {"type": "literal", "datatype": a.get("datatype", XSD_DECIMAL), "value": value}
+
+def alternatives_params(params):
+    """(top_k, min_diff) from the ?top_k= and ?min_diff= of a request; ValueError with a message if invalid"""
+    top_k, min_diff = params.get("top_k"), params.get("min_diff")
+    try:
+        top_k = int(top_k) if top_k not in (None, "") else None
+    except ValueError:
+        raise ValueError("top_k must be an integer")
+    if top_k is not None and top_k < 0:
+        raise ValueError("top_k must not be negative")
+    try:
+        min_diff = float(min_diff) if min_diff not in (None, "") else 0
+    except ValueError:
+        raise ValueError("min_diff must be a number")
+    if not np.isfinite(min_diff):
+        raise ValueError("min_diff must be a finite number")
+    return top_k, min_diff
+
+def _treatment_pairs(results, top_k=None, min_diff=0):
+    """
+    In-process equivalent of the get_treatment_alternatives_by_disease
+    self-join. Takes one row per treatment and builds every pair with
+    score1 > score2, ordered by score difference. The differences are
+    computed PAIR_BLOCK_CELLS at a time, and with top_k only the best
+    top_k pairs seen so far are kept, so memory does not grow with n².
+    """
+    if top_k is not None and top_k < 0:
+        raise ValueError("top_k must not be negative")
+    rows = []
+    for binding in results["results"]["bindings"]:
+        try:
+            rows.append((binding, float(binding["score"]["value"])))
+        except (KeyError, ValueError):
+            continue
+
+    bindings = []
+    if rows and top_k != 0:
+        n = len(rows)
+        scores = np.fromiter((score for _, score in rows), dtype=float, count=n)
+        _, treatment_ids = np.unique([b["t"]["value"] for b, _ in rows], return_inverse=True)
+
+        # Kept pairs, in row-major (first, second) order like np.nonzero on the full matrix
+        first = second = np.empty(0, dtype=np.intp)
+        pair_diffs = np.empty(0, dtype=float)
+        block = max(1, PAIR_BLOCK_CELLS // n)
+        for start in range(0, n, block):
+            diffs = scores[start:start + block, None] - scores[None, :]
+            mask = (diffs > 0) & (treatment_ids[start:start + block, None] != treatment_ids[None, :])
+            if min_diff:
+                mask &= diffs >= min_diff
+            block_first, block_second = np.nonzero(mask)
+            first = np.concatenate([first, block_first + start])
+            second = np.concatenate([second, block_second])
+            pair_diffs = np.concatenate([pair_diffs, diffs[block_first, block_second]])
+            if top_k is not None and top_k < len(pair_diffs):
+                best = np.sort(np.argpartition(-pair_diffs, top_k - 1)[:top_k])
+                first, second, pair_diffs = first[best], second[best], pair_diffs[best]
+
+        order = np.argsort(-pair_diffs, kind="stable")
+        for k in order:
+            b1, b2 = rows[first[k]][0], rows[second[k]][0]
+            bindings.append({
+                "maladie": b1["maladie"],
+                "traitement1": b1["traitement"],
+                "score1": b1["score"],
+                "efficacite1": b1["efficacite"],
+                "traitement2": b2["traitement"],
+                "score2": b2["score"],
+                "efficacite2": b2["efficacite"],
+                "scoreDiff": _literal_difference(b1["score"], b2["score"]),
+                "efficaciteDiff": _literal_difference(b1["efficacite"], b2["efficacite"]),
+            })
+    return {"head": {"vars": list(ALTERNATIVES_VARS)}, "results": {"bindings": bindings}}
+
 class OntologyQuery:
-    def __init__(self):
-        self.sparql = SPARQLWrapper(settings.FUSEKI_ENDPOINT)
-        self.sparql.setReturnFormat(JSON)
+    def __init__(self, raise_errors=False):
+        self.client = get_client()
+        self.cache = get_cache()
         self.namespace = "http://example.org/health#"
+        self.raise_errors = raise_errors
     
-    def execute_query(self, query):
-        """Execute SPARQL query and return results"""
-        try:
-            self.sparql.setQuery(query)
-            results = self.sparql.query().convert()
+    def execute_query(self, query, name=None):
+        """
+        Execute SPARQL query and return results, served from cache when possible.
+        Metrics are recorded under `name`, by default the calling method's name.
+        """
+        name = name or caller_name()
+        generation = get_dataset_generation()
+        results = self.cache.get(query, generation)
+        if results is not None:
+            get_metrics().record_cache_hit(name)
             return results
+        try:
+            results = self.client.query(query, name, get_current_graph())
         except Exception as e:
             logger.error(f"SPARQL query error: {str(e)}")
+            if self.raise_errors:
+                raise
+            mark_uncacheable()
             return {"results": {"bindings": []}}
+        self.cache.set(query, results, generation)
+        return results
+    
+    def _transform(self, results, func):
+        """Post-process query results (overridden by the async variant)"""
+        return func(results)
+    
+    def _empty(self):
+        return {"results": {"bindings": []}}
+    
+    def _values(self, maladie_noms):
+        return " ".join(sparql_literal(nom) for nom in maladie_noms)
     
     def get_all_patients(self):
         """Get all patients from ontology"""
@@ -96,6 +234,24 @@ class OntologyQuery:
         """
         return self.execute_query(query)
     
+    def get_medecins_with_specialite(self, specialite):
+        """Doctors whose health:specialite is the model's code (e.g. 'autre'), like the ORM filter"""
+        query = f"""
+        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+        PREFIX health: <{self.namespace}>
+        
+        SELECT ?medecin ?nom ?prenom ?anneesExperience
+        WHERE {{
+            ?medecin rdf:type health:Medecin ;
+                    health:specialite {sparql_literal(specialite)} ;
+                    health:nom ?nom ;
+                    health:prenom ?prenom .
+            OPTIONAL {{ ?medecin health:anneesExperience ?anneesExperience }}
+        }}
+        ORDER BY DESC(?anneesExperience)
+        """
+        return self.execute_query(query)
+    
     def get_patient_full_profile(self, patient_email):
         """Get complete patient profile with diagnoses and treatments"""
         query = f"""
@@ -178,6 +334,31 @@ class OntologyQuery:
         """
         return self.execute_query(query)
     
+    def get_treatment_alternatives_linear(self, maladie_nom, top_k=None, min_diff=0):
+        """
+        Same result as get_treatment_alternatives_by_disease, but the
+        treatments are fetched once (linear pattern) and the pairwise
+        differences computed in-process instead of by a SPARQL self-join.
+        top_k keeps the largest score differences, min_diff drops pairs
+        whose score difference is below the threshold.
+        """
+        query = f"""
+        PREFIX health: <{self.namespace}>
+        
+        SELECT ?maladie ?t ?traitement ?score ?efficacite
+        WHERE {{
+            ?m health:nomMaladie "{maladie_nom}" .
+            ?t health:nomTraitement ?traitement ;
+               health:traite ?m ;
+               health:efficacite ?efficacite ;
+               health:aImpact ?i .
+            ?i health:scoreCarbone ?score .
+            ?m health:nomMaladie ?maladie .
+        }}
+        """
+        return self._transform(self.execute_query(query),
+                               lambda results: _treatment_pairs(results, top_k, min_diff))
+    
     def get_best_treatment_recommendation(self, maladie_nom, max_score=10):
         """
         SEMANTIC REASONING: Calculate eco-efficiency ratio inline.
@@ -235,4 +416,110 @@ class OntologyQuery:
         GROUP BY ?medecin ?nom ?prenom ?specialite ?experience
         ORDER BY DESC(?ecoTreatmentCount) ?avgScore
         """
-        return self.execute_query(query)
\ No newline at end of file
+        return self.execute_query(query)
+    
+    def get_traitements_for_maladies(self, maladie_noms):
+        """
+        Batched get_traitements_for_maladie: one VALUES query for several
+        diseases, results grouped per disease name.
+        """
+        maladie_noms = list(dict.fromkeys(maladie_noms))
+        if not maladie_noms:
+            return self._transform(self._empty(), lambda results: {})
+        query = f"""
+        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+        PREFIX health: <{self.namespace}>
+        
+        SELECT ?nomMaladie ?traitement ?nomTraitement ?cout ?efficacite ?scoreCarbone
+        WHERE {{
+            VALUES ?nomMaladie {{ {self._values(maladie_noms)} }}
+            ?maladie rdf:type health:Maladie ;
+                     health:nomMaladie ?nomMaladie .
+            ?traitement health:traite ?maladie ;
+                       health:nomTraitement ?nomTraitement .
+            OPTIONAL {{ ?traitement health:cout ?cout }}
+            OPTIONAL {{ ?traitement health:efficacite ?efficacite }}
+            OPTIONAL {{ 
+                ?traitement health:aImpact ?impact .
+                ?impact health:scoreCarbone ?scoreCarbone 
+            }}
+        }}
+        ORDER BY ?nomMaladie ?scoreCarbone
+        """
+        return self._transform(self.execute_query(query),
+                               lambda results: _group_by_maladie(results, maladie_noms))
+    
+    def compare_traitements_impact_batch(self, maladie_noms):
+        """Batched compare_traitements_impact, results grouped per disease name"""
+        maladie_noms = list(dict.fromkeys(maladie_noms))
+        if not maladie_noms:
+            return self._transform(self._empty(), lambda results: {})
+        query = f"""
+        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+        PREFIX health: <{self.namespace}>
+        
+        SELECT ?nomMaladie ?nomTraitement ?scoreCarbone ?efficacite ?cout
+               ((?efficacite / ?scoreCarbone) as ?ratioEfficaciteImpact)
+        WHERE {{
+            VALUES ?nomMaladie {{ {self._values(maladie_noms)} }}
+            ?maladie health:nomMaladie ?nomMaladie .
+            ?traitement health:traite ?maladie ;
+                       health:nomTraitement ?nomTraitement ;
+                       health:efficacite ?efficacite ;
+                       health:cout ?cout ;
+                       health:aImpact ?impact .
+            ?impact health:scoreCarbone ?scoreCarbone .
+            FILTER (?scoreCarbone > 0)
+        }}
+        ORDER BY ?nomMaladie DESC(?ratioEfficaciteImpact)
+        """
+        return self._transform(self.execute_query(query),
+                               lambda results: _group_by_maladie(results, maladie_noms))
+    
+    def get_best_treatment_recommendations(self, maladie_noms, max_score=10, limit=5):
+        """
+        Batched get_best_treatment_recommendation. SPARQL has no per-group
+        LIMIT, so the top `limit` rows of each disease are kept in Python.
+        """
+        maladie_noms = list(dict.fromkeys(maladie_noms))
+        if not maladie_noms:
+            return self._transform(self._empty(), lambda results: {})
+        query = f"""
+        PREFIX health: <{self.namespace}>
+        
+        SELECT ?nomMaladie ?traitement ?score ?efficacite ?cout
+               ((?efficacite / ?score) as ?ecoEfficiencyRatio)
+        WHERE {{
+            VALUES ?nomMaladie {{ {self._values(maladie_noms)} }}
+            ?m health:nomMaladie ?nomMaladie .
+            ?t health:nomTraitement ?traitement ;
+               health:traite ?m ;
+               health:efficacite ?efficacite ;
+               health:cout ?cout ;
+               health:aImpact ?i .
+            ?i health:scoreCarbone ?score .
+            
+            FILTER (?score <= {max_score})
+            FILTER (?efficacite > 70)
+        }}
+        ORDER BY ?nomMaladie DESC(?ecoEfficiencyRatio)
+        """
+        return self._transform(self.execute_query(query),
+                               lambda results: _group_by_maladie(results, maladie_noms, limit))
+
+
+class StreamingOntologyQuery(OntologyQuery):
+    """
+    OntologyQuery whose plain SELECT methods return a SparqlStream instead
+    of materialized results. Bypasses the result cache, and errors are
+    raised rather than turned into an empty result. Post-processed
+    methods are not streamable (see STREAMABLE_QUERY_TYPES in views).
+    """
+    
+    def __init__(self, result_format='json'):
+        super().__init__()
+        self.result_format = result_format
+    
+    def execute_query(self, query, name=None):
+        return self.client.query_stream(query, self.result_format, name or caller_name(),
+                                        get_current_graph())
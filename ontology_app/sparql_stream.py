@@ -0,0 +1,233 @@
+"""
+Incremental decoding of SPARQL SELECT results.
+
+Rows are decoded one at a time from the HTTP response body (SPARQL JSON
+or TSV) and re-encoded as SPARQL JSON chunks, so memory use stays flat
+whatever the size of the result set.
+"""
+import codecs
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+CHUNK_SIZE = 64 * 1024
+ROWS_PER_CHUNK = 500
+
+RESULT_FORMATS = {
+    'json': 'application/sparql-results+json',
+    'tsv': 'text/tab-separated-values',
+}
+
+
+def _decode_chunks(byte_chunks, counter=None):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in byte_chunks:
+        if counter is not None:
+            counter[0] += len(chunk)
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class _JsonBindingsReader:
+    """Pulls binding objects out of a SPARQL JSON document one by one"""
+
+    _BINDINGS_RE = re.compile(r'"bindings"\s*:\s*\[')
+    _HEAD_RE = re.compile(r'"head"\s*:\s*')
+
+    def __init__(self, text_chunks):
+        self._chunks = text_chunks
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self.vars = self._read_head()
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _read_head(self):
+        while True:
+            match = self._BINDINGS_RE.search(self._buf)
+            if match:
+                break
+            if not self._fill():
+                raise ValueError("SPARQL JSON results without a bindings array")
+        head = self._HEAD_RE.search(self._buf, 0, match.start())
+        variables = []
+        if head:
+            variables = self._decoder.raw_decode(self._buf, head.end())[0].get('vars', [])
+        self._pos = match.end()
+        return variables
+
+    def __iter__(self):
+        while True:
+            buf, pos = self._buf, self._pos
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            self._pos = pos
+            if pos >= len(buf):
+                if not self._fill():
+                    raise ValueError("Truncated SPARQL JSON results")
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                binding, end = self._decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            self._pos = end
+            yield binding
+
+
+_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+_ESCAPE_RE = re.compile(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+_LITERAL_RE = re.compile(r'^"(.*)"(?:@([A-Za-z0-9-]+)|\^\^<([^>]*)>)?$', re.S)
+_INTEGER_RE = re.compile(r'^[+-]?\d+$')
+_DECIMAL_RE = re.compile(r'^[+-]?\d*\.\d+$')
+
+
+def _unescape(value):
+    def replace(match):
+        esc = match.group(1)
+        if len(esc) > 1:
+            return chr(int(esc[1:], 16))
+        return _ESCAPES.get(esc, esc)
+    return _ESCAPE_RE.sub(replace, value) if '\\' in value else value
+
+
+def parse_tsv_term(token):
+    """Turn one SPARQL TSV cell into a SPARQL JSON term (None when unbound)"""
+    if not token:
+        return None
+    if token[0] == '<' and token[-1] == '>':
+        return {"type": "uri", "value": token[1:-1]}
+    if token.startswith('_:'):
+        return {"type": "bnode", "value": token[2:]}
+    match = _LITERAL_RE.match(token)
+    if match:
+        value, lang, datatype = match.groups()
+        term = {"type": "literal", "value": _unescape(value)}
+        if lang:
+            term["xml:lang"] = lang
+        elif datatype:
+            term["datatype"] = datatype
+        return term
+    # Bare numbers and booleans use the Turtle short forms
+    if token in ('true', 'false'):
+        datatype = XSD + 'boolean'
+    elif _INTEGER_RE.match(token):
+        datatype = XSD + 'integer'
+    elif _DECIMAL_RE.match(token):
+        datatype = XSD + 'decimal'
+    else:
+        datatype = XSD + 'double'
+    return {"type": "literal", "value": token, "datatype": datatype}
+
+
+class _TsvBindingsReader:
+    """Pulls bindings out of a SPARQL TSV document line by line"""
+
+    def __init__(self, text_chunks):
+        self._lines = self._iter_lines(text_chunks)
+        header = next(self._lines, '')
+        self.vars = [name.lstrip('?$') for name in header.split('\t')] if header else []
+
+    @staticmethod
+    def _iter_lines(text_chunks):
+        pending = ''
+        for chunk in text_chunks:
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r')
+        if pending:
+            yield pending.rstrip('\r')
+
+    def __iter__(self):
+        variables = self.vars
+        for line in self._lines:
+            if not line:
+                continue
+            binding = {}
+            for name, token in zip(variables, line.split('\t')):
+                term = parse_tsv_term(token)
+                if term is not None:
+                    binding[name] = term
+            yield binding
+
+
+class SparqlStream:
+    """
+    Lazily decoded SELECT result: `vars` is read up front, bindings are
+    produced while iterating. Closing releases the HTTP connection and
+    reports the rows and bytes read to `on_close`.
+    """
+
+    def __init__(self, response, result_format='json', on_close=None):
+        self._response = response
+        self._on_close = on_close
+        self._bytes = [0]
+        self.rows = 0
+        text_chunks = _decode_chunks(response.iter_content(CHUNK_SIZE), self._bytes)
+        reader_class = _TsvBindingsReader if result_format == 'tsv' else _JsonBindingsReader
+        try:
+            self._reader = reader_class(text_chunks)
+        except Exception:
+            self.close()
+            raise
+        self.vars = self._reader.vars
+
+    def __iter__(self):
+        try:
+            for binding in self._reader:
+                self.rows += 1
+                yield binding
+        finally:
+            self.close()
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+            if self._on_close is not None:
+                self._on_close(self.rows, self._bytes[0])
+
+
+def iter_sparql_json(stream, rows_per_chunk=ROWS_PER_CHUNK):
+    """
+    Re-encode a SparqlStream as SPARQL JSON text chunks. An error in the
+    middle of the stream is re-raised: the server then aborts the response
+    and the client sees a truncated transfer, not a complete-looking document.
+    """
+    yield '{"head": {"vars": ' + json.dumps(stream.vars) + '}, "results": {"bindings": ['
+    batch = []
+    separator = ''
+    try:
+        for binding in stream:
+            batch.append(json.dumps(binding))
+            if len(batch) >= rows_per_chunk:
+                yield separator + ','.join(batch)
+                separator = ','
+                batch = []
+    except Exception as e:
+        # Headers are already sent: only an aborted connection can still signal the failure
+        logger.error(f"SPARQL stream error: {str(e)}")
+        raise
+    finally:
+        stream.close()
+    if batch:
+        yield separator + ','.join(batch)
+    yield ']}}'
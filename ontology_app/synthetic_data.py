@@ -0,0 +1,441 @@
+"""
+Seedable synthetic dataset generator.
+
+Builds establishments, doctors, patients, diseases, symptoms, drugs,
+treatments with their environmental impacts, diagnostics and
+prescriptions with realistic distributions (skewed disease prevalence,
+log-normal costs and carbon scores, French blood groups, ...), from a
+few thousand up to tens of millions of rows.
+
+Everything is written with bulk_create in batches, many-to-many links
+through their through tables, and only integer primary keys are kept in
+memory (array('q')), so memory stays flat as the row count grows. The
+same seed and patient count always produce the same dataset, dates
+included: diagnostics and prescriptions get theirs with an UPDATE after
+the insert, since auto_now_add overrides any value given to it.
+
+bulk_create sends no model signals: nothing is queued for sync_fuseki,
+reload the triple store with populate_fuseki.py afterwards.
+"""
+import math
+import random
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import accumulate
+
+from django.db import connection, transaction
+
+from .conditional_get import bump_all_table_versions
+from .dashboard_stats import reconcile_stats
+from .models import (
+    Etablissement, Patient, Medecin, Maladie, Symptome, ImpactEnvironnemental,
+    Medicament, Traitement, Diagnostic, Prescription,
+)
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Rows per patient (with a minimum count and, for catalogues, a maximum)
+RATIOS = {
+    'etablissements': (1 / 500, 3, None),
+    'medecins': (1 / 40, 5, None),
+    'maladies': (1 / 200, 6, 20000),
+    'medicaments': (1 / 100, 5, 20000),
+}
+SYMPTOMES_PER_MALADIE = 3
+# Mean treatments per disease, diagnostics per patient, prescriptions per diagnostic
+TRAITEMENTS_PER_MALADIE = 4
+DIAGNOSTICS_PER_PATIENT = 1.5
+PRESCRIPTIONS_PER_DIAGNOSTIC = 1.1
+# Zipf exponent of disease prevalence: a few diseases account for most diagnostics
+PREVALENCE_SKEW = 1.1
+# Ages are counted from a fixed day so a seed gives the same dataset whenever it runs
+REFERENCE_DATE = date(2025, 1, 1)
+# Diagnostics are spread over the days before REFERENCE_DATE; prescriptions
+# follow their diagnostic within PRESCRIPTION_DELAY_DAYS
+DIAGNOSTIC_SPAN_DAYS = 3 * 365
+PRESCRIPTION_DELAY_DAYS = 3
+
+PRENOMS_F = ['Marie', 'Sophie', 'Camille', 'Léa', 'Julie', 'Claire', 'Emma', 'Chloé', 'Inès', 'Manon',
+             'Isabelle', 'Nathalie', 'Catherine', 'Sylvie', 'Élise', 'Louise', 'Anne', 'Hélène']
+PRENOMS_M = ['Pierre', 'Jean', 'Thomas', 'Nicolas', 'Julien', 'Lucas', 'Hugo', 'Louis', 'Antoine', 'Paul',
+             'François', 'Laurent', 'Michel', 'Philippe', 'Mathieu', 'Olivier', 'Étienne', 'Arthur']
+NOMS = ['Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau',
+        'Simon', 'Laurent', 'Lefebvre', 'Michel', 'Garcia', 'David', 'Bertrand', 'Roux', 'Vincent', 'Fournier',
+        'Morel', 'Girard', 'André', 'Lefèvre', 'Mercier', 'Dupont', 'Lambert', 'Bonnet', 'François', 'Martinez',
+        'Rousseau', 'Blanc', 'Guerin', 'Muller', 'Henry', 'Roussel', 'Nicolas', 'Perrin', 'Morin', 'Mathieu']
+VILLES = [('Paris', '75'), ('Lyon', '69'), ('Marseille', '13'), ('Toulouse', '31'), ('Nantes', '44'),
+          ('Lille', '59'), ('Bordeaux', '33'), ('Strasbourg', '67'), ('Rennes', '35'), ('Montpellier', '34')]
+RUES = ['Rue de la République', 'Avenue Victor Hugo', 'Boulevard Pasteur', 'Rue des Lilas', 'Rue de la Paix',
+        'Avenue Jean Jaurès', 'Rue du Moulin', 'Place de la Mairie', 'Rue Nationale', 'Chemin des Vignes']
+# French blood group frequencies (%)
+GROUPES_SANGUINS = {'O+': 36, 'A+': 37, 'B+': 9, 'AB+': 3, 'O-': 6, 'A-': 7, 'B-': 1, 'AB-': 1}
+ALLERGIES = ['Pénicilline', 'Pollen', 'Arachides', 'Acariens', 'Lactose', 'Aspirine', 'Latex']
+SPECIALITES = {'generaliste': 50, 'cardiologue': 15, 'pneumologue': 10, 'autre': 25}
+TYPES_ETABLISSEMENT = {'cabinet': 45, 'clinique': 20, 'hopital': 15, 'pharmacie': 12, 'laboratoire': 8}
+CAPACITES = {'cabinet': (5, 30), 'clinique': (50, 250), 'hopital': (200, 1500),
+             'pharmacie': (3, 15), 'laboratoire': (10, 60)}
+
+# (name, ICD-10 code, type, severity, mortality %, contagious)
+MALADIES = [
+    ('Hypertension Artérielle', 'I10', 'cardiovasculaire', 'moderee', 2.0, False),
+    ('Insuffisance Cardiaque', 'I50', 'cardiovasculaire', 'grave', 18.5, False),
+    ('Diabète de Type 2', 'E11', 'chronique', 'moderee', 3.8, False),
+    ('Asthme Chronique', 'J45', 'respiratoire', 'moderee', 1.2, False),
+    ('Bronchite Chronique', 'J42', 'respiratoire', 'moderee', 2.5, False),
+    ('Grippe Saisonnière', 'J11', 'infectieuse', 'legere', 0.5, True),
+    ('Fibrillation Auriculaire', 'I48', 'cardiovasculaire', 'grave', 5.0, False),
+    ('Pneumonie', 'J18', 'infectieuse', 'grave', 8.0, True),
+    ('Gastro-entérite', 'A09', 'aigue', 'legere', 0.1, True),
+    ('Arthrose', 'M19', 'chronique', 'legere', 0.0, False),
+    ('Migraine', 'G43', 'chronique', 'legere', 0.0, False),
+    ('BPCO', 'J44', 'respiratoire', 'grave', 12.0, False),
+    ('Angine', 'J02', 'infectieuse', 'legere', 0.0, True),
+    ('Hypothyroïdie', 'E03', 'chronique', 'legere', 0.3, False),
+    ('Appendicite Aiguë', 'K35', 'aigue', 'grave', 0.2, False),
+    ('COVID-19', 'U07', 'infectieuse', 'moderee', 1.0, True),
+]
+SYMPTOMES = [
+    ('Toux', 'respiratoire'), ('Essoufflement', 'respiratoire'), ('Sifflement respiratoire', 'respiratoire'),
+    ('Nausées', 'digestif'), ('Diarrhée', 'digestif'), ('Douleurs abdominales', 'digestif'),
+    ('Vertiges', 'neurologique'), ('Céphalées', 'neurologique'), ('Fatigue', 'neurologique'),
+    ('Douleur thoracique', 'douleur'), ('Douleurs articulaires', 'douleur'), ('Maux de gorge', 'douleur'),
+    ('Fièvre', 'fievre'), ('Frissons', 'fievre'), ('Sueurs nocturnes', 'fievre'),
+]
+# (name, type, dosage, form)
+MEDICAMENTS = [
+    ('Lisinopril', 'anticoagulant', '10mg', 'Comprimé'), ('Amlodipine', 'anticoagulant', '5mg', 'Comprimé'),
+    ('Metformine', 'anti_inflammatoire', '500mg', 'Comprimé'), ('Salbutamol', 'antibiotique', '100mcg', 'Inhalateur'),
+    ('Paracétamol', 'analgesique', '500mg', 'Comprimé'), ('Ibuprofène', 'anti_inflammatoire', '400mg', 'Comprimé'),
+    ('Amoxicilline', 'antibiotique', '1g', 'Comprimé'), ('Oseltamivir', 'antiviral', '75mg', 'Gélule'),
+    ('Warfarine', 'anticoagulant', '5mg', 'Comprimé'), ('Tramadol', 'analgesique', '50mg', 'Gélule'),
+]
+FABRICANTS = ['Laboratoires Pharma', 'Cardio Pharma', 'BioPharm', 'RespiraPharma', 'GeneriPharm', 'EcoMed']
+# type: (weight, median cost €, median carbon score kg CO2)
+TYPES_TRAITEMENT = {
+    'medicamenteux': (60, 60, 4.0),
+    'physiotherapie': (15, 300, 1.5),
+    'chirurgie': (10, 8000, 18.0),
+    'radiotherapie': (5, 12000, 22.0),
+    'psychotherapie': (10, 600, 1.0),
+}
+POSOLOGIES = ['1 comprimé matin', '1 comprimé matin et soir', '2 bouffées matin et soir',
+              '500mg 2x/jour avec repas', 'Programme exercice 30min/jour', '1 injection par jour',
+              'Séances hebdomadaires']
+
+
+def scaled_counts(patients):
+    """Row counts of the catalogue tables for a number of patients"""
+    counts = {'patients': patients}
+    for table, (ratio, minimum, maximum) in RATIOS.items():
+        count = max(minimum, round(patients * ratio))
+        counts[table] = min(count, maximum) if maximum else count
+    counts['symptomes'] = counts['maladies'] * SYMPTOMES_PER_MALADIE
+    return counts
+
+
+def _ascii(text):
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower().replace(' ', '')
+
+
+def _money(value):
+    return Decimal(f'{value:.2f}')
+
+
+def _weighted(choices):
+    """(values, cumulative weights) for Random.choices"""
+    return list(choices), list(accumulate(choices.values()))
+
+
+class SyntheticDataGenerator:
+    """
+    Generates a dataset of `patients` patients, the other tables being
+    sized from RATIOS. progress: optional callable(table, rows written).
+    """
+
+    def __init__(self, patients=1000, seed=0, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+        self.rng = random.Random(seed)
+        self.counts = scaled_counts(patients)
+        self.batch_size = batch_size
+        self.progress = progress
+        self.written = {}
+        self.seconds = 0.0
+
+    # -- helpers -----------------------------------------------------------
+
+    def _insert(self, model, objects, table=None):
+        """bulk_create one batch, returning the new primary keys"""
+        created = model.objects.bulk_create(objects, batch_size=self.batch_size)
+        table = table or model._meta.db_table
+        self.written[table] = self.written.get(table, 0) + len(created)
+        if self.progress:
+            self.progress(table, self.written[table])
+        return [obj.pk for obj in created]
+
+    def _insert_all(self, model, objects):
+        """bulk_create an iterable of objects batch by batch; returns an array of the new keys"""
+        pks = array('q')
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                pks.extend(self._insert(model, batch))
+                batch = []
+        if batch:
+            pks.extend(self._insert(model, batch))
+        return pks
+
+    def _link(self, field, pairs):
+        """Insert (source_id, target_id) pairs into the through table of a ManyToManyField"""
+        through = field.remote_field.through
+        source, target = field.m2m_field_name() + '_id', field.m2m_reverse_field_name() + '_id'
+        batch = []
+        for source_id, target_id in pairs:
+            batch.append(through(**{source: source_id, target: target_id}))
+            if len(batch) >= self.batch_size:
+                self._insert(through, batch)
+                batch = []
+        if batch:
+            self._insert(through, batch)
+
+    def _set_dates(self, model, objects, field, dates):
+        """Give inserted rows their generated dates: auto_now_add replaced them with now() on insert"""
+        # One prepared UPDATE per row: bulk_update's CASE expressions cost more than the inserts
+        column, quote = model._meta.get_field(field), connection.ops.quote_name
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {quote(model._meta.db_table)} SET {quote(column.column)} = %s '
+                f'WHERE {quote(model._meta.pk.column)} = %s',
+                [(column.get_db_prep_value(value, connection), obj.pk) for obj, value in zip(objects, dates)],
+            )
+
+    def _diagnostic_date(self):
+        end = datetime.combine(REFERENCE_DATE, datetime.min.time(), tzinfo=timezone.utc)
+        return end - timedelta(seconds=self.rng.randrange(DIAGNOSTIC_SPAN_DAYS * 86400))
+
+    def _count(self, mean):
+        """Non-negative integer with the given mean (geometric distribution)"""
+        if mean <= 0:
+            return 0
+        return int(math.log(1 - self.rng.random()) / math.log(mean / (mean + 1)))
+
+    def _person(self, i, prefix):
+        rng = self.rng
+        sexe = 'F' if rng.random() < 0.51 else ('M' if rng.random() < 0.99 else 'A')
+        prenom = rng.choice(PRENOMS_F if sexe == 'F' else PRENOMS_M)
+        nom = rng.choice(NOMS)
+        ville, _ = rng.choice(VILLES)
+        return {
+            'nom': nom,
+            'prenom': prenom,
+            'sexe': sexe,
+            'email': f'{_ascii(prenom)}.{_ascii(nom)}.{prefix}{i}@example.fr',
+            'telephone': f'0{rng.randint(1, 7)}{rng.randint(0, 99999999):08d}',
+            'adresse': f'{rng.randint(1, 150)} {rng.choice(RUES)}, {ville}',
+        }
+
+    # -- tables --------------------------------------------------------------
+
+    def _etablissements(self):
+        types, weights = _weighted(TYPES_ETABLISSEMENT)
+        for i in range(self.counts['etablissements']):
+            kind = self.rng.choices(types, cum_weights=weights)[0]
+            ville, departement = self.rng.choice(VILLES)
+            low, high = CAPACITES[kind]
+            yield Etablissement(
+                nom_etablissement=f"{dict(Etablissement.TYPE_CHOICES)[kind]} {self.rng.choice(NOMS)} {ville} {i + 1}",
+                adresse_etablissement=f"{self.rng.randint(1, 150)} {self.rng.choice(RUES)}, {departement}000 {ville}",
+                type_etablissement=kind,
+                capacite=self.rng.randint(low, high),
+                certifications=self.rng.choice(['', 'HAS', 'ISO 9001, HAS', 'HAS, Éco-Label']),
+            )
+
+    def _medecins(self, etablissements):
+        specialites, weights = _weighted(SPECIALITES)
+        for i in range(self.counts['medecins']):
+            experience = min(40, int(self.rng.expovariate(1 / 14)))
+            age = 27 + experience + self.rng.randint(0, 5)
+            yield Medecin(
+                **self._person(i, 'm'),
+                date_naissance=REFERENCE_DATE - timedelta(days=age * 365 + self.rng.randint(0, 364)),
+                numero_ordre=f'{10000000 + i}',
+                specialite=self.rng.choices(specialites, cum_weights=weights)[0],
+                annees_experience=experience,
+                etablissement_id=self.rng.choice(etablissements),
+            )
+
+    def _patients(self, etablissements):
+        groupes, weights = _weighted(GROUPES_SANGUINS)
+        for i in range(self.counts['patients']):
+            person = self._person(i, 'p')
+            age = min(100, max(0, int(self.rng.gauss(45, 20))))
+            birth = REFERENCE_DATE - timedelta(days=age * 365 + self.rng.randint(0, 364))
+            allergies = ', '.join(self.rng.sample(ALLERGIES, self._count(0.4) % len(ALLERGIES)))
+            yield Patient(
+                **person,
+                date_naissance=birth,
+                # Sex, birth year and month, then a counter: unique and 15 characters long
+                numero_securite_sociale=f"{2 if person['sexe'] == 'F' else 1}{birth:%y%m}{i:010d}",
+                imc=_money(min(60, max(15, self.rng.gauss(25.5, 4.5)))),
+                groupe_sanguin=self.rng.choices(groupes, cum_weights=weights)[0],
+                allergies=allergies,
+                # A quarter of the patients are not attached to an establishment
+                etablissement_id=self.rng.choice(etablissements) if self.rng.random() < 0.75 else None,
+            )
+
+    def _maladies(self):
+        for i in range(self.counts['maladies']):
+            name, code, kind, gravite, mortalite, contagieuse = MALADIES[i % len(MALADIES)]
+            variant = i // len(MALADIES)
+            yield Maladie(
+                nom_maladie=name if not variant else f'{name} - forme {variant}',
+                code_cim10=code if not variant else f'{code}.{variant % 10}',
+                type_maladie=kind,
+                gravite=gravite,
+                taux_mortalite=_money(mortalite * self.rng.uniform(0.5, 1.5)),
+                contagieuse=contagieuse,
+                description=f'{name} (données synthétiques)',
+            )
+
+    def _symptomes(self):
+        for i in range(self.counts['symptomes']):
+            name, kind = SYMPTOMES[i % len(SYMPTOMES)]
+            yield Symptome(
+                nom_symptome=name,
+                type_symptome=kind,
+                intensite=self.rng.choice(['faible', 'moderee', 'forte']),
+                duree_symptome=max(1, int(self.rng.expovariate(1 / 10))),
+            )
+
+    def _medicaments(self):
+        for i in range(self.counts['medicaments']):
+            name, kind, dosage, forme = MEDICAMENTS[i % len(MEDICAMENTS)]
+            variant = i // len(MEDICAMENTS)
+            yield Medicament(
+                nom_medicament=name if not variant else f'{name} {variant}',
+                type_medicament=kind,
+                dosage=dosage,
+                forme=forme,
+                fabricant=self.rng.choice(FABRICANTS),
+                effets_secondaires=self.rng.choice(['Rares', 'Troubles digestifs', 'Vertiges', 'Somnolence']),
+            )
+
+    def _traitements(self, maladies):
+        """(impact, traitement) pairs, 1 + geometric treatments per disease"""
+        types, weights = _weighted({kind: spec[0] for kind, spec in TYPES_TRAITEMENT.items()})
+        for maladie_id in maladies:
+            for n in range(1 + self._count(TRAITEMENTS_PER_MALADIE - 1)):
+                kind = self.rng.choices(types, cum_weights=weights)[0]
+                _, cost, carbon = TYPES_TRAITEMENT[kind]
+                score = round(self.rng.lognormvariate(math.log(carbon), 0.6), 2)
+                impact = ImpactEnvironnemental(
+                    type_impact=ImpactEnvironnemental.type_for_score(score),
+                    score_carbone=_money(score),
+                    consommation_eau=_money(score * self.rng.uniform(4, 12)),
+                    dechets=_money(score * self.rng.uniform(0.05, 1.2)),
+                    recyclable=score < 5 and self.rng.random() < 0.8,
+                )
+                traitement = Traitement(
+                    nom_traitement=f'{dict(Traitement.TYPE_CHOICES)[kind]} {n + 1}',
+                    type_traitement=kind,
+                    cout=_money(self.rng.lognormvariate(math.log(cost), 0.7)),
+                    duree=max(1, int(self.rng.lognormvariate(math.log(60), 1))),
+                    efficacite=_money(min(99, max(40, self.rng.gauss(78, 10)))),
+                    description='Traitement synthétique',
+                    maladie_id=maladie_id,
+                )
+                yield impact, traitement
+
+    def _insert_traitements(self, maladies, medicaments):
+        """Impacts and treatments batch by batch, then their drugs; returns {maladie_id: [traitement_id]}"""
+        by_maladie = {}
+        drug_links = []
+        pending = []
+
+        def flush():
+            impact_ids = self._insert(ImpactEnvironnemental, [impact for impact, _ in pending])
+            for impact_id, (_, traitement) in zip(impact_ids, pending):
+                traitement.impact_environnemental_id = impact_id
+            traitements = [traitement for _, traitement in pending]
+            for traitement_id, traitement in zip(self._insert(Traitement, traitements), traitements):
+                by_maladie.setdefault(traitement.maladie_id, []).append(traitement_id)
+                if traitement.type_traitement == 'medicamenteux':
+                    for medicament_id in self.rng.sample(medicaments, min(len(medicaments), 1 + self._count(0.5))):
+                        drug_links.append((traitement_id, medicament_id))
+            pending.clear()
+
+        for pair in self._traitements(maladies):
+            pending.append(pair)
+            if len(pending) >= self.batch_size:
+                flush()
+        if pending:
+            flush()
+        self._link(Traitement._meta.get_field('medicaments'), drug_links)
+        return by_maladie
+
+    def _insert_diagnostics(self, patients, medecins, maladies, traitements):
+        """Diagnostics patient batch by patient batch, each followed by its prescriptions"""
+        # Zipf prevalence over a shuffled disease order
+        order = list(maladies)
+        self.rng.shuffle(order)
+        prevalence = list(accumulate(1 / (rank + 1) ** PREVALENCE_SKEW for rank in range(len(order))))
+
+        for start in range(0, len(patients), self.batch_size):
+            diagnostics, diagnostic_dates = [], []
+            for patient_id in patients[start:start + self.batch_size]:
+                for _ in range(self._count(DIAGNOSTICS_PER_PATIENT)):
+                    diagnostics.append(Diagnostic(
+                        patient_id=patient_id,
+                        maladie_id=order[bisect_left(prevalence, self.rng.random() * prevalence[-1])],
+                        medecin_id=medecins[self.rng.randrange(len(medecins))],
+                        notes=self.rng.choice(['', 'Suivi recommandé', 'Contrôle dans 3 mois', 'Cas léger']),
+                    ))
+                    diagnostic_dates.append(self._diagnostic_date())
+            if not diagnostics:
+                continue
+            prescriptions, prescription_dates = [], []
+            diagnostic_ids = self._insert(Diagnostic, diagnostics)
+            for diagnostic_id, diagnostic, diagnosed in zip(diagnostic_ids, diagnostics, diagnostic_dates):
+                candidates = traitements.get(diagnostic.maladie_id, [])
+                count = min(len(candidates), self._count(PRESCRIPTIONS_PER_DIAGNOSTIC))
+                for traitement_id in self.rng.sample(candidates, count):
+                    prescriptions.append(Prescription(
+                        diagnostic_id=diagnostic_id,
+                        traitement_id=traitement_id,
+                        posologie=self.rng.choice(POSOLOGIES),
+                        duree_prescription=self.rng.choice([7, 14, 30, 90, 180, 365]),
+                        renouvellement=self.rng.random() < 0.4,
+                    ))
+                    prescription_dates.append(
+                        diagnosed + timedelta(seconds=self.rng.randrange(PRESCRIPTION_DELAY_DAYS * 86400)))
+            self._set_dates(Diagnostic, diagnostics, 'date_diagnostic', diagnostic_dates)
+            if prescriptions:
+                self._insert(Prescription, prescriptions)
+                self._set_dates(Prescription, prescriptions, 'date_prescription', prescription_dates)
+
+    def generate(self):
+        """Write the whole dataset; returns {table: rows written}"""
+        started = time.perf_counter()
+        etablissements = list(self._insert_all(Etablissement, self._etablissements()))
+        medecins = self._insert_all(Medecin, self._medecins(etablissements))
+        maladies = list(self._insert_all(Maladie, self._maladies()))
+
+        symptomes = self._insert_all(Symptome, self._symptomes())
+        self._link(Symptome._meta.get_field('maladies'), (
+            (symptome_id, maladie_id)
+            for symptome_id in symptomes
+            for maladie_id in self.rng.sample(maladies, min(len(maladies), 1 + self._count(1)))
+        ))
+        medicaments = list(self._insert_all(Medicament, self._medicaments()))
+        traitements = self._insert_traitements(maladies, medicaments)
+
+        patients = self._insert_all(Patient, self._patients(etablissements))
+        self._insert_diagnostics(patients, medecins, maladies, traitements)
+        # bulk_create sends no signals
+        reconcile_stats()
+        bump_all_table_versions()
+        self.seconds = time.perf_counter() - started
+        return dict(self.written)
@@ -1,3 +1,1167 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import json
+from decimal import Decimal
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from io import StringIO
+from itertools import count
+from operator import itemgetter
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+import httpx
+import requests
+
+import msgpack
+from rdflib import ConjunctiveGraph
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from .models import (
+    Etablissement, Patient, Medecin, Maladie, Symptome,
+    ImpactEnvironnemental, Medicament, Traitement, Examen,
+    Diagnostic, Prescription, DashboardCounter, RdfDigest, RdfOutbox
+)
+from .async_sparql import AsyncSparqlClient
+from .clinical_import import ClinicalImporter
+from .conditional_get import table_versions
+from .dashboard_stats import compute_stats, current_stats, reconcile_stats, stats_payload
+from .graph_versions import (
+    LEGACY_GRAPH, POINTER_KEY, SERVED_GRAPH, begin_reload, collect_garbage, end_reload,
+    get_current_graph, hold_reload, list_versions, new_version_graph, read_pointer, switch_to,
+)
+from .data_snapshots import (
+    NOT_SAVED, SnapshotError, data_models, delete_snapshot, list_snapshots, reset_data,
+    restore_snapshot, save_snapshot,
+)
+from .fast_serializers import FAST_SERIALIZERS, values_serializer_for
+from .query_router import medecins_by_specialite_orm, medecins_by_specialite_sparql
+from .rdf_drift import DriftChecker
+from .rdf_loader import BulkLoader
+from .rdf_mapping import iri, resource, string, to_ntriples
+from .rdf_sync import apply_pending
+from .rdflib_backend import LocalGraphClient, ReadWriteLock, result_to_json
+from .sparql_queries import OntologyQuery, _treatment_pairs
+from .renderers import ORJSONRenderer
+from .serializers import DiagnosticSerializer, PrescriptionSerializer, TraitementSerializer
+from .sparql_cache import bump_dataset_generation
+from .sparql_client import SparqlClient
+from .sparql_metrics import get_metrics
+from .synthetic_data import DIAGNOSTIC_SPAN_DAYS, PRESCRIPTION_DELAY_DAYS, REFERENCE_DATE, SyntheticDataGenerator
+
+_sequence = count(1)
+
+
+def create_clinical_case():
+    """One row in every table, linked the way the API serializes them"""
+    n = next(_sequence)
+    etablissement = Etablissement.objects.create(
+        nom_etablissement=f"Hôpital {n}", adresse_etablissement=f"{n} rue de la Santé", capacite=100,
+    )
+    patient = Patient.objects.create(
+        nom=f"Patient{n}", prenom="Marie", email=f"patient{n}@example.fr",
+        numero_securite_sociale=f"{n:015d}", etablissement=etablissement,
+    )
+    medecin = Medecin.objects.create(
+        nom=f"Medecin{n}", prenom="Pierre", email=f"medecin{n}@example.fr",
+        numero_ordre=f"ORD{n}", specialite='generaliste', etablissement=etablissement,
+    )
+    maladie = Maladie.objects.create(
+        nom_maladie=f"Maladie {n}", type_maladie='chronique', gravite='moderee',
+    )
+    symptome = Symptome.objects.create(
+        nom_symptome=f"Symptôme {n}", type_symptome='douleur', intensite='faible', duree_symptome=3,
+    )
+    symptome.maladies.add(maladie)
+    medicament = Medicament.objects.create(
+        nom_medicament=f"Médicament {n}", type_medicament='analgesique', dosage='500mg',
+        forme='Comprimé', fabricant='GeneriPharm',
+    )
+    traitement = Traitement.objects.create(
+        nom_traitement=f"Traitement {n}", type_traitement='medicamenteux', cout=10, duree=30,
+        efficacite=80, maladie=maladie,
+        impact_environnemental=ImpactEnvironnemental.objects.create(
+            score_carbone=2.5, consommation_eau=10, dechets=0.5, recyclable=True,
+        ),
+    )
+    traitement.medicaments.add(medicament)
+    examen = Examen.objects.create(
+        nom_examen=f"Examen {n}", type_examen='biologique', date_examen='2024-01-01', cout_examen=20,
+    )
+    examen.maladies_diagnostiquees.add(maladie)
+    diagnostic = Diagnostic.objects.create(patient=patient, maladie=maladie, medecin=medecin)
+    diagnostic.examens.add(examen)
+    Prescription.objects.create(
+        diagnostic=diagnostic, traitement=traitement, posologie="1 comprimé matin", duree_prescription=30,
+    )
+    return patient, medecin, maladie
+
+
+class RdflibBackendMixin:
+    """
+    use_rdflib_graph() sends OntologyQuery to an in-process rdflib graph
+    (SPARQL_BACKEND = 'rdflib') built from the test database on the first
+    query, so SPARQL plans run without Fuseki.
+    """
+
+    def use_rdflib_graph(self):
+        client = LocalGraphClient(snapshot_path=None, ontology_path=settings.RDFLIB_ONTOLOGY_PATH)
+        backend = override_settings(SPARQL_BACKEND='rdflib')
+        backend.enable()
+        self.addCleanup(backend.disable)
+        patcher = mock.patch('ontology_app.sparql_client._client', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Results cached by an earlier test belong to another graph
+        bump_dataset_generation()
+        return client
+
+
+class QueryBudgetMixin:
+    """
+    assertQueryBudget(url, grow) requests `url`, calls grow() to add rows,
+    requests it again and fails if the second response took more queries:
+    the query count of an endpoint must not depend on the number of rows.
+    """
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return queries
+
+    def assertQueryBudget(self, url, grow, max_queries=None):
+        before = self.count_queries(url)
+        grow()
+        after = self.count_queries(url)
+        executed = '\n'.join(query['sql'] for query in after.captured_queries)
+        self.assertEqual(
+            len(after), len(before),
+            f"{url}: {len(before)} queries before adding rows, {len(after)} after\n{executed}",
+        )
+        if max_queries is not None:
+            self.assertLessEqual(len(after), max_queries, f"{url}\n{executed}")
+
+
+class ViewSetQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Every list endpoint loads its serialized relations in a constant number of queries"""
+
+    def setUp(self):
+        self.patient, self.medecin, self.maladie = create_clinical_case()
+
+    def grow(self):
+        for _ in range(3):
+            create_clinical_case()
+
+    def test_list_endpoints(self):
+        for resource in ['etablissements', 'patients', 'medecins', 'maladies', 'symptomes', 'traitements',
+                         'medicaments', 'impacts', 'examens', 'diagnostics', 'prescriptions']:
+            with self.subTest(resource=resource):
+                self.assertQueryBudget(f'/api/{resource}/', self.grow, max_queries=4)
+
+    def test_list_actions(self):
+        urls = [
+            f'/api/patients/{self.patient.pk}/diagnostics/',
+            f'/api/maladies/{self.maladie.pk}/traitements/',
+            '/api/medecins/by_specialite/?specialite=generaliste',
+            '/api/traitements/by_type/?type=medicamenteux',
+            '/api/traitements/eco_responsables/',
+            '/api/prescriptions/eco_alternatives/',
+            f'/api/diagnostics/by_patient/?patient_id={self.patient.pk}',
+            f'/api/diagnostics/by_medecin/?medecin_id={self.medecin.pk}',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertQueryBudget(url, self.grow, max_queries=4)
+
+
+class ValuesSerializerTests(TestCase):
+    """The .values() fast path renders exactly what the DRF serializers render"""
+
+    def setUp(self):
+        for _ in range(3):
+            patient, medecin, maladie = create_clinical_case()
+        # A treatment without impact, several medicaments and examens, an empty relation
+        traitement = Traitement.objects.create(
+            nom_traitement="Sans impact", type_traitement='chirurgie', cout=1234.5, duree=1,
+            efficacite=12.345, maladie=maladie,
+        )
+        traitement.medicaments.set(Medicament.objects.all())
+        diagnostic = Diagnostic.objects.create(patient=patient, maladie=maladie, medecin=medecin)
+        diagnostic.examens.set(Examen.objects.all())
+        Diagnostic.objects.create(patient=patient, maladie=maladie, medecin=medecin)
+        Prescription.objects.create(
+            diagnostic=diagnostic, traitement=traitement, posologie="Une fois", duree_prescription=1,
+        )
+
+    def test_same_json_as_serializer(self):
+        render = JSONRenderer().render
+        for serializer_class in FAST_SERIALIZERS:
+            with self.subTest(serializer=serializer_class.__name__):
+                fast = values_serializer_for(serializer_class)
+                queryset = serializer_class.setup_eager_loading(serializer_class.Meta.model.objects.order_by('pk'))
+                self.assertEqual(
+                    render(fast.serialize(fast.rows(queryset))),
+                    render(serializer_class(queryset, many=True).data),
+                )
+
+    def test_endpoints(self):
+        render = JSONRenderer().render
+        for resource, serializer_class in [('traitements', TraitementSerializer),
+                                           ('diagnostics', DiagnosticSerializer),
+                                           ('prescriptions', PrescriptionSerializer)]:
+            with self.subTest(resource=resource):
+                model = serializer_class.Meta.model
+                expected = serializer_class(model.objects.order_by('pk'), many=True).data
+                listed = self.client.get(f'/api/{resource}/?page_size=100').json()['results']
+                self.assertEqual(sorted(listed, key=itemgetter('id')), json.loads(render(expected)))
+                instance = model.objects.last()
+                self.assertEqual(self.client.get(f'/api/{resource}/{instance.pk}/').json(),
+                                 json.loads(render(serializer_class(instance).data)))
+
+
+class RendererTests(TestCase):
+    """orjson and MessagePack carry exactly what DRF's JSONRenderer renders"""
+
+    def setUp(self):
+        create_clinical_case()
+
+    def test_negotiation(self):
+        for url in ['/api/prescriptions/', '/api/patients/', '/api/stats/']:
+            with self.subTest(url=url):
+                as_json = self.client.get(url, HTTP_ACCEPT='application/json')
+                as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+                self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+                self.assertEqual(msgpack.unpackb(as_msgpack.content), json.loads(as_json.content))
+                self.assertEqual(as_json.content, JSONRenderer().render(json.loads(as_json.content)))
+
+    def test_orjson_matches_json_module(self):
+        data = self.client.get('/api/diagnostics/').data
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class QueryRouterTests(RdflibBackendMixin, TestCase):
+    """Both plans of a routed query return the same rows"""
+
+    def setUp(self):
+        create_clinical_case()
+        for n, (specialite, experience) in enumerate([('autre', 7), ('cardiologue', 15), ('autre', 3)]):
+            Medecin.objects.create(
+                nom=f"Specialiste{n}", prenom="Anne", email=f"specialiste{n}@example.fr",
+                numero_ordre=f"SPE{n}", specialite=specialite, annees_experience=experience,
+            )
+        self.use_rdflib_graph()
+
+    def test_medecins_by_specialite(self):
+        for specialite in ['generaliste', 'cardiologue', 'pneumologue', 'autre', 'inconnue']:
+            with self.subTest(specialite=specialite):
+                self.assertEqual(medecins_by_specialite_sparql(specialite),
+                                 medecins_by_specialite_orm(specialite))
+        self.assertEqual(len(medecins_by_specialite_orm('autre')), 2)
+
+
+class TreatmentPairsTests(RdflibBackendMixin, TestCase):
+    """?mode=linear alternatives: blocked pair computation and parameter validation"""
+
+    @staticmethod
+    def results(scores):
+        def literal(value):
+            return {"type": "literal", "datatype": "http://www.w3.org/2001/XMLSchema#decimal", "value": str(value)}
+        return {"results": {"bindings": [
+            {"maladie": literal("M"), "t": {"type": "uri", "value": f"T{n % 7}"},
+             "traitement": literal(f"T{n % 7}"), "score": literal(score), "efficacite": literal(n % 5)}
+            for n, score in enumerate(scores)
+        ]}}
+
+    @staticmethod
+    def pairs(result):
+        return [(b["traitement1"]["value"], b["score1"]["value"], b["traitement2"]["value"], b["score2"]["value"])
+                for b in result["results"]["bindings"]]
+
+    def test_blocks_match_full_matrix(self):
+        results = self.results([(n * 37) % 23 / 4 for n in range(60)])
+        for top_k, min_diff in [(None, 0), (None, 2), (5, 0), (40, 1), (10000, 0)]:
+            with self.subTest(top_k=top_k, min_diff=min_diff):
+                full = _treatment_pairs(results, top_k, min_diff)
+                with mock.patch('ontology_app.sparql_queries.PAIR_BLOCK_CELLS', 100):
+                    blocked = _treatment_pairs(results, top_k, min_diff)
+                diffs = [float(b["scoreDiff"]["value"]) for b in blocked["results"]["bindings"]]
+                self.assertEqual(diffs, sorted(diffs, reverse=True))
+                if top_k is None:
+                    self.assertEqual(self.pairs(blocked), self.pairs(full))
+                else:
+                    self.assertEqual(len(diffs), min(top_k, len(_treatment_pairs(results)["results"]["bindings"])))
+                    self.assertEqual(diffs, [float(b["scoreDiff"]["value"]) for b in full["results"]["bindings"]])
+
+    def test_top_k_bounds(self):
+        results = self.results([1, 2, 3, 4])
+        self.assertEqual(_treatment_pairs(results, 0)["results"]["bindings"], [])
+        self.assertEqual(len(_treatment_pairs(results, 1)["results"]["bindings"]), 1)
+        with self.assertRaises(ValueError):
+            _treatment_pairs(results, -1)
+
+    def test_invalid_parameters_are_rejected(self):
+        self.use_rdflib_graph()
+        for url in ['/api/semantic/alternatives/', '/api/async/semantic/alternatives/']:
+            for params, message in [({'top_k': 'abc'}, 'top_k'), ({'top_k': '-1'}, 'top_k'),
+                                    ({'min_diff': 'x'}, 'min_diff'), ({'min_diff': 'nan'}, 'min_diff')]:
+                with self.subTest(url=url, params=params):
+                    response = self.client.get(url, {'mode': 'linear', **params})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(message, response.json()['error'])
+            response = self.client.get(url, {'mode': 'linear', 'top_k': '1', 'min_diff': '0.5'})
+            self.assertEqual(response.status_code, 200)
+
+
+class ConditionalGetTests(RdflibBackendMixin, TestCase):
+    """ETags answer 304 without queries and move whenever a source table changes"""
+
+    def setUp(self):
+        self.patient, self.medecin, self.maladie = create_clinical_case()
+        self.diagnostic = Diagnostic.objects.get(patient=self.patient)
+
+    def assertChangesETag(self, url, change):
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified(self):
+        first = self.client.get('/api/patients/')
+        for header, value in [('If-None-Match', first['ETag']), ('If-Modified-Since', first['Last-Modified'])]:
+            with self.subTest(header=header):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get('/api/patients/', headers={header: value})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(len(queries), 0)
+                for name in ('ETag', 'Last-Modified', 'Cache-Control'):
+                    self.assertEqual(response[name], first[name], name)
+                self.assertIn('Accept', response['Vary'])
+
+    def test_save_delete_and_m2m_move_the_etag(self):
+        def save():
+            self.patient.prenom = "Claire"
+            self.patient.save()
+
+        examen = Examen.objects.create(
+            nom_examen="Radio", type_examen='imagerie', date_examen='2024-02-01', cout_examen=50,
+        )
+        self.assertChangesETag('/api/patients/', save)
+        self.assertChangesETag('/api/diagnostics/', lambda: self.diagnostic.examens.add(examen))
+        self.assertChangesETag('/api/diagnostics/', lambda: Diagnostic.objects.filter(pk=self.diagnostic.pk).delete())
+
+    def test_fallback_not_cacheable(self):
+        url = '/api/traitements/eco_ontology/'
+        failing = mock.Mock()
+        failing.query.side_effect = requests.ConnectionError("Fuseki down")
+        with mock.patch('ontology_app.sparql_client._client', failing):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+        self.use_rdflib_graph()
+        response = self.client.get(url)
+        self.assertTrue(response.json()['results']['bindings'])
+        self.assertIn('ETag', response)
+
+
+class AsyncViewTests(RdflibBackendMixin, TestCase):
+    """The /api/async/ views: GET only, conditional GET through the coroutine branch, bounded fan-out"""
+
+    URL = '/api/async/ontology/query/'
+
+    def setUp(self):
+        create_clinical_case()
+        # Built now: the async views must not hit the database from the event loop
+        self.use_rdflib_graph().graph
+
+    async def test_get_only(self):
+        for method in ('post', 'put', 'delete'):
+            with self.subTest(method=method):
+                response = await getattr(self.async_client, method)(self.URL)
+                self.assertEqual(response.status_code, 405)
+                self.assertEqual(response['Allow'], 'GET')
+        response = await self.async_client.head(self.URL)
+        self.assertEqual(response.status_code, 200)
+
+    async def test_not_modified(self):
+        first = await self.async_client.get(self.URL)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(json.loads(first.content)['results']['bindings'])
+        # A 304 is answered before the view runs
+        with mock.patch('ontology_app.async_views.AsyncOntologyQuery', side_effect=AssertionError("view ran")):
+            response = await self.async_client.get(self.URL, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+    async def test_fallback_not_cacheable(self):
+        with mock.patch('ontology_app.async_sparql.AsyncLocalGraphClient.query',
+                        side_effect=requests.ConnectionError("Fuseki down")):
+            response = await self.async_client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['results']['bindings'], [])
+        self.assertNotIn('ETag', response)
+
+    async def test_concurrency_is_bounded(self):
+        running, peak = 0, 0
+
+        async def fuseki(request):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if request.url.params.get('default-graph-uri') == 'urn:down':
+                return httpx.Response(503)
+            return httpx.Response(200, json={'head': {'vars': ['s']}, 'results': {'bindings': []}})
+
+        client = AsyncSparqlClient('http://fuseki.test/sparql', max_concurrency=3)
+        await client.aclose()
+        client._http = httpx.AsyncClient(transport=httpx.MockTransport(fuseki))
+        results = await asyncio.gather(*(client.query('SELECT ?s WHERE { ?s ?p ?o }') for _ in range(10)))
+        self.assertEqual(len(results), 10)
+        self.assertEqual(peak, 3)
+        with self.assertRaises(httpx.HTTPStatusError):
+            await client.query('ASK { ?s ?p ?o }', default_graph='urn:down')
+        stats = client.stats()
+        self.assertEqual((stats['queries'], stats['errors'], stats['peak_in_flight']), (11, 1, 3))
+        self.assertEqual((stats['in_flight'], stats['waiting']), (0, 0))
+        await client.aclose()
+
+
+class RdflibBackendTests(RdflibBackendMixin, TestCase):
+    """OntologyQuery against the embedded rdflib backend, without Fuseki"""
+
+    def setUp(self):
+        self.cases = [create_clinical_case() for _ in range(2)]
+        self.graph_client = self.use_rdflib_graph()
+
+    def values(self, results, name):
+        return sorted(row[name]['value'] for row in results['results']['bindings'])
+
+    def test_ontology_queries(self):
+        ontology = OntologyQuery(raise_errors=True)
+        self.assertEqual(self.values(ontology.get_all_patients(), 'email'),
+                         sorted(Patient.objects.values_list('email', flat=True)))
+        self.assertEqual(self.values(ontology.get_traitements_eco_responsables(5.0), 'nomTraitement'),
+                         sorted(Traitement.objects.values_list('nom_traitement', flat=True)))
+        self.assertEqual(self.values(ontology.get_medecins_by_specialite('Generaliste'), 'nom'),
+                         sorted(Medecin.objects.values_list('nom', flat=True)))
+        noms = [maladie.nom_maladie for _, _, maladie in self.cases]
+        self.assertEqual(self.values(ontology.get_traitements_for_maladie(noms[0]), 'nomTraitement'),
+                         sorted(Traitement.objects.filter(maladie__nom_maladie=noms[0])
+                                .values_list('nom_traitement', flat=True)))
+        batch = ontology.get_traitements_for_maladies(noms)
+        self.assertEqual(sorted(batch), sorted(noms))
+        for nom in noms:
+            self.assertEqual(len(batch[nom]['results']['bindings']), 1)
+
+    def test_update_is_visible_to_queries(self):
+        ontology = OntologyQuery(raise_errors=True)
+        before = len(ontology.get_all_patients()['results']['bindings'])
+        self.graph_client.update(
+            'INSERT DATA { <http://example.org/health#Patient_999> '
+            '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://example.org/health#Patient> }'
+        )
+        self.assertEqual(len(ontology.get_all_patients()['results']['bindings']), before + 1)
+
+    def test_concurrent_queries_and_updates(self):
+        ontology = OntologyQuery(raise_errors=True)
+        query = 'SELECT (COUNT(*) AS ?n) WHERE { ?s ?p ?o }'
+        self.graph_client.query(query)
+        errors = []
+
+        def read():
+            try:
+                for _ in range(20):
+                    self.graph_client.query(query)
+                    ontology.get_all_patients()
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        for n in range(20):
+            self.graph_client.update(
+                f'INSERT DATA {{ <http://example.org/health#Patient_{1000 + n}> '
+                f'<http://example.org/health#nom> "Concurrent" }}'
+            )
+        for thread in readers:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_queries_share_the_graph(self):
+        lock = ReadWriteLock()
+        entered = {'reading': threading.Event(), 'writing': threading.Event()}
+
+        def enter(mode):
+            with getattr(lock, mode)():
+                entered[mode].set()
+
+        with lock.reading():
+            threads = {mode: threading.Thread(target=enter, args=(mode,)) for mode in entered}
+            threads['reading'].start()
+            self.assertTrue(entered['reading'].wait(5), "a second query waited for the first")
+            threads['writing'].start()
+            self.assertFalse(entered['writing'].wait(0.2), "an update ran during a query")
+        self.assertTrue(entered['writing'].wait(5))
+        for thread in threads.values():
+            thread.join()
+
+
+class ClinicalImportTests(TestCase):
+    """import_clinical rejects the rows the database would refuse and merges the rest"""
+
+    def setUp(self):
+        self.patient, self.medecin, self.maladie = create_clinical_case()
+        self.traitement = self.maladie.traitements.get()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.rejects_path = os.path.join(directory.name, 'rejects.csv')
+
+    def run_import(self, kind, rows):
+        """Import rows given as dicts of strings, numbered from line 2 as under a CSV header"""
+        stats = ClinicalImporter(kind, self.rejects_path).run([list(enumerate(rows, start=2))])
+        with open(self.rejects_path, newline='', encoding='utf-8') as f:
+            rejects = {int(row['line']): row['reason'] for row in csv.DictReader(f)}
+        return stats, rejects
+
+    def patient_row(self, n, **values):
+        return {'numero_securite_sociale': f'9{n:014d}', 'nom': f'Import{n}', 'prenom': 'Jeanne',
+                'email': f'import{n}@example.fr', **values}
+
+    def diagnostic_row(self, **values):
+        return {'numero_securite_sociale': self.patient.numero_securite_sociale,
+                'numero_ordre': self.medecin.numero_ordre, 'nom_maladie': self.maladie.nom_maladie,
+                'date_diagnostic': '2024-03-01 10:00', 'notes': 'Import', **values}
+
+    def test_invalid_rows_are_rejected(self):
+        row = {'nom_traitement': 'Importé', 'type_traitement': 'medicamenteux', 'cout': '12.5',
+               'duree': '10', 'efficacite': '70', 'nom_maladie': self.maladie.nom_maladie}
+        stats, rejects = self.run_import('traitements', [
+            row, {**row, 'efficacite': '150'}, {**row, 'type_traitement': 'magie'}, {**row, 'duree': 'dix'},
+        ])
+        self.assertEqual((stats.invalid, stats.inserted), (3, 1))
+        self.assertEqual(sorted(rejects), [3, 4, 5])
+        self.assertIn('efficacite', rejects[3])
+        self.assertIn('type_traitement', rejects[4])
+        self.assertIn('duree', rejects[5])
+
+    def test_duplicate_and_taken_values_are_rejected(self):
+        stats, rejects = self.run_import('patients', [
+            self.patient_row(1),
+            self.patient_row(1, email='other@example.fr'),
+            self.patient_row(2, email=self.patient.email),
+            self.patient_row(3, email='import1@example.fr'),
+            self.patient_row(4, numero_securite_sociale=self.patient.numero_securite_sociale, nom='Renommé'),
+        ])
+        self.assertEqual((stats.rejected, stats.inserted, stats.updated), (3, 1, 1))
+        self.assertIn('duplicate numero_securite_sociale', rejects[3])
+        self.assertIn('email already used', rejects[4])
+        self.assertIn('email already used', rejects[5])
+        self.patient.refresh_from_db()
+        self.assertEqual(self.patient.nom, 'Renommé')
+
+    def test_unknown_references_are_rejected(self):
+        stats, rejects = self.run_import('diagnostics', [
+            self.diagnostic_row(),
+            self.diagnostic_row(numero_ordre='ORD-INCONNU'),
+            self.diagnostic_row(nom_maladie='Maladie inconnue'),
+        ])
+        self.assertEqual((stats.rejected, stats.inserted), (2, 1))
+        self.assertIn('unknown', rejects[3])
+        self.assertIn('numero_ordre', rejects[3])
+        self.assertIn('nom_maladie', rejects[4])
+
+    def test_reimport_updates_instead_of_duplicating(self):
+        diagnostics = Diagnostic.objects.count()
+        self.run_import('diagnostics', [self.diagnostic_row()])
+        stats, _ = self.run_import('diagnostics', [self.diagnostic_row(notes='Corrigé')])
+        self.assertEqual((stats.inserted, stats.updated), (0, 1))
+        self.assertEqual(Diagnostic.objects.count(), diagnostics + 1)
+        self.assertEqual(Diagnostic.objects.get(notes='Corrigé').date_diagnostic.year, 2024)
+
+        row = {'numero_securite_sociale': self.patient.numero_securite_sociale,
+               'numero_ordre': self.medecin.numero_ordre, 'nom_maladie': self.maladie.nom_maladie,
+               'nom_traitement': self.traitement.nom_traitement, 'date_prescription': '2024-03-02 09:00',
+               'posologie': '2 comprimés', 'duree_prescription': '14'}
+        prescriptions = Prescription.objects.count()
+        self.run_import('prescriptions', [row])
+        stats, _ = self.run_import('prescriptions', [{**row, 'duree_prescription': '21'}])
+        self.assertEqual((stats.inserted, stats.updated), (0, 1))
+        self.assertEqual(Prescription.objects.count(), prescriptions + 1)
+
+    def test_dateless_rows_get_the_import_time(self):
+        diagnostics = Diagnostic.objects.count()
+        row = self.diagnostic_row(date_diagnostic='')
+        # Same references and the same import time: the second row is a duplicate key
+        stats, rejects = self.run_import('diagnostics', [row, {**row, 'notes': 'Doublon'}])
+        self.assertEqual((stats.inserted, stats.rejected), (1, 1))
+        self.assertIn('duplicate', rejects[3])
+        # Another run has another import time: the row is new again
+        stats, _ = self.run_import('diagnostics', [row])
+        self.assertEqual((stats.inserted, stats.updated), (1, 0))
+        self.assertEqual(Diagnostic.objects.count(), diagnostics + 2)
+
+    def test_prescription_goes_to_the_latest_diagnostic(self):
+        latest = Diagnostic.objects.get()
+        # Created after the latest one, but dated before it
+        older = Diagnostic.objects.create(patient=self.patient, maladie=self.maladie, medecin=self.medecin)
+        Diagnostic.objects.filter(pk=older.pk).update(date_diagnostic=latest.date_diagnostic.replace(year=2000))
+        self.run_import('prescriptions', [{
+            'numero_securite_sociale': self.patient.numero_securite_sociale,
+            'numero_ordre': self.medecin.numero_ordre, 'nom_maladie': self.maladie.nom_maladie,
+            'nom_traitement': self.traitement.nom_traitement, 'posologie': 'Le soir', 'duree_prescription': '7',
+        }])
+        self.assertEqual(Prescription.objects.get(posologie='Le soir').diagnostic, latest)
+
+
+class SparqlMetricsTests(TestCase):
+    """GET /api/ontology/metrics/ only reads the counters, DELETE clears them"""
+
+    def test_only_delete_resets(self):
+        get_metrics().record_cache_hit('get_all_patients')
+        self.assertIn('get_all_patients', self.client.get('/api/ontology/metrics/?reset=1').json()['queries'])
+        response = self.client.delete('/api/ontology/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('get_all_patients', response.json()['queries'])
+        self.assertEqual(self.client.get('/api/ontology/metrics/').json()['queries'], {})
+        self.assertEqual(self.client.post('/api/ontology/metrics/').status_code, 405)
+
+
+class RdfSyncTests(RdflibBackendMixin, TestCase):
+    """apply_pending replays the outbox onto the rdflib graph and only then drops the rows"""
+
+    HEALTH = 'http://example.org/health#'
+
+    def setUp(self):
+        self.patient, self.medecin, _ = create_clinical_case()
+        self.graph_client = self.use_rdflib_graph()
+        # Built from the database: everything queued so far is already in the graph
+        self.graph_client.graph
+        RdfOutbox.objects.all().delete()
+
+    def ask(self, pattern):
+        return self.graph_client.query(f'ASK {{ {pattern} }}')['boolean']
+
+    def change(self):
+        """Rename the patient and diagnose a new disease; returns the disease"""
+        self.patient.nom = 'Renommé'
+        self.patient.save()
+        maladie = Maladie.objects.create(nom_maladie="Asthme", type_maladie='chronique', gravite='legere')
+        Diagnostic.objects.create(patient=self.patient, maladie=maladie, medecin=self.medecin)
+        return maladie
+
+    def test_subject_and_link_deltas_are_applied(self):
+        old_nom = self.patient.nom
+        maladie = self.change()
+        removed, _, _ = create_clinical_case()
+        removed_pk = removed.pk
+        apply_pending(self.graph_client)
+        removed.delete()
+        pending = RdfOutbox.objects.count()
+
+        events, resources = apply_pending(self.graph_client)
+        self.assertEqual(events, pending)
+        self.assertFalse(RdfOutbox.objects.exists())
+        patient = f'<{self.HEALTH}Patient_{self.patient.pk}>'
+        self.assertTrue(self.ask(f'{patient} <{self.HEALTH}nom> "Renommé"'))
+        self.assertFalse(self.ask(f'{patient} <{self.HEALTH}nom> "{old_nom}"'))
+        self.assertTrue(self.ask(f'{patient} <{self.HEALTH}diagnostiquePour> <{self.HEALTH}Maladie_{maladie.pk}>'))
+        self.assertTrue(self.ask(f'<{self.HEALTH}Maladie_{maladie.pk}> a ?class'))
+        self.assertFalse(self.ask(f'<{self.HEALTH}Patient_{removed_pk}> ?p ?o'))
+        self.assertTrue(RdfDigest.objects.filter(kind='diagnostiquePour', object_id=self.patient.pk).exists())
+        self.assertFalse(RdfDigest.objects.filter(kind='Patient', object_id=removed_pk).exists())
+
+    def test_rows_are_kept_on_failure(self):
+        self.change()
+        pending = set(RdfOutbox.objects.values_list('id', flat=True))
+        with mock.patch.object(self.graph_client, 'update', side_effect=requests.ConnectionError("Fuseki down")):
+            with self.assertRaises(requests.ConnectionError):
+                apply_pending(self.graph_client)
+        self.assertEqual(set(RdfOutbox.objects.values_list('id', flat=True)), pending)
+        self.assertFalse(self.ask(f'?s <{self.HEALTH}nom> "Renommé"'))
+
+        self.assertEqual(apply_pending(self.graph_client)[0], len(pending))
+        self.assertTrue(self.ask(f'?s <{self.HEALTH}nom> "Renommé"'))
+
+    def test_rows_are_kept_during_a_reload(self):
+        self.change()
+        pending = RdfOutbox.objects.count()
+        self.addCleanup(end_reload)
+        begin_reload('http://example.org/health/graph/next', None)
+        self.assertEqual(apply_pending(self.graph_client), (0, 0))
+        end_reload()
+
+        # A reload starting while the update is sent keeps the rows too
+        update = self.graph_client.update
+
+        def update_then_reload(*args, **kwargs):
+            update(*args, **kwargs)
+            begin_reload('http://example.org/health/graph/next', None)
+
+        with mock.patch.object(self.graph_client, 'update', side_effect=update_then_reload):
+            self.assertEqual(apply_pending(self.graph_client), (0, 0))
+        self.assertEqual(RdfOutbox.objects.count(), pending)
+        self.assertFalse(RdfDigest.objects.exists())
+
+        end_reload()
+        self.assertEqual(apply_pending(self.graph_client)[0], pending)
+        self.assertFalse(RdfOutbox.objects.exists())
+
+
+class BulkLoaderTests(TestCase):
+    """Chunks are retried on 5xx, written to the manifest when they keep failing and replayed from it"""
+
+    GRAPH = 'http://example.org/health/graph/test'
+
+    def setUp(self):
+        self.fuseki = SparqlClient('http://fuseki.test/query', 'http://fuseki.test/update',
+                                   data_endpoint='http://fuseki.test/data')
+        sleep = mock.patch('ontology_app.rdf_loader.time.sleep')
+        sleep.start()
+        self.addCleanup(sleep.stop)
+        self.triples = [(resource('Patient', n), iri('nom'), string(f"Patient {n}")) for n in range(3)]
+
+    def respond(self, *statuses):
+        """Make the session answer the next POSTs with these statuses; returns the mock"""
+        responses = []
+        for status in statuses:
+            response = requests.Response()
+            response.status_code = status
+            response.url = self.fuseki.data_endpoint
+            responses.append(response)
+        post = mock.patch.object(self.fuseki.session, 'post', side_effect=responses)
+        self.addCleanup(post.stop)
+        return post.start()
+
+    def test_unavailable_chunk_is_retried(self):
+        post = self.respond(503, 503, 200)
+        loader = BulkLoader(self.fuseki, chunk_size=10, graph=self.GRAPH, retries=3, backoff=0)
+        stats = loader.load(self.triples, 'Patients')
+        self.assertEqual(post.call_count, 3)
+        self.assertEqual((stats.triples, stats.chunks, stats.retries, stats.failed_chunks), (3, 1, 2, 0))
+        self.assertEqual(loader.failures, [])
+        self.assertEqual(post.call_args.kwargs['params'], {'graph': self.GRAPH})
+
+    def test_failed_chunks_are_written_and_replayed(self):
+        # First chunk: a 400 is not retried; second chunk: 503 on every attempt
+        post = self.respond(400, 503, 503, 503)
+        loader = BulkLoader(self.fuseki, chunk_size=2, graph=self.GRAPH, retries=2, backoff=0)
+        stats = loader.load(self.triples, 'Patients')
+        self.assertEqual(post.call_count, 4)
+        self.assertEqual((stats.triples, stats.retries, stats.failed_chunks, stats.failed_triples), (0, 2, 2, 3))
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'failures.jsonl')
+        self.assertEqual(loader.write_failures(path), 2)
+        with open(path, encoding='utf-8') as manifest:
+            entries = [json.loads(line) for line in manifest]
+        self.assertEqual([(e['label'], e['method'], e['graph'], e['triples']) for e in entries],
+                         [('Patients', 'gsp', self.GRAPH, 2), ('Patients', 'gsp', self.GRAPH, 1)])
+        self.assertIn('400', entries[0]['error'])
+        self.assertIn('503', entries[1]['error'])
+        self.assertEqual([e['data'] for e in entries], [to_ntriples(self.triples[:2]), to_ntriples(self.triples[2:])])
+
+        post = self.respond(200, 200)
+        replayed = BulkLoader(self.fuseki, retries=2, backoff=0).replay(path)
+        self.assertEqual((replayed.triples, replayed.chunks, replayed.failed_chunks), (3, 2, 0))
+        self.assertEqual([call.kwargs['data'].decode('utf-8') for call in post.call_args_list],
+                         [e['data'] for e in entries])
+        self.assertEqual(post.call_args.kwargs['params'], {'graph': self.GRAPH})
+
+
+class DatasetClient:
+    """Fuseki stand-in with named graphs (its default graph reads their union)"""
+
+    def __init__(self):
+        self.dataset = ConjunctiveGraph()
+
+    def query(self, query, name=None, default_graph=None):
+        return result_to_json(self.dataset.query(query))
+
+    def update(self, update, name=None):
+        self.dataset.update(update)
+
+
+@override_settings(SPARQL_BACKEND='fuseki')
+class GraphVersionTests(TestCase):
+    """Reloads switch the pointer to complete versions and drop the ones nobody reads"""
+
+    def setUp(self):
+        caches[settings.SPARQL_CACHE['GENERATION_CACHE']].delete(POINTER_KEY)
+        self.addCleanup(caches[settings.SPARQL_CACHE['GENERATION_CACHE']].delete, POINTER_KEY)
+        end_reload()
+        self.addCleanup(end_reload)
+        self.store = DatasetClient()
+        # Loaded before versioning
+        self.store.update('INSERT DATA { <urn:legacy> <urn:nom> "ancien" }')
+
+    def load(self):
+        graph = new_version_graph(self.store)
+        self.store.update(f'INSERT DATA {{ GRAPH <{graph}> {{ <urn:version> <urn:graph> "{graph}" }} }}')
+        return graph
+
+    def holds_data(self, graph=None):
+        pattern = f'GRAPH <{graph}> {{ ?s ?p ?o }}' if graph else '<urn:legacy> ?p ?o'
+        return self.store.query(f'ASK {{ {pattern} }}')['boolean']
+
+    def test_get_current_graph_without_pointer(self):
+        self.assertIsNone(get_current_graph(self.store))
+        # "No pointer" is cached like a pointer
+        graph = self.load()
+        switch_to(DatasetClient(), graph)
+        caches[settings.SPARQL_CACHE['GENERATION_CACHE']].delete(POINTER_KEY)
+        self.assertIsNone(get_current_graph(self.store))
+        self.assertIsNone(get_current_graph(self.store))
+
+        failing = mock.Mock()
+        failing.query.side_effect = requests.ConnectionError("Fuseki down")
+        caches[settings.SPARQL_CACHE['GENERATION_CACHE']].delete(POINTER_KEY)
+        with self.assertRaises(requests.ConnectionError):
+            get_current_graph(failing)
+        self.assertIsNone(caches[settings.SPARQL_CACHE['GENERATION_CACHE']].get(POINTER_KEY))
+
+    def test_switch_to(self):
+        first = self.load()
+        self.assertIsNone(get_current_graph(self.store))
+        switch_to(self.store, first)
+        self.assertEqual(get_current_graph(self.store), first)
+        self.assertEqual(read_pointer(self.store), first)
+        self.assertEqual(list_versions(self.store, SERVED_GRAPH), [LEGACY_GRAPH, first])
+
+        second = self.load()
+        switch_to(self.store, second)
+        self.assertEqual(read_pointer(self.store), second)
+        self.assertEqual(list_versions(self.store, SERVED_GRAPH), [LEGACY_GRAPH, first, second])
+
+        # A failed switch leaves readers on what the store says
+        with mock.patch.object(self.store, 'update', side_effect=requests.ConnectionError("Fuseki down")):
+            with self.assertRaises(requests.ConnectionError):
+                switch_to(self.store, self.load())
+        self.assertEqual(get_current_graph(self.store), second)
+
+    def test_collect_garbage_keeps_served_and_held_graphs(self):
+        first = self.load()
+        switch_to(self.store, first)
+        self.assertEqual(collect_garbage(self.store, keep=2), [])
+        self.assertTrue(self.holds_data())
+
+        abandoned = self.load()
+        held = self.load()
+        begin_reload(held, None)
+        hold_reload()
+        second = self.load()
+        switch_to(self.store, second)
+        self.assertEqual(collect_garbage(self.store, keep=2), [LEGACY_GRAPH, abandoned])
+        self.assertFalse(self.holds_data())
+        self.assertFalse(self.holds_data(abandoned))
+        for graph in (first, held, second):
+            self.assertTrue(self.holds_data(graph), graph)
+        self.assertEqual(list_versions(self.store), [first, held, second])
+
+        # Once the held reload is given up, only the current graph is left with keep=1
+        end_reload()
+        self.assertEqual(collect_garbage(self.store, keep=1), [first, held])
+        self.assertEqual(list_versions(self.store), [second])
+
+
+class DriftTests(RdflibBackendMixin, TestCase):
+    """check_drift finds drift injected into the rdflib graph and --repair removes it"""
+
+    def setUp(self):
+        self.cases = [create_clinical_case() for _ in range(3)]
+        # A second diagnostic and prescription repeat the links of the first case
+        patient, medecin, maladie = self.cases[0]
+        diagnostic = Diagnostic.objects.create(patient=patient, maladie=maladie, medecin=medecin)
+        Prescription.objects.create(diagnostic=diagnostic, traitement=maladie.traitements.get(),
+                                    posologie="1 comprimé soir", duree_prescription=7)
+        # Typed Medecin twice by medecin_triples
+        _, medecin, _ = self.cases[2]
+        medecin.specialite = 'autre'
+        medecin.save()
+        self.graph_client = self.use_rdflib_graph()
+        # The sync stores the digests of everything the cases created
+        apply_pending(self.graph_client)
+
+    def drift(self):
+        checker = DriftChecker(self.graph_client)
+        report = checker.check()
+        return {kind: {status: names for status, names in result.items() if status != 'resources' and names}
+                for kind, result in report.items() if any(result[s] for s in ('missing', 'extra', 'different'))}, checker
+
+    def test_in_sync(self):
+        drift, checker = self.drift()
+        self.assertEqual(drift, {})
+        # One pass per entity type, nothing to descend into
+        self.assertEqual(checker.queries, 5)
+
+    def test_synced_changes_are_not_drift(self):
+        patient, _, _ = self.cases[0]
+        patient.nom = 'Renommé'
+        patient.save()
+        apply_pending(self.graph_client)
+        self.assertEqual(self.drift()[0], {})
+
+    def test_drift_is_found_and_repaired(self):
+        (patient, _, _), (_, medecin, maladie), _ = self.cases
+        health = 'http://example.org/health#'
+        self.graph_client.update(
+            f'DELETE WHERE {{ <{health}Patient_{patient.pk}> <{health}email> ?o }} ;\n'
+            f'DELETE WHERE {{ <{health}Medecin_{medecin.pk}> <{health}prescrit> ?o }} ;\n'
+            f'DELETE WHERE {{ <{health}Maladie_{maladie.pk}> ?p ?o }} ;\n'
+            f'INSERT DATA {{ <{health}Patient_99999> a <{health}Patient> ; <{health}nom> "Fantôme" }}'
+        )
+        drift, checker = self.drift()
+        self.assertEqual(drift, {
+            'Patient': {'different': [f'Patient_{patient.pk}'], 'extra': ['Patient_99999']},
+            'Medecin': {'different': [f'Medecin_{medecin.pk}']},
+            'Maladie': {'missing': [f'Maladie_{maladie.pk}']},
+        })
+
+        call_command('check_drift', '--repair', stdout=StringIO())
+        apply_pending(self.graph_client)
+        self.assertEqual(self.drift()[0], {})
+        links = self.graph_client.query(
+            f'ASK {{ <{health}Medecin_{medecin.pk}> <{health}prescrit> ?t }}')
+        self.assertTrue(links['boolean'])
+
+
+class DataSnapshotTests(TransactionTestCase):
+    """reset_data empties every table; a restored snapshot gives back the saved rows"""
+
+    def setUp(self):
+        # SQLite cannot ATTACH the snapshot file within the test transaction
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        prefix = mock.patch('ontology_app.data_snapshots._sqlite_prefix',
+                            return_value=os.path.join(directory.name, 'db.'))
+        prefix.start()
+        self.addCleanup(prefix.stop)
+        self.cases = [create_clinical_case() for _ in range(2)]
+
+    def rows(self):
+        return {model._meta.db_table: model.objects.count() for model in data_models() if model not in NOT_SAVED}
+
+    def test_reset_data(self):
+        versions = table_versions([Patient])
+        counts = reset_data()
+        self.assertEqual(set(counts), {model._meta.db_table for model in data_models()})
+        # No estimate outside PostgreSQL, and no COUNT(*) to get one
+        self.assertEqual(set(counts.values()), {None})
+        self.assertEqual(set(self.rows().values()), {0})
+        self.assertEqual(current_stats(), stats_payload(compute_stats()))
+        self.assertNotEqual(table_versions([Patient]), versions)
+        patient, _, _ = create_clinical_case()
+        self.assertEqual(patient.pk, 1)
+
+    def test_save_and_restore(self):
+        saved = self.rows()
+        patients = list(Patient.objects.order_by('pk').values_list('pk', 'nom'))
+        self.assertEqual(save_snapshot('base'), saved)
+        self.assertEqual([(s['name'], s['rows']) for s in list_snapshots()], [('base', sum(saved.values()))])
+        with self.assertRaises(SnapshotError):
+            save_snapshot('base')
+        with self.assertRaises(SnapshotError):
+            save_snapshot('Base')
+
+        self.cases[0][0].delete()
+        create_clinical_case()
+        self.assertEqual(restore_snapshot('base'), saved)
+        self.assertEqual(self.rows(), saved)
+        self.assertEqual(list(Patient.objects.order_by('pk').values_list('pk', 'nom')), patients)
+        self.assertEqual(current_stats(), stats_payload(compute_stats()))
+        # Ids go on after the restored ones
+        patient, _, _ = create_clinical_case()
+        self.assertGreater(patient.pk, patients[-1][0])
+
+        self.assertEqual(save_snapshot('base', replace=True), self.rows())
+        delete_snapshot('base')
+        self.assertEqual(list_snapshots(), [])
+        with self.assertRaises(SnapshotError):
+            restore_snapshot('base')
+
+
+class SyntheticDataTests(TestCase):
+    """A seed always gives the same rows, links and dates"""
+
+    def generate(self, seed):
+        reset_data()
+        SyntheticDataGenerator(patients=60, seed=seed, batch_size=20).generate()
+        return {
+            'rows': {model._meta.db_table: model.objects.count() for model in data_models() if model not in NOT_SAVED},
+            'traitements': list(Traitement.objects.order_by('pk').values_list(
+                'pk', 'maladie_id', 'impact_environnemental_id', 'type_traitement', 'cout')),
+            'diagnostics': list(Diagnostic.objects.order_by('pk').values_list(
+                'pk', 'patient_id', 'maladie_id', 'medecin_id', 'date_diagnostic')),
+            'prescriptions': list(Prescription.objects.order_by('pk').values_list(
+                'pk', 'diagnostic_id', 'traitement_id', 'date_prescription')),
+        }
+
+    def test_seed_is_deterministic(self):
+        first = self.generate(seed=7)
+        self.assertEqual(self.generate(seed=7), first)
+        self.assertNotEqual(self.generate(seed=8)['diagnostics'], first['diagnostics'])
+        self.assertEqual(first['rows']['ontology_app_patient'], 60)
+        self.assertTrue(first['prescriptions'])
+
+    def test_dates_are_spread(self):
+        dataset = self.generate(seed=7)
+        end = timezone.make_aware(datetime.combine(REFERENCE_DATE, datetime.min.time()))
+        diagnosed = {pk: when for pk, _, _, _, when in dataset['diagnostics']}
+        self.assertGreater(len(set(diagnosed.values())), len(diagnosed) // 2)
+        for when in diagnosed.values():
+            self.assertTrue(end - timedelta(days=DIAGNOSTIC_SPAN_DAYS) <= when < end, when)
+        for _, diagnostic_id, _, when in dataset['prescriptions']:
+            self.assertTrue(timedelta(0) <= when - diagnosed[diagnostic_id] < timedelta(days=PRESCRIPTION_DELAY_DAYS))
+
+
+class DashboardCounterTests(TestCase):
+    """The running counters of /api/stats/ always equal a recount of the tables"""
+
+    def setUp(self):
+        self.patient, self.medecin, self.maladie = create_clinical_case()
+        create_clinical_case()
+        reconcile_stats()
+
+    def assertCountersMatch(self):
+        self.assertEqual(current_stats(), stats_payload(compute_stats()))
+
+    def test_create_update_delete(self):
+        patient, _, _ = create_clinical_case()
+        self.assertCountersMatch()
+        patient.nom = 'Renommé'
+        patient.save()
+        self.assertCountersMatch()
+        Prescription.objects.filter(diagnostic__patient=patient).delete()
+        Examen.objects.filter(maladies_diagnostiquees__traitements__isnull=False).first().delete()
+        self.assertCountersMatch()
+
+    def test_cascade_deletes(self):
+        self.patient.delete()
+        self.assertCountersMatch()
+        self.maladie.traitements.get().delete()
+        self.assertCountersMatch()
+        # An impact takes its treatment along
+        ImpactEnvironnemental.objects.first().delete()
+        self.assertCountersMatch()
+
+    def test_treatment_crossing_the_eco_threshold(self):
+        traitement = self.maladie.traitements.get()
+        impact = traitement.impact_environnemental
+        eco = current_stats()['traitements_eco']
+        impact.score_carbone = 12
+        impact.save()
+        self.assertEqual(current_stats()['traitements_eco'], eco - 1)
+        self.assertCountersMatch()
+        impact.score_carbone = 1
+        impact.save()
+        self.assertEqual(current_stats()['traitements_eco'], eco)
+        self.assertCountersMatch()
+        traitement.impact_environnemental = None
+        traitement.save()
+        self.assertEqual(current_stats()['traitements_eco'], eco - 1)
+        self.assertCountersMatch()
+
+    def test_carbon_score_change(self):
+        impact = ImpactEnvironnemental.objects.first()
+        impact.score_carbone = Decimal('3.75')
+        impact.save()
+        self.assertCountersMatch()
+        ImpactEnvironnemental.objects.create(score_carbone=Decimal('7.10'), consommation_eau=1, dechets=0)
+        self.assertCountersMatch()
+        self.assertIsInstance(current_stats()['impact_moyen'], Decimal)
+        # Rendered as a JSON number, as the Avg() it replaces
+        self.assertIsInstance(self.client.get('/api/stats/').json()['impact_moyen'], float)
+
+    def test_m2m_add_remove(self):
+        diagnostic = Diagnostic.objects.filter(patient=self.patient).get()
+        examen = Examen.objects.create(nom_examen="Examen m2m", type_examen='biologique',
+                                       date_examen='2024-02-01', cout_examen=15)
+        diagnostic.examens.add(examen)
+        self.assertCountersMatch()
+        diagnostic.examens.remove(examen)
+        self.maladie.symptomes.clear()
+        self.assertCountersMatch()
+
+    def test_reconcile_fixes_drift(self):
+        # QuerySet.update() sends no signals
+        Patient.objects.filter(pk=self.patient.pk).delete()
+        DashboardCounter.objects.filter(name='traitements').update(value=99)
+        ImpactEnvironnemental.objects.update(score_carbone=6)
+        drift = reconcile_stats()
+        self.assertEqual(set(drift), {'traitements', 'traitements_eco', 'score_carbone_total'})
+        self.assertEqual(drift['traitements'], (Decimal(99), Decimal(2)))
+        self.assertCountersMatch()
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursors walk every row once, in order, both ways, and reject tampering"""
+
+    def setUp(self):
+        for _ in range(3):
+            patient, medecin, maladie = create_clinical_case()
+            for _ in range(2):
+                Diagnostic.objects.create(patient=patient, maladie=maladie, medecin=medecin)
+        # Most rows share one date, as after a bulk import: only the id orders them
+        self.tied = timezone.now().replace(microsecond=0)
+        ids = list(Diagnostic.objects.order_by('id').values_list('id', flat=True))
+        Diagnostic.objects.filter(id__in=ids[:-2]).update(date_diagnostic=self.tied)
+        Diagnostic.objects.filter(id=ids[-1]).update(date_diagnostic=self.tied - timedelta(days=1))
+        Diagnostic.objects.filter(id=ids[-2]).update(date_diagnostic=self.tied + timedelta(days=1))
+        self.expected = list(Diagnostic.objects.order_by('-date_diagnostic', 'id').values_list('id', flat=True))
+
+    def walk(self, url, link='next'):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.json()['results']])
+            url = response.json()[link]
+        return pages
+
+    def test_cursor_round_trip(self):
+        # Diagnostics are read from .values() rows, keyed by pk
+        pages = self.walk('/api/diagnostics/?page_size=2')
+        self.assertEqual(len(pages), 5)
+        self.assertTrue(all(len(page) == 2 for page in pages[:-1]))
+        self.assertEqual([pk for page in pages for pk in page], self.expected)
+        self.assertEqual(self.expected[0], Diagnostic.objects.get(date_diagnostic__gt=self.tied).id)
+
+    def test_previous_links(self):
+        last = self.client.get('/api/diagnostics/?page_size=2')
+        while last.json()['next']:
+            last = self.client.get(last.json()['next'])
+        self.assertIsNotNone(last.json()['previous'])
+        pages = self.walk(last.json()['previous'], link='previous')
+        forward = self.walk('/api/diagnostics/?page_size=2')
+        self.assertEqual(pages, forward[-2::-1])
+        self.assertIsNone(self.client.get('/api/diagnostics/?page_size=2').json()['previous'])
+
+    def test_model_instances(self):
+        pages = self.walk('/api/patients/?page_size=2')
+        self.assertEqual([pk for page in pages for pk in page],
+                         list(Patient.objects.order_by('id').values_list('id', flat=True)))
+
+    def cursor(self, position):
+        return base64.b64encode(urlencode({'o': 0, 'r': 0, 'p': position}).encode('ascii')).decode('ascii')
+
+    def test_invalid_cursors(self):
+        for cursor in ['not-a-cursor', self.cursor('not json'), self.cursor('[1]'),
+                       self.cursor('["2024-13-45", 1]'), self.cursor(f'["{self.tied.isoformat()}", "x"]')]:
+            response = self.client.get('/api/diagnostics/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
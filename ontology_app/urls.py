@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'etablissements', views.EtablissementViewSet)
@@ -20,7 +20,21 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/stats/', views.dashboard_stats, name='dashboard-stats'),
     path('api/ontology/query/', views.ontology_query, name='ontology-query'),
+    path('api/hybrid/query/', views.hybrid_query, name='hybrid-query'),
+    path('api/hybrid/stats/', views.hybrid_stats, name='hybrid-stats'),
+    path('api/ontology/stream/', views.ontology_query_stream, name='ontology-query-stream'),
+    path('api/ontology/pool-stats/', views.sparql_pool_stats, name='sparql-pool-stats'),
+    path('api/ontology/cache-stats/', views.sparql_cache_stats, name='sparql-cache-stats'),
+    path('api/ontology/metrics/', views.sparql_metrics, name='sparql-metrics'),
     path('api/semantic/alternatives/', views.semantic_alternatives, name='semantic-alternatives'),
     path('api/semantic/recommendation/', views.semantic_recommendation, name='semantic-recommendation'),
     path('api/semantic/eco-doctors/', views.semantic_eco_doctors, name='semantic-eco-doctors'),
+    path('api/semantic/batch/traitements/', views.semantic_batch_traitements, name='semantic-batch-traitements'),
+    path('api/semantic/batch/comparison/', views.semantic_batch_comparison, name='semantic-batch-comparison'),
+    path('api/semantic/batch/recommendation/', views.semantic_batch_recommendation, name='semantic-batch-recommendation'),
+    path('api/async/ontology/query/', async_views.ontology_query, name='async-ontology-query'),
+    path('api/async/ontology/client-stats/', async_views.async_client_stats, name='async-client-stats'),
+    path('api/async/semantic/alternatives/', async_views.semantic_alternatives, name='async-semantic-alternatives'),
+    path('api/async/semantic/recommendation/', async_views.semantic_recommendation, name='async-semantic-recommendation'),
+    path('api/async/semantic/eco-doctors/', async_views.semantic_eco_doctors, name='async-semantic-eco-doctors'),
 ]
\ No newline at end of file
@@ -1,8 +1,10 @@
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from django.shortcuts import render
+from django.http import StreamingHttpResponse
 from django.db.models import Count, Avg
 from .models import (
     Etablissement, Patient, Medecin, Maladie, Symptome,
@@ -15,17 +17,58 @@ from .serializers import (
     MedicamentSerializer, TraitementSerializer, ExamenSerializer,
     DiagnosticSerializer, PrescriptionSerializer
 )
-from .sparql_queries import OntologyQuery
+from .conditional_get import SPARQL, ConditionalGetMixin, conditional_get, serializer_models
+from .dashboard_stats import COUNTED_MODELS, current_stats
+from .fast_serializers import values_serializer_for
+from .sparql_queries import OntologyQuery, StreamingOntologyQuery, alternatives_params
+from .sparql_stream import RESULT_FORMATS, iter_sparql_json
+from .sparql_columns import shape_results
+from .query_router import get_router
+from .sparql_client import get_client
+from .sparql_cache import get_cache
+from .sparql_metrics import get_metrics
 
 def index(request):
     """Render main application page"""
     return render(request, 'index.html')
 
-class EtablissementViewSet(viewsets.ModelViewSet):
-    queryset = Etablissement.objects.all()
+def _sparql_response(request, results):
+    """SPARQL results as-is, or as flat typed columns with ?shape=columns"""
+    return Response(shape_results(results, request.query_params.get('shape')))
+
+def _list_response(view, queryset, serializer_class=None):
+    """One keyset page of `queryset` for a custom list action, like ListModelMixin.list"""
+    serializer_class = serializer_class or view.get_serializer_class()
+    fast = values_serializer_for(serializer_class)
+    if fast is not None:
+        page = view.paginate_queryset(fast.rows(queryset))
+        if page is None:
+            return Response(fast.serialize(fast.rows(queryset)))
+        return view.get_paginated_response(fast.serialize(page))
+    context = view.get_serializer_context()
+    page = view.paginate_queryset(queryset)
+    if page is None:
+        return Response(serializer_class(queryset, many=True, context=context).data)
+    return view.get_paginated_response(serializer_class(page, many=True, context=context).data)
+
+class ValuesReadMixin:
+    """list and retrieve from .values() rows (see fast_serializers); writes stay on the DRF serializer"""
+
+    def list(self, request, *args, **kwargs):
+        return _list_response(self, self.filter_queryset(self.get_queryset()))
+
+    def retrieve(self, request, *args, **kwargs):
+        fast = values_serializer_for(self.get_serializer_class())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(fast.rows(self.filter_queryset(self.get_queryset())),
+                                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(fast.serialize([row])[0])
+
+class EtablissementViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = EtablissementSerializer.setup_eager_loading(Etablissement.objects.all())
     serializer_class = EtablissementSerializer
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], version_sources=(Etablissement, Patient, Medecin))
     def stats(self, request, pk=None):
         etablissement = self.get_object()
         return Response({
@@ -34,38 +77,36 @@ class EtablissementViewSet(viewsets.ModelViewSet):
             'capacite': etablissement.capacite,
         })
 
-class PatientViewSet(viewsets.ModelViewSet):
-    queryset = Patient.objects.all()
+class PatientViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = PatientSerializer.setup_eager_loading(Patient.objects.all())
     serializer_class = PatientSerializer
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], version_sources=(Patient, *serializer_models(DiagnosticSerializer)))
     def diagnostics(self, request, pk=None):
         patient = self.get_object()
-        diagnostics = patient.diagnostics.all()
-        serializer = DiagnosticSerializer(diagnostics, many=True)
-        return Response(serializer.data)
+        diagnostics = DiagnosticSerializer.setup_eager_loading(patient.diagnostics.all())
+        return _list_response(self, diagnostics, DiagnosticSerializer)
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], version_sources=(Patient, SPARQL))
     def profile_ontology(self, request, pk=None):
         patient = self.get_object()
         ontology = OntologyQuery()
         profile = ontology.get_patient_full_profile(patient.email)
-        return Response(profile)
+        return _sparql_response(request, profile)
 
-class MedecinViewSet(viewsets.ModelViewSet):
-    queryset = Medecin.objects.all()
+class MedecinViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = MedecinSerializer.setup_eager_loading(Medecin.objects.all())
     serializer_class = MedecinSerializer
     
     @action(detail=False, methods=['get'])
     def by_specialite(self, request):
         specialite = request.query_params.get('specialite')
         if specialite:
-            medecins = Medecin.objects.filter(specialite=specialite)
-            serializer = self.get_serializer(medecins, many=True)
-            return Response(serializer.data)
+            medecins = self.get_queryset().filter(specialite=specialite)
+            return _list_response(self, medecins)
         return Response({"error": "specialite parameter required"}, status=400)
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], version_sources=(Medecin, Diagnostic))
     def stats(self, request, pk=None):
         medecin = self.get_object()
         return Response({
@@ -74,75 +115,78 @@ class MedecinViewSet(viewsets.ModelViewSet):
             'annees_experience': medecin.annees_experience,
         })
 
-class MaladieViewSet(viewsets.ModelViewSet):
-    queryset = Maladie.objects.all()
+class MaladieViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = MaladieSerializer.setup_eager_loading(Maladie.objects.all())
     serializer_class = MaladieSerializer
-    
-    @action(detail=True, methods=['get'])
+
+    def get_queryset(self):
+        # These actions only need the disease itself, not its symptoms
+        if self.action in ('traitements', 'traitements_eco', 'compare_traitements'):
+            return Maladie.objects.all()
+        return super().get_queryset()
+
+    @action(detail=True, methods=['get'], version_sources=(Maladie, *serializer_models(TraitementSerializer)))
     def traitements(self, request, pk=None):
         maladie = self.get_object()
-        traitements = maladie.traitements.all()
-        serializer = TraitementSerializer(traitements, many=True)
-        return Response(serializer.data)
+        traitements = TraitementSerializer.setup_eager_loading(maladie.traitements.all())
+        return _list_response(self, traitements, TraitementSerializer)
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], version_sources=(Maladie, SPARQL))
     def traitements_eco(self, request, pk=None):
         maladie = self.get_object()
         ontology = OntologyQuery()
         traitements = ontology.get_traitements_for_maladie(maladie.nom_maladie)
-        return Response(traitements)
+        return _sparql_response(request, traitements)
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], version_sources=(Maladie, SPARQL))
     def compare_traitements(self, request, pk=None):
         maladie = self.get_object()
         ontology = OntologyQuery()
         comparison = ontology.compare_traitements_impact(maladie.nom_maladie)
-        return Response(comparison)
+        return _sparql_response(request, comparison)
 
-class SymptomeViewSet(viewsets.ModelViewSet):
-    queryset = Symptome.objects.all()
+class SymptomeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = SymptomeSerializer.setup_eager_loading(Symptome.objects.all())
     serializer_class = SymptomeSerializer
 
-class TraitementViewSet(viewsets.ModelViewSet):
-    queryset = Traitement.objects.all()
+class TraitementViewSet(ConditionalGetMixin, ValuesReadMixin, viewsets.ModelViewSet):
+    queryset = TraitementSerializer.setup_eager_loading(Traitement.objects.all())
     serializer_class = TraitementSerializer
     
     @action(detail=False, methods=['get'])
     def eco_responsables(self, request):
         """PostgreSQL query for eco-friendly treatments"""
         score_max = float(request.query_params.get('score_max', 5.0))
-        traitements = Traitement.objects.filter(
+        traitements = self.get_queryset().filter(
             impact_environnemental__score_carbone__lte=score_max
-        ).select_related('impact_environnemental', 'maladie')
-        serializer = self.get_serializer(traitements, many=True)
-        return Response(serializer.data)
+        )
+        return _list_response(self, traitements)
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], version_sources=(SPARQL,))
     def eco_ontology(self, request):
         """SPARQL query for eco-friendly treatments"""
         score_max = float(request.query_params.get('score_max', 5.0))
         ontology = OntologyQuery()
         traitements = ontology.get_traitements_eco_responsables(score_max)
-        return Response(traitements)
+        return _sparql_response(request, traitements)
     
     @action(detail=False, methods=['get'])
     def by_type(self, request):
         type_traitement = request.query_params.get('type')
         if type_traitement:
-            traitements = Traitement.objects.filter(type_traitement=type_traitement)
-            serializer = self.get_serializer(traitements, many=True)
-            return Response(serializer.data)
+            traitements = self.get_queryset().filter(type_traitement=type_traitement)
+            return _list_response(self, traitements)
         return Response({"error": "type parameter required"}, status=400)
 
-class MedicamentViewSet(viewsets.ModelViewSet):
-    queryset = Medicament.objects.all()
+class MedicamentViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = MedicamentSerializer.setup_eager_loading(Medicament.objects.all())
     serializer_class = MedicamentSerializer
 
-class ImpactEnvironnementalViewSet(viewsets.ModelViewSet):
-    queryset = ImpactEnvironnemental.objects.all()
+class ImpactEnvironnementalViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = ImpactEnvironnementalSerializer.setup_eager_loading(ImpactEnvironnemental.objects.all())
     serializer_class = ImpactEnvironnementalSerializer
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], version_sources=(ImpactEnvironnemental,))
     def statistiques(self, request):
         stats = ImpactEnvironnemental.objects.aggregate(
             score_moyen=Avg('score_carbone'),
@@ -153,96 +197,163 @@ class ImpactEnvironnementalViewSet(viewsets.ModelViewSet):
         stats['nombre_total'] = ImpactEnvironnemental.objects.count()
         return Response(stats)
 
-class ExamenViewSet(viewsets.ModelViewSet):
-    queryset = Examen.objects.all()
+class ExamenViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = ExamenSerializer.setup_eager_loading(Examen.objects.all())
     serializer_class = ExamenSerializer
 
-class DiagnosticViewSet(viewsets.ModelViewSet):
-    queryset = Diagnostic.objects.all()
+class DiagnosticViewSet(ConditionalGetMixin, ValuesReadMixin, viewsets.ModelViewSet):
+    queryset = DiagnosticSerializer.setup_eager_loading(Diagnostic.objects.all())
     serializer_class = DiagnosticSerializer
     
     @action(detail=False, methods=['get'])
     def by_patient(self, request):
         patient_id = request.query_params.get('patient_id')
         if patient_id:
-            diagnostics = Diagnostic.objects.filter(patient_id=patient_id)
-            serializer = self.get_serializer(diagnostics, many=True)
-            return Response(serializer.data)
+            diagnostics = self.get_queryset().filter(patient_id=patient_id)
+            return _list_response(self, diagnostics)
         return Response({"error": "patient_id required"}, status=400)
     
     @action(detail=False, methods=['get'])
     def by_medecin(self, request):
         medecin_id = request.query_params.get('medecin_id')
         if medecin_id:
-            diagnostics = Diagnostic.objects.filter(medecin_id=medecin_id)
-            serializer = self.get_serializer(diagnostics, many=True)
-            return Response(serializer.data)
+            diagnostics = self.get_queryset().filter(medecin_id=medecin_id)
+            return _list_response(self, diagnostics)
         return Response({"error": "medecin_id required"}, status=400)
 
-class PrescriptionViewSet(viewsets.ModelViewSet):
-    queryset = Prescription.objects.all()
+class PrescriptionViewSet(ConditionalGetMixin, ValuesReadMixin, viewsets.ModelViewSet):
+    queryset = PrescriptionSerializer.setup_eager_loading(Prescription.objects.all())
     serializer_class = PrescriptionSerializer
     
     @action(detail=False, methods=['get'])
     def eco_alternatives(self, request):
         """Find eco-friendly prescription alternatives"""
-        prescriptions = Prescription.objects.filter(
+        prescriptions = self.get_queryset().filter(
             traitement__impact_environnemental__score_carbone__lte=5
-        ).select_related('traitement', 'diagnostic', 'traitement__impact_environnemental')
-        serializer = self.get_serializer(prescriptions, many=True)
-        return Response(serializer.data)
+        )
+        return _list_response(self, prescriptions)
 
+@conditional_get(*COUNTED_MODELS.values())
 @api_view(['GET'])
 def dashboard_stats(request):
-    """Get overall dashboard statistics"""
-    stats = {
-        'patients': Patient.objects.count(),
-        'medecins': Medecin.objects.count(),
-        'maladies': Maladie.objects.count(),
-        'traitements': Traitement.objects.count(),
-        'diagnostics': Diagnostic.objects.count(),
-        'prescriptions': Prescription.objects.count(),
-        'etablissements': Etablissement.objects.count(),
-        'examens': Examen.objects.count(),
-        'traitements_eco': Traitement.objects.filter(
-            impact_environnemental__score_carbone__lte=5
-        ).count(),
-        'impact_moyen': ImpactEnvironnemental.objects.aggregate(
-            Avg('score_carbone')
-        )['score_carbone__avg'] or 0,
-    }
-    return Response(stats)
+    """Get overall dashboard statistics, read from the running counters (see dashboard_stats)"""
+    return Response(current_stats())
 
-@api_view(['GET'])
-def ontology_query(request):
-    """Execute custom SPARQL queries"""
+def _run_ontology_query(ontology, request):
+    """Dispatch ?type= to an OntologyQuery method, None for an unknown type"""
     query_type = request.query_params.get('type', 'patients')
-    ontology = OntologyQuery()
     
     if query_type == 'patients':
-        results = ontology.get_all_patients()
+        return ontology.get_all_patients()
     elif query_type == 'eco_traitements':
         score_max = float(request.query_params.get('score_max', 5.0))
-        results = ontology.get_traitements_eco_responsables(score_max)
+        return ontology.get_traitements_eco_responsables(score_max)
     elif query_type == 'medecins_specialite':
         specialite = request.query_params.get('specialite', 'Generaliste')
-        results = ontology.get_medecins_by_specialite(specialite)
-    else:
+        return ontology.get_medecins_by_specialite(specialite)
+    return None
+
+@conditional_get(SPARQL)
+@api_view(['GET'])
+def ontology_query(request):
+    """Execute custom SPARQL queries"""
+    results = _run_ontology_query(OntologyQuery(), request)
+    if results is None:
         return Response({"error": "Invalid query type"}, status=400)
+    return _sparql_response(request, results)
+
+# Query types answered by a plain SELECT, whose rows can be streamed unchanged
+STREAMABLE_QUERY_TYPES = ('patients', 'eco_traitements', 'medecins_specialite')
+
+@api_view(['GET'])
+def ontology_query_stream(request):
+    """
+    Same queries as ontology_query, streamed row by row from Fuseki to the
+    client. ?result_format=tsv asks Fuseki for TSV instead of JSON.
+    """
+    result_format = request.query_params.get('result_format', 'json')
+    if result_format not in RESULT_FORMATS:
+        return Response({"error": "result_format must be json or tsv"}, status=400)
+    if request.query_params.get('type', 'patients') not in STREAMABLE_QUERY_TYPES:
+        return Response({"error": f"type must be one of {list(STREAMABLE_QUERY_TYPES)}"}, status=400)
+    try:
+        stream = _run_ontology_query(StreamingOntologyQuery(result_format), request)
+    except Exception as e:
+        return Response({"error": f"SPARQL endpoint unavailable: {e}"}, status=502)
+    return StreamingHttpResponse(iter_sparql_json(stream), content_type='application/json')
+
+@api_view(['GET'])
+def hybrid_query(request):
+    """
+    Run a logical query on whichever of PostgreSQL / Fuseki is currently
+    cheaper and healthy. ?source=postgresql|sparql forces a backend.
+    """
+    router = get_router()
+    name = request.query_params.get('name', 'eco_traitements')
+    if name not in router.queries:
+        return Response({"error": f"name must be one of {router.queries}"}, status=400)
     
-    return Response(results)
+    if name == 'eco_traitements':
+        params = {'score_max': float(request.query_params.get('score_max', 5.0))}
+    elif name == 'traitements_maladie':
+        params = {'maladie_nom': request.query_params.get('maladie', 'Hypertension Artérielle')}
+    else:
+        params = {'specialite': request.query_params.get('specialite', 'generaliste')}
+    
+    try:
+        source, rows = router.execute(name, source=request.query_params.get('source'), **params)
+    except Exception as e:
+        return Response({"error": f"No backend available: {e}"}, status=503)
+    return Response({'source': source, 'count': len(rows), 'results': rows})
+
+@api_view(['GET'])
+def hybrid_stats(request):
+    """Observed latency, error rate and circuit state per backend"""
+    return Response(get_router().stats())
+
+@api_view(['GET'])
+def sparql_pool_stats(request):
+    """Connection pool usage of the shared SPARQL client"""
+    return Response(get_client().stats())
+
+@api_view(['GET'])
+def sparql_cache_stats(request):
+    """Hit/miss/eviction counters of the SPARQL result cache"""
+    return Response(get_cache().stats())
+
+@api_view(['GET', 'DELETE'])
+def sparql_metrics(request):
+    """
+    Latency percentiles, rows and bytes per OntologyQuery method, plus recent slow queries.
+    DELETE clears them and returns what was recorded until then.
+    """
+    metrics = get_metrics()
+    snapshot = metrics.snapshot()
+    if request.method == 'DELETE':
+        metrics.reset()
+    return Response(snapshot)
 
+@conditional_get(SPARQL)
 @api_view(['GET'])
 def semantic_alternatives(request):
     """
     SEMANTIC SEARCH: Find treatment alternatives using graph pattern matching.
     Compares all treatments for same disease automatically.
+    ?mode=linear computes the pairs in-process (supports ?top_k= and ?min_diff=).
     """
     maladie_nom = request.query_params.get('maladie', 'Hypertension Artérielle')
     ontology = OntologyQuery()
-    alternatives = ontology.get_treatment_alternatives_by_disease(maladie_nom)
-    return Response(alternatives)
+    if request.query_params.get('mode') == 'linear':
+        try:
+            top_k, min_diff = alternatives_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        alternatives = ontology.get_treatment_alternatives_linear(maladie_nom, top_k=top_k, min_diff=min_diff)
+    else:
+        alternatives = ontology.get_treatment_alternatives_by_disease(maladie_nom)
+    return _sparql_response(request, alternatives)
 
+@conditional_get(SPARQL)
 @api_view(['GET'])
 def semantic_recommendation(request):
     """
@@ -253,8 +364,38 @@ def semantic_recommendation(request):
     max_score = float(request.query_params.get('max_score', 10))
     ontology = OntologyQuery()
     recommendations = ontology.get_best_treatment_recommendation(maladie_nom, max_score)
-    return Response(recommendations)
+    return _sparql_response(request, recommendations)
+
+def _requested_maladies(request):
+    """Disease names from repeated ?maladie= parameters, defaulting to every disease"""
+    maladie_noms = request.query_params.getlist('maladie')
+    if not maladie_noms:
+        maladie_noms = list(Maladie.objects.values_list('nom_maladie', flat=True))
+    return maladie_noms
+
+@conditional_get(SPARQL, Maladie)
+@api_view(['GET'])
+def semantic_batch_traitements(request):
+    """Treatments of several diseases in a single SPARQL query, grouped by disease"""
+    ontology = OntologyQuery()
+    return _sparql_response(request, ontology.get_traitements_for_maladies(_requested_maladies(request)))
+
+@conditional_get(SPARQL, Maladie)
+@api_view(['GET'])
+def semantic_batch_comparison(request):
+    """Eco-efficiency comparison of several diseases in a single SPARQL query"""
+    ontology = OntologyQuery()
+    return _sparql_response(request, ontology.compare_traitements_impact_batch(_requested_maladies(request)))
+
+@conditional_get(SPARQL, Maladie)
+@api_view(['GET'])
+def semantic_batch_recommendation(request):
+    """Top recommendations of several diseases in a single SPARQL query"""
+    max_score = float(request.query_params.get('max_score', 10))
+    ontology = OntologyQuery()
+    return _sparql_response(request, ontology.get_best_treatment_recommendations(_requested_maladies(request), max_score))
 
+@conditional_get(SPARQL)
 @api_view(['GET'])
 def semantic_eco_doctors(request):
     """
@@ -265,4 +406,4 @@ def semantic_eco_doctors(request):
     max_impact = float(request.query_params.get('max_impact', 5))
     ontology = OntologyQuery()
     doctors = ontology.get_eco_conscious_doctors(min_experience, max_impact)
-    return Response(doctors)
\ No newline at end of file
+    return _sparql_response(request, doctors)
\ No newline at end of file
@@ -9,19 +9,11 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'health_environment.settings')
 django.setup()
 
 from ontology_app.models import *
+from ontology_app.data_snapshots import reset_data
 
 print("🗑️  Nettoyage de la base de données...")
-Prescription.objects.all().delete()
-Diagnostic.objects.all().delete()
-Traitement.objects.all().delete()
-Examen.objects.all().delete()
-ImpactEnvironnemental.objects.all().delete()
-Medicament.objects.all().delete()
-Symptome.objects.all().delete()
-Maladie.objects.all().delete()
-Medecin.objects.all().delete()
-Patient.objects.all().delete()
-Etablissement.objects.all().delete()
+# TRUNCATE de toutes les tables de l'application (voir manage.py reset_data)
+reset_data()
 
 print("🏥 Création des établissements...")
 etablissements = [
@@ -1,3 +1,5 @@
+import argparse
+import json
 import os
 import django
 import requests
@@ -5,23 +7,50 @@ import requests
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'health_environment.settings')
 django.setup()
 
+from django.conf import settings
 from ontology_app.models import *
+from ontology_app.sparql_client import get_client
+from ontology_app.rdf_mapping import (
+    NAMESPACE, MALADIE_CLASSES, to_ntriples,
+    patient_triples, medecin_triples, maladie_triples, impact_triples,
+    traitement_triples, diagnostic_triples, prescription_triples,
+)
+from ontology_app.rdf_drift import rebuild_digests
+from ontology_app.rdf_loader import BulkLoader, DEFAULT_CHUNK_SIZE, FORMATS, METHODS
+from ontology_app.rdf_mapping import ontology_triples
+from ontology_app.graph_versions import (
+    begin_reload, end_reload, hold_reload, reload_state,
+    collect_garbage, get_current_graph, new_version_graph, switch_to,
+)
 
-# Fuseki configuration
-FUSEKI_UPDATE = 'http://localhost:3030/health_env/update'
-NAMESPACE = 'http://example.org/health#'
-
-def escape_sparql_string(s):
-    """Escape special characters for SPARQL"""
-    if s is None:
-        return ""
-    s = str(s)
-    # Escape backslashes first, then quotes
-    s = s.replace('\\', '\\\\')
-    s = s.replace('"', '\\"')
-    s = s.replace('\n', '\\n')
-    s = s.replace('\r', '\\r')
-    return s
+parser = argparse.ArgumentParser(description="Charge les données Django dans Fuseki")
+parser.add_argument('--mode', choices=['bulk', 'per-entity'], default='bulk',
+                    help="bulk: gros lots de triplets (défaut), per-entity: une requête par entité")
+parser.add_argument('--method', choices=METHODS, default='gsp',
+                    help="gsp: Graph Store protocol (FUSEKI_DATA_ENDPOINT), update: INSERT DATA")
+parser.add_argument('--format', dest='rdf_format', choices=list(FORMATS), default='nt',
+                    help="Format des lots envoyés par le Graph Store protocol")
+parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                    help="Nombre de triplets par requête en mode bulk")
+parser.add_argument('--workers', type=int, default=settings.FUSEKI_POOL_SIZE,
+                    help="Requêtes envoyées en parallèle en mode bulk (défaut: FUSEKI_POOL_SIZE)")
+parser.add_argument('--retries', type=int, default=3,
+                    help="Nouvelles tentatives par lot, avec attente exponentielle")
+parser.add_argument('--failures', default='fuseki_failures.jsonl',
+                    help="Manifeste des lots en échec, rejouable avec --replay")
+parser.add_argument('--replay', metavar='MANIFEST',
+                    help="Renvoie les lots d'un manifeste d'échecs puis bascule sur leur graphe")
+parser.add_argument('--keep-versions', type=int, default=settings.SPARQL_GRAPH_VERSIONS['KEEP'],
+                    help="Versions du graphe conservées après la bascule")
+args = parser.parse_args()
+
+# Fuseki configuration (endpoints, pool size and timeouts come from settings)
+client = get_client()
+
+# Named graph being built; readers keep using the current one until the switch
+target_graph = None
+# Set once a failure manifest is written: the reload stays held for --replay
+held = False
 
 def create_rdf_insert(triples):
     """Create SPARQL INSERT query"""
@@ -30,188 +59,230 @@ def create_rdf_insert(triples):
     PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
     PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
     
-    INSERT DATA {{
+    INSERT DATA {{ GRAPH <{target_graph}> {{
         {triples}
-    }}
+    }} }}
     """
     return query
 
 def send_sparql_update(query):
     """Send update to Fuseki"""
     try:
-        response = requests.post(
-            FUSEKI_UPDATE,
-            data={'update': query},
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=30
-        )
-        # Accept both 200 and 204 status codes
-        if response.status_code in [200, 204]:
-            return True
-        else:
-            print(f"    ⚠️  Status {response.status_code}: {response.text[:200]}")
-            return False
+        client.update(query)
+        return True
+    except requests.HTTPError as e:
+        print(f"    ⚠️  Status {e.response.status_code}: {e.response.text[:200]}")
+        return False
     except Exception as e:
         print(f"    ❌ Erreur: {e}")
         return False
 
+def populate_per_entity():
+    """One INSERT DATA request per entity, with a line per entity; returns the failure count"""
+    failures = 0
+    # Populate Patients
+    print("\n📤 Population des Patients...")
+    for patient in Patient.objects.all():
+        if send_sparql_update(create_rdf_insert(to_ntriples(patient_triples(patient)))):
+            print(f"    ✅ {patient.prenom} {patient.nom}")
+        else:
+            print(f"    ❌ Échec: {patient.prenom} {patient.nom}")
+            failures += 1
+
+    # Populate Médecins
+    print("\n📤 Population des Médecins...")
+    for medecin in Medecin.objects.all():
+        if send_sparql_update(create_rdf_insert(to_ntriples(medecin_triples(medecin)))):
+            print(f"    ✅ Dr. {medecin.prenom} {medecin.nom} ({medecin.specialite}, {medecin.annees_experience} ans)")
+        else:
+            print(f"    ❌ Échec: Dr. {medecin.prenom} {medecin.nom}")
+            failures += 1
+
+    # Populate Maladies
+    print("\n📤 Population des Maladies...")
+    for maladie in Maladie.objects.all():
+        type_class = MALADIE_CLASSES.get(maladie.type_maladie, 'Maladie')
+        if send_sparql_update(create_rdf_insert(to_ntriples(maladie_triples(maladie)))):
+            print(f"    ✅ {maladie.nom_maladie} ({type_class})")
+        else:
+            print(f"    ❌ Échec: {maladie.nom_maladie}")
+            failures += 1
+
+    # Populate Impacts Environnementaux
+    print("\n📤 Population des Impacts Environnementaux...")
+    for impact in ImpactEnvironnemental.objects.all():
+        if send_sparql_update(create_rdf_insert(to_ntriples(impact_triples(impact)))):
+            print(f"    ✅ Impact {impact.id} (score: {impact.score_carbone} kg CO2)")
+        else:
+            print(f"    ❌ Échec: Impact {impact.id}")
+            failures += 1
+
+    # Populate Traitements avec liens vers impacts et maladies
+    print("\n📤 Population des Traitements...")
+    for traitement in Traitement.objects.select_related('impact_environnemental'):
+        if send_sparql_update(create_rdf_insert(to_ntriples(traitement_triples(traitement)))):
+            impact_info = f"impact: {traitement.impact_environnemental.score_carbone} kg" if traitement.impact_environnemental else "pas d'impact"
+            print(f"    ✅ {traitement.nom_traitement} ({impact_info})")
+        else:
+            print(f"    ❌ Échec: {traitement.nom_traitement}")
+            failures += 1
+
+    # Populate Diagnostics (relationships)
+    print("\n📤 Population des Relations Diagnostics...")
+    for diagnostic in Diagnostic.objects.select_related('patient', 'maladie'):
+        if send_sparql_update(create_rdf_insert(to_ntriples(diagnostic_triples(diagnostic)))):
+            print(f"    ✅ {diagnostic.patient.prenom} {diagnostic.patient.nom} → {diagnostic.maladie.nom_maladie}")
+        else:
+            print(f"    ❌ Échec: Diagnostic {diagnostic.id}")
+            failures += 1
+
+    # Populate Prescriptions (medecin prescrit traitement)
+    print("\n📤 Population des Relations Prescriptions...")
+    for prescription in Prescription.objects.select_related('diagnostic__medecin', 'traitement'):
+        medecin = prescription.diagnostic.medecin
+        traitement = prescription.traitement
+        if send_sparql_update(create_rdf_insert(to_ntriples(prescription_triples(prescription)))):
+            print(f"    ✅ Dr. {medecin.nom} prescrit {traitement.nom_traitement}")
+        else:
+            print(f"    ❌ Échec: Prescription {prescription.id}")
+            failures += 1
+    return failures
+
+def print_progress(label, stats):
+    failed = f", {stats.failed_chunks} en échec" if stats.failed_chunks else ""
+    print(f"    ⏳ {label}: {stats.triples} triplets, {stats.chunks} lots{failed} "
+          f"({stats.triples_per_second:,.0f} triplets/s)", end='\r', flush=True)
+
+def make_loader():
+    return BulkLoader(client, chunk_size=args.chunk_size, method=args.method,
+                      rdf_format=args.rdf_format, graph=target_graph, progress=print_progress,
+                      concurrency=args.workers, retries=args.retries)
+
+def report_failures(loader):
+    """
+    Write the failure manifest; a load with holes must not look successful.
+    The reload stays held so sync_fuseki keeps the outbox for the new graph.
+    """
+    global held
+    if not loader.failures:
+        return
+    count = loader.write_failures(args.failures)
+    hold_reload()
+    held = True
+    print(f"\n    ❌ {count} lots en échec écrits dans {args.failures}")
+    print(f"       Synchronisation incrémentale suspendue jusqu'au renvoi:")
+    print(f"       python populate_fuseki.py --replay {args.failures}")
+    raise SystemExit(1)
+
+def populate_bulk():
+    """Whole dataset in chunks of --chunk-size triples, --workers requests at a time"""
+    loader = make_loader()
+    print(f"\n📦 Chargement en masse ({args.method}, {args.rdf_format}, {args.chunk_size} triplets par lot, "
+          f"{args.workers} en parallèle)...")
+    report = loader.load_dataset()
+    for label, stats in report.items():
+        if label != 'total':
+            status = '✅' if not stats['failed_chunks'] else '❌'
+            print(f"    {status} {label}: {stats['triples']} triplets en {stats['seconds']}s" + " " * 20)
+    total = report['total']
+    print(f"\n    📊 {total['triples']} triplets, {total['chunks']} requêtes, {total['retries']} nouvelles tentatives, "
+          f"{total['seconds']}s ({total['triples_per_second']:,.0f} triplets/s)")
+    report_failures(loader)
+
+def populate_ontology():
+    """Each version holds the ontology too, since queries only read that graph"""
+    loader = make_loader()
+    stats = loader.load(ontology_triples(settings.RDFLIB_ONTOLOGY_PATH), 'Ontologie')
+    print(f"\n    ✅ Ontologie: {stats.triples} triplets" + " " * 40)
+    report_failures(loader)
+
+def switch_version():
+    switch_to(client, target_graph)
+    print(f"\n🔀 Graphe courant: {target_graph}")
+    dropped = collect_garbage(client, args.keep_versions)
+    if dropped:
+        print(f"    🗑️  {len(dropped)} ancienne(s) version(s) supprimée(s)")
+
+def finish_reload(last_outbox_id):
+    """Switch to the complete graph, drop the outbox rows it covers and resume the sync"""
+    switch_version()
+    if last_outbox_id is not None:
+        RdfOutbox.objects.filter(id__lte=last_outbox_id).delete()
+    # check_drift compares the store with the digests of what it now holds
+    rebuild_digests()
+    end_reload()
+
+def manifest_graph(path):
+    """Version graph the chunks of a failure manifest belong to"""
+    with open(path, encoding='utf-8') as manifest:
+        for line in manifest:
+            if line.strip():
+                return json.loads(line).get('graph')
+    return None
+
+def replay_failures():
+    """Complete a held reload: failed chunks, then the ontology, then the switch"""
+    global target_graph
+    target_graph = manifest_graph(args.replay)
+    state = reload_state()
+    if target_graph is None or state is None or state['graph'] != target_graph:
+        # Without the held state sync_fuseki may have applied changes to the
+        # old graph only: switching would lose them
+        print(f"\n❌ Aucun rechargement suspendu pour {target_graph}: relancez un rechargement complet")
+        raise SystemExit(1)
+
+    begin_reload(target_graph, state['last_outbox_id'])
+    try:
+        loader = make_loader()
+        print(f"\n🔁 Renvoi des lots de {args.replay} vers {target_graph}...")
+        stats = loader.replay(args.replay)
+        print(f"\n    📊 {stats.triples} triplets renvoyés, {stats.failed_triples} encore en échec")
+        report_failures(loader)
+        # A reload that failed during the data never loaded the ontology
+        populate_ontology()
+        finish_reload(state['last_outbox_id'])
+    except BaseException:
+        # Still incomplete: keep holding the outbox for this graph
+        hold_reload()
+        raise
+
+if settings.SPARQL_BACKEND == 'rdflib':
+    print("ℹ️  SPARQL_BACKEND=rdflib: utilisez 'python manage.py build_rdf_snapshot'")
+    raise SystemExit(0)
+
 print("="*70)
 print("📤 POPULATION DE FUSEKI AVEC DONNÉES RICHES")
 print("="*70)
 
-# Clear existing data
-print("\n🗑️  Nettoyage des données existantes dans Fuseki...")
-clear_query = f"""
-PREFIX health: <{NAMESPACE}>
-DELETE WHERE {{ ?s ?p ?o }}
-"""
-try:
-    requests.post(FUSEKI_UPDATE, data={'update': clear_query}, headers={'Content-Type': 'application/x-www-form-urlencoded'})
-    print("    ✅ Données nettoyées")
-except:
-    print("    ⚠️  Nettoyage ignoré (première utilisation?)")
-
-# Populate Patients
-print("\n📤 Population des Patients...")
-for patient in Patient.objects.all():
-    triples = f"""
-        health:Patient_{patient.id} rdf:type health:Patient ;
-            health:nom "{escape_sparql_string(patient.nom)}" ;
-            health:prenom "{escape_sparql_string(patient.prenom)}" ;
-            health:email "{escape_sparql_string(patient.email)}" ;
-            health:dateNaissance "{patient.date_naissance}"^^xsd:date ;
-            health:sexe "{escape_sparql_string(patient.sexe)}" ;
-            health:numeroSecuriteSociale "{escape_sparql_string(patient.numero_securite_sociale)}" ;
-            health:groupeSanguin "{escape_sparql_string(patient.groupe_sanguin or '')}" ;
-            health:IMC "{float(patient.imc) if patient.imc else 0}"^^xsd:decimal .
-    """
-    if send_sparql_update(create_rdf_insert(triples)):
-        print(f"    ✅ {patient.prenom} {patient.nom}")
-    else:
-        print(f"    ❌ Échec: {patient.prenom} {patient.nom}")
-
-# Populate Médecins
-print("\n📤 Population des Médecins...")
-for medecin in Medecin.objects.all():
-    spec_class = {
-        'generaliste': 'Generaliste',
-        'cardiologue': 'Cardiologue',
-        'pneumologue': 'Pneumologue'
-    }.get(medecin.specialite, 'Medecin')
-    
-    triples = f"""
-        health:Medecin_{medecin.id} rdf:type health:{spec_class} ;
-            rdf:type health:Medecin ;
-            health:nom "{escape_sparql_string(medecin.nom)}" ;
-            health:prenom "{escape_sparql_string(medecin.prenom)}" ;
-            health:email "{escape_sparql_string(medecin.email)}" ;
-            health:dateNaissance "{medecin.date_naissance}"^^xsd:date ;
-            health:sexe "{escape_sparql_string(medecin.sexe)}" ;
-            health:numeroOrdre "{escape_sparql_string(medecin.numero_ordre)}" ;
-            health:specialite "{escape_sparql_string(medecin.specialite)}" ;
-            health:anneesExperience {medecin.annees_experience} .
-    """
-    if send_sparql_update(create_rdf_insert(triples)):
-        print(f"    ✅ Dr. {medecin.prenom} {medecin.nom} ({medecin.specialite}, {medecin.annees_experience} ans)")
-    else:
-        print(f"    ❌ Échec: Dr. {medecin.prenom} {medecin.nom}")
-
-# Populate Maladies
-print("\n📤 Population des Maladies...")
-for maladie in Maladie.objects.all():
-    type_class = {
-        'chronique': 'MaladieChronique',
-        'aigue': 'MaladieAigue',
-        'infectieuse': 'MaladieInfectieuse',
-        'cardiovasculaire': 'MaladieCardiovasculaire',
-        'respiratoire': 'MaladieRespiratoire'
-    }.get(maladie.type_maladie, 'Maladie')
-    
-    triples = f"""
-        health:Maladie_{maladie.id} rdf:type health:{type_class} ;
-            rdf:type health:Maladie ;
-            health:nomMaladie "{escape_sparql_string(maladie.nom_maladie)}" ;
-            health:codeCIM10 "{escape_sparql_string(maladie.code_cim10 or '')}" ;
-            health:gravite "{escape_sparql_string(maladie.gravite)}" ;
-            health:contagieuse {str(maladie.contagieuse).lower()} ;
-            health:tauxMortalite "{float(maladie.taux_mortalite)}"^^xsd:decimal .
-    """
-    if send_sparql_update(create_rdf_insert(triples)):
-        print(f"    ✅ {maladie.nom_maladie} ({type_class})")
-    else:
-        print(f"    ❌ Échec: {maladie.nom_maladie}")
-
-# Populate Impacts Environnementaux
-print("\n📤 Population des Impacts Environnementaux...")
-for impact in ImpactEnvironnemental.objects.all():
-    triples = f"""
-        health:Impact_{impact.id} rdf:type health:ImpactEnvironnemental ;
-            health:scoreCarbone "{float(impact.score_carbone)}"^^xsd:decimal ;
-            health:consommationEau "{float(impact.consommation_eau)}"^^xsd:decimal ;
-            health:dechets "{float(impact.dechets)}"^^xsd:decimal ;
-            health:recyclable {str(impact.recyclable).lower()} .
-    """
-    if send_sparql_update(create_rdf_insert(triples)):
-        print(f"    ✅ Impact {impact.id} (score: {impact.score_carbone} kg CO2)")
-    else:
-        print(f"    ❌ Échec: Impact {impact.id}")
-
-# Populate Traitements avec liens vers impacts et maladies
-print("\n📤 Population des Traitements...")
-for traitement in Traitement.objects.all():
-    type_class = {
-        'medicamenteux': 'TraitementMedicamenteux',
-        'chirurgie': 'Chirurgie',
-        'physiotherapie': 'Physiotherapie',
-        'radiotherapie': 'Radiotherapie',
-        'psychotherapie': 'Psychotherapie'
-    }.get(traitement.type_traitement, 'Traitement')
-    
-    triples = f"""
-        health:Traitement_{traitement.id} rdf:type health:{type_class} ;
-            rdf:type health:Traitement ;
-            health:nomTraitement "{escape_sparql_string(traitement.nom_traitement)}" ;
-            health:cout "{float(traitement.cout)}"^^xsd:decimal ;
-            health:duree {traitement.duree} ;
-            health:efficacite "{float(traitement.efficacite)}"^^xsd:decimal ;
-            health:traite health:Maladie_{traitement.maladie.id} .
-    """
-    
-    # Add impact relationship if exists
-    if traitement.impact_environnemental:
-        triples += f"""
-        health:Traitement_{traitement.id} health:aImpact health:Impact_{traitement.impact_environnemental.id} .
-        """
-    
-    if send_sparql_update(create_rdf_insert(triples)):
-        impact_info = f"impact: {traitement.impact_environnemental.score_carbone} kg" if traitement.impact_environnemental else "pas d'impact"
-        print(f"    ✅ {traitement.nom_traitement} ({impact_info})")
-    else:
-        print(f"    ❌ Échec: {traitement.nom_traitement}")
-
-# Populate Diagnostics (relationships)
-print("\n📤 Population des Relations Diagnostics...")
-for diagnostic in Diagnostic.objects.all():
-    triples = f"""
-        health:Patient_{diagnostic.patient.id} health:diagnostiquePour health:Maladie_{diagnostic.maladie.id} .
-    """
-    if send_sparql_update(create_rdf_insert(triples)):
-        print(f"    ✅ {diagnostic.patient.prenom} {diagnostic.patient.nom} → {diagnostic.maladie.nom_maladie}")
-    else:
-        print(f"    ❌ Échec: Diagnostic {diagnostic.id}")
-
-# Populate Prescriptions (medecin prescrit traitement)
-print("\n📤 Population des Relations Prescriptions...")
-for prescription in Prescription.objects.all():
-    medecin = prescription.diagnostic.medecin
-    traitement = prescription.traitement
-    triples = f"""
-        health:Medecin_{medecin.id} health:prescrit health:Traitement_{traitement.id} .
-    """
-    if send_sparql_update(create_rdf_insert(triples)):
-        print(f"    ✅ Dr. {medecin.nom} prescrit {traitement.nom_traitement}")
-    else:
-        print(f"    ❌ Échec: Prescription {prescription.id}")
+def full_reload():
+    """Build a new version graph while readers keep the current one, then switch"""
+    global target_graph
+    # Outbox changes made before this point are covered by the full reload;
+    # later ones are held by sync_fuseki and applied to the new graph
+    last_outbox_id = RdfOutbox.objects.order_by('-id').values_list('id', flat=True).first()
+    target_graph = new_version_graph(client)
+    begin_reload(target_graph, last_outbox_id)
+    try:
+        print(f"\n🆕 Nouvelle version: {target_graph}")
+
+        if args.mode == 'bulk':
+            populate_bulk()
+        elif populate_per_entity():
+            print("\n    ❌ Des entités ont échoué, le graphe courant reste inchangé")
+            raise SystemExit(1)
+        populate_ontology()
+
+        finish_reload(last_outbox_id)
+    except BaseException:
+        # Nothing to replay: the old graph stays current and the sync resumes on it
+        if not held:
+            end_reload()
+        raise
+
+if args.replay:
+    replay_failures()
+else:
+    full_reload()
 
 print("\n" + "="*70)
 print("✅ FUSEKI POPULÉ AVEC SUCCÈS!")
@@ -227,20 +298,18 @@ SELECT (COUNT(?t) as ?count) WHERE {
 """
 
 try:
-    response = requests.post(
-        'http://localhost:3030/health_env/sparql',
-        data={'query': test_query},
-        headers={'Accept': 'application/sparql-results+json'}
-    )
-    if response.status_code == 200:
-        result = response.json()
-        count = result['results']['bindings'][0]['count']['value']
-        print(f"    ✅ {count} traitements trouvés dans Fuseki")
-    else:
-        print(f"    ⚠️  Impossible de vérifier (status: {response.status_code})")
+    result = client.query(test_query, name='populate_fuseki_check', default_graph=get_current_graph(client))
+    count = result['results']['bindings'][0]['count']['value']
+    print(f"    ✅ {count} traitements trouvés dans Fuseki")
+except requests.HTTPError as e:
+    print(f"    ⚠️  Impossible de vérifier (status: {e.response.status_code})")
 except Exception as e:
     print(f"    ⚠️  Test ignoré: {e}")
 
+stats = client.stats()
+print(f"\n🔌 Connexions HTTP: {sum(p['connections_opened'] for p in stats['pools'])} ouvertes "
+      f"pour {stats['updates']} mises à jour, {stats['uploads']} envois et {stats['queries']} requêtes")
+
 print("\n🎯 Données optimisées pour démonstration SPARQL:")
 print("   • Hypertension: 5 traitements (scores 0.8 à 25.3)")
 print("   • Diabète: 3 traitements (scores 0.8 à 8.2)")